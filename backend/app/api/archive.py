@@ -0,0 +1,48 @@
+from fastapi import APIRouter, Depends, Query, Request, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import Session
+from app.database import get_db, session_factory_for
+from app.models.user import User
+from app.schemas.archive import ImportResponse
+from app.utils.dependencies import get_current_user
+from app.services.archive import ArchiveService
+
+router = APIRouter(prefix="/api", tags=["导出导入"])
+
+
+@router.get("/export")
+def export_conversations(
+    gzip: bool = Query(False, description="是否以gzip压缩输出"),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    流式导出当前用户的全部对话和消息（NDJSON）
+    
+    每行一个JSON记录：首行为export，之后每个对话一行conversation，紧跟其全部message。
+    消息通过服务端游标按批读取，导出任意规模的数据内存占用不变
+    """
+    session_factory = session_factory_for(db)
+    # 导出使用独立会话，认证用的连接立即归还
+    db.close()
+    filename = "aitalk-export.ndjson.gz" if gzip else "aitalk-export.ndjson"
+    return StreamingResponse(
+        ArchiveService.export_stream(session_factory, current_user.id, compress=gzip),
+        media_type="application/gzip" if gzip else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+
+@router.post("/import", response_model=ImportResponse, status_code=status.HTTP_201_CREATED)
+async def import_conversations(
+    request: Request,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    导入导出文件中的对话（作为当前用户的新对话）
+    
+    请求体为导出的NDJSON，可以是gzip压缩的；边接收边解析，消息按批插入。
+    任一行无效时不导入任何内容，返回400及出错的行号
+    """
+    return await ArchiveService.import_stream(db, current_user, request.stream())
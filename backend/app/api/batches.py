@@ -0,0 +1,90 @@
+from fastapi import APIRouter, Depends, HTTPException, status, Query
+from sqlalchemy.orm import Session
+from app.config import settings
+from app.database import get_db, session_factory_for
+from app.models.user import User
+from app.schemas.batch import BatchCreate, BatchItemResponse, BatchJobResponse
+from app.utils.dependencies import get_current_user
+from app.services.batch import BatchJob, BatchService, batch_registry
+
+router = APIRouter(prefix="/api/batches", tags=["批量提交"])
+
+
+def _job_response(job: BatchJob, include_items: bool) -> BatchJobResponse:
+    return BatchJobResponse(
+        id=job.id,
+        status=job.status,
+        total=len(job.items),
+        counts=job.counts(),
+        created_at=job.created_at,
+        finished_at=job.finished_at,
+        items=[BatchItemResponse.model_validate(item) for item in job.items] if include_items else None
+    )
+
+
+def _get_job(job_id: str, user: User) -> BatchJob:
+    job = batch_registry.get(job_id, user.id)
+    if job is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="批量任务不存在或已过期"
+        )
+    return job
+
+
+@router.post("", response_model=BatchJobResponse, status_code=status.HTTP_202_ACCEPTED)
+async def create_batch(
+    batch_data: BatchCreate,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    批量提交消息
+    
+    - **items**: 条目列表，每项包含 conversation_id 和 content
+    
+    立即返回任务句柄，条目在后台由有限个工作协程处理；
+    同一对话的条目按提交顺序依次执行，不同对话之间并行
+    """
+    if len(batch_data.items) > settings.BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"单个批量任务最多{settings.BATCH_MAX_ITEMS}条"
+        )
+    BatchService.check_conversations(db, current_user, {item.conversation_id for item in batch_data.items})
+    
+    job = BatchService.submit(
+        session_factory_for(db),
+        current_user.id,
+        [(item.conversation_id, item.content) for item in batch_data.items]
+    )
+    return _job_response(job, include_items=False)
+
+
+@router.get("/{job_id}", response_model=BatchJobResponse)
+def get_batch(
+    job_id: str,
+    include_items: bool = Query(True, description="是否返回每个条目的状态和结果"),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    查询批量任务进度
+    
+    返回各状态的条目数，以及每个条目的状态、消息ID和AI回复
+    """
+    return _job_response(_get_job(job_id, current_user), include_items)
+
+
+@router.post("/{job_id}/cancel", response_model=BatchJobResponse)
+async def cancel_batch(
+    job_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    取消批量任务
+    
+    未完成的条目标记为已取消，已完成条目保存的消息保留
+    """
+    job = _get_job(job_id, current_user)
+    job.cancel()
+    return _job_response(job, include_items=False)
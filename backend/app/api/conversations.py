@@ -1,11 +1,13 @@
-from fastapi import APIRouter, Depends, status, Query
+from fastapi import APIRouter, Depends, Header, status, Query
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 from app.database import get_db
 from app.models.user import User
 from app.schemas.conversation import ConversationCreate, ConversationUpdate, ConversationResponse
 from app.utils.dependencies import get_current_user
 from app.services.conversation import ConversationService
+from app.services.page_cache import page_cache
+from app.utils.serialization import APIResponse
 
 router = APIRouter(prefix="/api/conversations", tags=["对话管理"])
 
@@ -14,18 +16,35 @@ router = APIRouter(prefix="/api/conversations", tags=["对话管理"])
 def get_conversations(
     skip: int = Query(0, ge=0, description="跳过的记录数"),
     limit: int = Query(20, ge=1, le=100, description="返回的记录数"),
+    cursor: Optional[str] = Query(None, description="分页游标（取自X-Next-Cursor或X-Prev-Cursor响应头）"),
+    if_none_match: Optional[str] = Header(None, alias="If-None-Match"),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """
     获取当前用户的对话列表
     
-    支持分页，按更新时间倒序排列
+    按更新时间倒序排列。不跳过记录时使用游标分页，
+    响应头X-Next-Cursor / X-Prev-Cursor给出后一页和前一页的游标；
+    仍支持skip跳过记录。
+    响应带ETag，携带If-None-Match轮询且列表未变化时返回304
     """
-    conversations = ConversationService.get_user_conversations(
-        db, current_user, skip, limit
-    )
-    return conversations
+    def render():
+        headers = {}
+        if skip and cursor is None:
+            conversations = ConversationService.get_user_conversations(
+                db, current_user, skip, limit
+            )
+        else:
+            page = ConversationService.get_user_conversations_page(db, current_user, limit, cursor)
+            conversations = page.items
+            headers = page.headers()
+        content = [ConversationResponse.model_validate(conv).model_dump(mode="json") for conv in conversations]
+        return APIResponse(content, headers=headers), headers
+    
+    version = ConversationService.get_conversations_version(db, current_user)
+    key = (current_user.id, "conversations", version, skip, limit, cursor)
+    return page_cache.respond(key, if_none_match, render)
 
 
 @router.post("", response_model=ConversationResponse, status_code=status.HTTP_201_CREATED)
@@ -1,38 +1,67 @@
-from fastapi import APIRouter, Depends, status, Query
+from fastapi import APIRouter, Depends, Header, HTTPException, status, Query
 from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import func
-from typing import List
-import json
-import asyncio
+from typing import List, Optional
 from app.database import get_db
 from app.models.user import User
-from app.models.message import Message, MessageRole
-from app.schemas.message import MessageCreate, MessageResponse
+from app.schemas.message import MessageCreate, MessageResponse, dump_messages
 from app.utils.dependencies import get_current_user
+from app.utils.serialization import APIResponse
+from app.utils.sse import sse_event
 from app.services.conversation import ConversationService
-from app.services.ai import AIService
+from app.services.generation import GenerationService
+from app.services.page_cache import page_cache
+from app.services.stream_registry import stream_registry
 
 router = APIRouter(prefix="/api/conversations/{conversation_id}/messages", tags=["消息交互"])
 
+SSE_HEADERS = {
+    "Cache-Control": "no-cache, no-store, must-revalidate",
+    "Connection": "keep-alive",
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Headers": "*",
+    "X-Accel-Buffering": "no",  # 禁用 Nginx 缓冲
+    "Content-Type": "text/event-stream; charset=utf-8",
+}
+
 
 @router.get("", response_model=List[MessageResponse])
 def get_messages(
     conversation_id: int,
     skip: int = Query(0, ge=0, description="跳过的记录数"),
     limit: int = Query(100, ge=1, le=500, description="返回的记录数"),
+    cursor: Optional[str] = Query(None, description="分页游标（取自X-Next-Cursor或X-Prev-Cursor响应头）"),
+    if_none_match: Optional[str] = Header(None, alias="If-None-Match"),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """
     获取对话中的消息列表
     
-    按时间顺序排列，支持分页
+    按时间顺序排列。不跳过记录时使用游标分页，
+    响应头X-Next-Cursor / X-Prev-Cursor给出后一页和前一页的游标；
+    仍支持skip跳过记录。
+    响应带ETag，携带If-None-Match轮询且消息未变化时返回304
     """
-    messages = ConversationService.get_conversation_messages(
-        db, current_user, conversation_id, skip, limit
-    )
-    return messages
+    def render():
+        if skip and cursor is None:
+            messages = ConversationService.get_conversation_messages(
+                db, current_user, conversation_id, skip, limit
+            )
+            # 大页列表跳过响应模型的逐条校验，直接编码
+            return APIResponse(dump_messages(messages)), {}
+        
+        page = ConversationService.get_conversation_messages_page(
+            db, current_user, conversation_id, limit, cursor
+        )
+        headers = page.headers()
+        return APIResponse(dump_messages(page.items), headers=headers), headers
+    
+    version = ConversationService.get_messages_version(db, current_user, conversation_id)
+    key = None
+    if version is not None:
+        key = (current_user.id, "messages", conversation_id, version, skip, limit, cursor)
+    return page_cache.respond(key, if_none_match, render)
 
 
 @router.post("", response_model=List[MessageResponse], status_code=status.HTTP_201_CREATED)
@@ -59,6 +88,7 @@ async def send_message(
 async def send_message_stream(
     conversation_id: int,
     message_data: MessageCreate,
+    flush_ms: Optional[int] = Query(None, ge=0, description="分块合并的刷新间隔（毫秒），0表示逐块发送"),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -66,108 +96,78 @@ async def send_message_stream(
     发送消息并获取AI流式回复
     
     - **content**: 消息内容
+    - **flush_ms**: 可选，上游细碎分块合并后再发送的最长间隔
     
     返回服务器发送事件(SSE)流
     """
     try:
-        # 验证对话所有权
-        conversation = ConversationService.get_conversation(db, current_user, conversation_id)
-        
-        # 创建用户消息
-        user_message = Message(
-            conversation_id=conversation_id,
-            role=MessageRole.USER,
-            content=message_data.content
-        )
-        db.add(user_message)
-        db.commit()
-        db.refresh(user_message)
-        
-        # 获取对话历史（在用户消息保存之前）
-        history = db.query(Message).filter(
-            Message.conversation_id == conversation_id
-        ).order_by(Message.created_at).all()
-        
-        async def generate_stream():
-            try:
-                # 首先发送用户消息
-                yield f"data: {json.dumps({'type': 'user_message', 'message': {'id': user_message.id, 'content': user_message.content, 'role': 'user'}}, ensure_ascii=False)}\n\n"
-                await asyncio.sleep(0)  # 强制刷新
-                
-                # 发送AI回复开始标记
-                yield f"data: {json.dumps({'type': 'ai_start'}, ensure_ascii=False)}\n\n"
-                await asyncio.sleep(0)  # 强制刷新
-                
-                # 收集AI回复内容
-                ai_content = ""
-                try:
-                    async for chunk in AIService.get_ai_response_stream(message_data.content, history):
-                        if chunk:  # 确保chunk不为空
-                            ai_content += chunk
-                            yield f"data: {json.dumps({'type': 'ai_chunk', 'content': chunk}, ensure_ascii=False)}\n\n"
-                            await asyncio.sleep(0)  # 强制刷新，确保立即发送
-                except Exception as ai_error:
-                    error_msg = f"AI服务错误: {str(ai_error)}"
-                    ai_content = error_msg
-                    yield f"data: {json.dumps({'type': 'ai_chunk', 'content': error_msg}, ensure_ascii=False)}\n\n"
-                    await asyncio.sleep(0)  # 强制刷新
-                
-                # 保存AI回复消息
-                try:
-                    ai_message = Message(
-                        conversation_id=conversation_id,
-                        role=MessageRole.ASSISTANT,
-                        content=ai_content or "抱歉，AI服务暂时不可用。"
-                    )
-                    db.add(ai_message)
-                    
-                    # 更新对话时间和标题
-                    conversation.updated_at = func.now()
-                    if len(history) == 1 and conversation.title == "新对话":  # history包含了刚添加的用户消息
-                        conversation.title = message_data.content[:50] + ("..." if len(message_data.content) > 50 else "")
-                    
-                    db.commit()
-                    db.refresh(ai_message)
-                    
-                    # 发送AI回复完成标记
-                    yield f"data: {json.dumps({'type': 'ai_complete', 'message': {'id': ai_message.id, 'content': ai_content, 'role': 'assistant'}}, ensure_ascii=False)}\n\n"
-                    
-                except Exception as db_error:
-                    yield f"data: {json.dumps({'type': 'error', 'message': f'数据库错误: {str(db_error)}'}, ensure_ascii=False)}\n\n"
-                
-                # 发送结束标记
-                yield f"data: {json.dumps({'type': 'done'}, ensure_ascii=False)}\n\n"
-                
-            except Exception as stream_error:
-                yield f"data: {json.dumps({'type': 'error', 'message': f'流式处理错误: {str(stream_error)}'}, ensure_ascii=False)}\n\n"
+        # 在后台任务中生成回复，断线后可凭Last-Event-ID续传
+        stream = GenerationService.begin(db, current_user, conversation_id, message_data.content, flush_ms)
         
         return StreamingResponse(
-            generate_stream(),
+            stream.subscribe(),
             media_type="text/event-stream",
-            headers={
-                "Cache-Control": "no-cache, no-store, must-revalidate",
-                "Connection": "keep-alive",
-                "Access-Control-Allow-Origin": "*",
-                "Access-Control-Allow-Headers": "*",
-                "X-Accel-Buffering": "no",  # 禁用 Nginx 缓冲
-                "Content-Type": "text/event-stream; charset=utf-8",
-            }
+            headers={**SSE_HEADERS, "X-Stream-ID": stream.id}
         )
-        
+    
     except Exception as e:
         # 如果在设置阶段出错，返回错误响应
         async def error_stream():
-            yield f"data: {json.dumps({'type': 'error', 'message': f'服务器错误: {str(e)}'}, ensure_ascii=False)}\n\n"
+            yield sse_event({'type': 'error', 'message': f'服务器错误: {str(e)}'})
         
         return StreamingResponse(
             error_stream(),
             media_type="text/event-stream",
-            headers={
-                "Cache-Control": "no-cache, no-store, must-revalidate",
-                "Connection": "keep-alive",
-                "Access-Control-Allow-Origin": "*",
-                "Access-Control-Allow-Headers": "*",
-                "X-Accel-Buffering": "no",  # 禁用 Nginx 缓冲
-                "Content-Type": "text/event-stream; charset=utf-8",
-            }
-        ) 
\ No newline at end of file
+            headers=SSE_HEADERS
+        )
+
+
+@router.get("/stream/{stream_id}", status_code=status.HTTP_200_OK)
+async def resume_message_stream(
+    conversation_id: int,
+    stream_id: str,
+    last_event_id: Optional[int] = Header(None, alias="Last-Event-ID", description="最后收到的事件ID"),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    断线重连，续传AI流式回复
+    
+    从Last-Event-ID之后的事件开始重放缓冲中的事件，生成未结束时继续接收新事件
+    """
+    stream = stream_registry.get(stream_id, current_user.id)
+    if stream is None or stream.conversation_id != conversation_id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="流不存在或已过期"
+        )
+    
+    stream_registry.resumed += 1
+    # 认证查询所用的请求会话在续传期间不再占用连接
+    db.close()
+    return StreamingResponse(
+        stream.subscribe(last_event_id or 0),
+        media_type="text/event-stream",
+        headers={**SSE_HEADERS, "X-Stream-ID": stream.id}
+    )
+
+
+@router.post("/stream/{stream_id}/stop", status_code=status.HTTP_200_OK)
+async def stop_message_stream(
+    conversation_id: int,
+    stream_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    停止正在进行的AI回复生成
+    
+    已生成的部分会保存为截断状态的AI消息
+    """
+    stream = stream_registry.get(stream_id, current_user.id)
+    if stream is None or stream.conversation_id != conversation_id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="流不存在或已过期"
+        )
+    
+    return {"stream_id": stream.id, "stopped": stream.cancel("stop")}
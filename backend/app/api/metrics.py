@@ -0,0 +1,43 @@
+from fastapi import APIRouter, Depends
+from app.database import pool_stats
+from app.models.user import User
+from app.services.ai import AIService
+from app.services.batch import batch_registry
+from app.services.cache import response_cache
+from app.services.generation import generation_stats
+from app.services.limiter import ai_limiter
+from app.services.page_cache import page_cache
+from app.services.resilience import circuit_breaker, hedger
+from app.services.search import search_index
+from app.services.semantic_cache import semantic_cache
+from app.services.singleflight import singleflight
+from app.services.stream_registry import stream_registry
+from app.utils.dependencies import get_current_user
+from app.utils.sse import sse_stats
+
+router = APIRouter(prefix="/api/metrics", tags=["运行指标"])
+
+
+@router.get("")
+def get_metrics(current_user: User = Depends(get_current_user)):
+    """
+    获取运行指标
+    
+    用于监控缓存命中率等性能数据，需要登录
+    """
+    return {
+        "response_cache": response_cache.stats(),
+        "semantic_cache": semantic_cache.stats() if semantic_cache is not None else None,
+        "singleflight": singleflight.stats(),
+        "upstream_limiter": ai_limiter.stats(),
+        "hedging": hedger.stats(),
+        "circuit_breaker": circuit_breaker.stats(),
+        "backends": AIService.backend_stats(),
+        "sse": sse_stats.stats(),
+        "streams": stream_registry.stats(),
+        "generation": generation_stats.stats(),
+        "batches": batch_registry.stats(),
+        "db_pool": pool_stats(),
+        "page_cache": page_cache.stats(),
+        "search_index": search_index.stats()
+    }
@@ -0,0 +1,31 @@
+from fastapi import APIRouter, Depends, Query, Response
+from sqlalchemy.orm import Session
+from typing import List, Optional
+from app.database import get_db
+from app.models.user import User
+from app.schemas.search import SearchHit
+from app.utils.dependencies import get_current_user
+from app.services.search import SearchService
+
+router = APIRouter(prefix="/api/search", tags=["消息检索"])
+
+
+@router.get("", response_model=List[SearchHit])
+def search_messages(
+    response: Response,
+    q: str = Query(..., min_length=1, max_length=200, description="检索词，多个词以空格分隔，须全部出现"),
+    conversation_id: Optional[int] = Query(None, description="只检索指定对话"),
+    limit: int = Query(20, ge=1, le=100, description="返回的记录数"),
+    cursor: Optional[str] = Query(None, description="分页游标（取自X-Next-Cursor响应头）"),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    全文检索当前用户的消息
+    
+    按相关度排序，返回消息所在的对话、片段和片段中的命中位置；
+    响应头X-Next-Cursor给出下一页的游标
+    """
+    page = SearchService.search(db, current_user, q, limit, cursor, conversation_id)
+    response.headers.update(page.headers())
+    return page.items
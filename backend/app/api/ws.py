@@ -0,0 +1,231 @@
+import asyncio
+from typing import Dict, Optional, Union
+from fastapi import APIRouter, Depends, HTTPException, Query, WebSocket
+from pydantic import ValidationError
+from sqlalchemy.orm import Session
+from starlette.websockets import WebSocketDisconnect
+from app.config import settings
+from app.database import get_db
+from app.models.user import User
+from app.schemas.message import MessageCreate
+from app.services.generation import GenerationService
+from app.services.stream_registry import StreamSession, stream_registry
+from app.utils.dependencies import user_from_token
+from app.utils.serialization import dumps_json, dumps_msgpack, loads_json, msgpack
+
+router = APIRouter(prefix="/api", tags=["WebSocket对话"])
+
+# 认证失败时的关闭码（4000-4999为应用自定义）
+WS_CLOSE_UNAUTHORIZED = 4401
+
+
+class ProtocolError(Exception):
+    """客户端消息格式错误"""
+
+
+class ChatConnection:
+    """
+    一个已认证的WebSocket连接
+    
+    多个对话的事件流复用同一连接，每个事件带上stream_id和conversation_id；
+    所有发送经由一个有界队列和单个写协程，客户端读取过慢时对转发形成反压
+    """
+    
+    def __init__(self, websocket: WebSocket, db: Session, user: User, binary: bool):
+        self.websocket = websocket
+        self.db = db
+        self.user = user
+        self.binary = binary
+        self.outbox: asyncio.Queue = asyncio.Queue(maxsize=settings.WS_SEND_QUEUE_SIZE)
+        self.forwarders: Dict[str, asyncio.Task] = {}
+    
+    def _encode(self, payload: dict) -> Union[str, bytes]:
+        if self.binary:
+            return dumps_msgpack(payload)
+        return dumps_json(payload).decode("utf-8")
+    
+    def _event_frame(self, stream: StreamSession, event_id: Optional[int], data: str) -> Union[str, bytes]:
+        if self.binary:
+            return dumps_msgpack({
+                "stream_id": stream.id,
+                "conversation_id": stream.conversation_id,
+                "id": event_id,
+                "event": loads_json(data)
+            })
+        # 事件在缓冲中已是编码好的JSON，直接拼接，不重复编码
+        return (
+            f'{{"stream_id":"{stream.id}","conversation_id":{stream.conversation_id},'
+            f'"id":{"null" if event_id is None else event_id},"event":{data}}}'
+        )
+    
+    async def send(self, payload: dict) -> None:
+        await self.outbox.put(self._encode(payload))
+    
+    async def writer(self) -> None:
+        while True:
+            frame = await self.outbox.get()
+            if isinstance(frame, bytes):
+                await self.websocket.send_bytes(frame)
+            else:
+                await self.websocket.send_text(frame)
+    
+    async def _forward(self, stream: StreamSession, last_event_id: int) -> None:
+        events = stream.listen(last_event_id)
+        try:
+            async for event_id, data in events:
+                await self.outbox.put(self._event_frame(stream, event_id, data))
+        finally:
+            await events.aclose()
+            if self.forwarders.get(stream.id) is asyncio.current_task():
+                del self.forwarders[stream.id]
+    
+    def _subscribe(self, stream: StreamSession, last_event_id: int) -> None:
+        previous = self.forwarders.get(stream.id)
+        if previous is not None:
+            previous.cancel()
+        self.forwarders[stream.id] = asyncio.create_task(self._forward(stream, last_event_id))
+    
+    def _get_stream(self, payload: dict) -> StreamSession:
+        stream = stream_registry.get(str(payload.get("stream_id")), self.user.id)
+        if stream is None:
+            raise HTTPException(status_code=404, detail="流不存在或已过期")
+        return stream
+    
+    async def handle(self, payload: dict) -> None:
+        """处理一条客户端消息：send / resume / stop / ping"""
+        message_type = payload.get("type")
+        request_id = payload.get("request_id")
+        try:
+            if message_type == "send":
+                if len(self.forwarders) >= settings.WS_MAX_STREAMS:
+                    raise ProtocolError(f"单个连接最多同时进行{settings.WS_MAX_STREAMS}个流")
+                try:
+                    conversation_id = int(payload["conversation_id"])
+                    message_data = MessageCreate(content=payload.get("content"))
+                    flush_ms = payload.get("flush_ms")
+                    flush_ms = None if flush_ms is None else max(0, int(flush_ms))
+                except (KeyError, TypeError, ValueError, ValidationError):
+                    raise ProtocolError("send需要conversation_id和非空的content")
+                stream = GenerationService.begin(self.db, self.user, conversation_id, message_data.content, flush_ms)
+                await self.send({
+                    "type": "accepted",
+                    "request_id": request_id,
+                    "stream_id": stream.id,
+                    "conversation_id": conversation_id
+                })
+                self._subscribe(stream, 0)
+            
+            elif message_type == "resume":
+                stream = self._get_stream(payload)
+                self._subscribe(stream, int(payload.get("last_event_id") or 0))
+            
+            elif message_type == "stop":
+                stream = self._get_stream(payload)
+                await self.send({
+                    "type": "stopped",
+                    "request_id": request_id,
+                    "stream_id": stream.id,
+                    "stopped": stream.cancel("stop")
+                })
+            
+            elif message_type == "ping":
+                await self.send({"type": "pong", "request_id": request_id})
+            
+            else:
+                raise ProtocolError(f"未知的消息类型: {message_type}")
+        
+        except (ProtocolError, ValueError) as e:
+            await self.send({"type": "error", "request_id": request_id, "message": str(e)})
+        except HTTPException as e:
+            await self.send({"type": "error", "request_id": request_id, "status": e.status_code, "message": e.detail})
+    
+    async def close(self) -> None:
+        """连接断开：停止转发（各流按断线宽限期处理），结束写协程"""
+        tasks = list(self.forwarders.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def _receive_payload(websocket: WebSocket) -> Optional[dict]:
+    """读取一条JSON文本或msgpack二进制消息，连接断开时返回None"""
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        return None
+    try:
+        if message.get("bytes") is not None:
+            if msgpack is None:
+                raise ProtocolError("服务端未启用msgpack")
+            payload = msgpack.unpackb(message["bytes"])
+        else:
+            payload = loads_json(message.get("text") or "")
+    except ProtocolError:
+        raise
+    except Exception:
+        raise ProtocolError("消息必须是JSON对象或msgpack映射")
+    if not isinstance(payload, dict):
+        raise ProtocolError("消息必须是JSON对象或msgpack映射")
+    return payload
+
+
+@router.websocket("/ws")
+async def chat_socket(
+    websocket: WebSocket,
+    token: Optional[str] = Query(None, description="访问令牌，也可在连接后发送auth消息"),
+    encoding: str = Query("json", description="json（文本帧）或msgpack（二进制帧）"),
+    db: Session = Depends(get_db)
+):
+    """
+    WebSocket对话
+    
+    连接时认证一次，之后在同一连接上收发多个对话的消息：
+    - **send**: {"type": "send", "conversation_id", "content", "flush_ms"?, "request_id"?}
+    - **resume**: {"type": "resume", "stream_id", "last_event_id"}
+    - **stop**: {"type": "stop", "stream_id"}
+    - **ping**: {"type": "ping"}
+    
+    流事件格式为 {"stream_id", "conversation_id", "id", "event"}，event与SSE的data相同
+    """
+    await websocket.accept()
+    binary = encoding == "msgpack"
+    if binary and msgpack is None:
+        await websocket.send_text(dumps_json({"type": "error", "message": "服务端未启用msgpack"}).decode("utf-8"))
+        await websocket.close(code=1003)
+        return
+    
+    # 未在查询参数中携带令牌时，等待第一条auth消息
+    try:
+        if token is None:
+            payload = await asyncio.wait_for(_receive_payload(websocket), timeout=settings.WS_AUTH_TIMEOUT)
+            if payload is None:
+                return
+            if payload.get("type") == "auth":
+                token = payload.get("token")
+    except (asyncio.TimeoutError, ProtocolError):
+        pass
+    user = user_from_token(db, token) if token else None
+    # 认证完成后归还连接，之后只在处理send时短暂占用
+    db.close()
+    if user is None or not user.is_active:
+        await websocket.close(code=WS_CLOSE_UNAUTHORIZED)
+        return
+    
+    connection = ChatConnection(websocket, db, user, binary)
+    writer = asyncio.create_task(connection.writer())
+    await connection.send({"type": "ready", "user_id": user.id})
+    try:
+        while not writer.done():
+            try:
+                payload = await _receive_payload(websocket)
+            except ProtocolError as e:
+                await connection.send({"type": "error", "message": str(e)})
+                continue
+            if payload is None:
+                break
+            await connection.handle(payload)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        await connection.close()
+        writer.cancel()
+        await asyncio.gather(writer, return_exceptions=True)
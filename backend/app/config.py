@@ -1,13 +1,27 @@
+from pydantic import BaseModel
 from pydantic_settings import BaseSettings
-from typing import Optional
+from typing import List, Optional
 import os
 from dotenv import load_dotenv
 
 load_dotenv()
 
+
+class BackendConfig(BaseModel):
+    """一个OpenAI兼容的上游端点"""
+    name: Optional[str] = None
+    base_url: str
+    api_key: Optional[str] = None
+    model: str
+    weight: float = 1.0
+
+
 class Settings(BaseSettings):
     # 数据库配置
     DATABASE_URL: str = os.getenv("DATABASE_URL")
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_TIMEOUT: float = 30.0
     
     # JWT配置
     SECRET_KEY: str = os.getenv("SECRET_KEY")
@@ -19,11 +33,141 @@ class Settings(BaseSettings):
     QWEN_BASE_URL: str = "https://dashscope.aliyuncs.com/compatible-mode/v1"
     QWEN_MODEL: str = "qwen-plus"
     
+    # 多上游端点（JSON列表，如[{"base_url": "...", "api_key": "...", "model": "...", "weight": 1}]），
+    # 为空时使用上面的单个端点
+    QWEN_BACKENDS: List[BackendConfig] = []
+    
+    # AI客户端连接池配置（进程内共享，由应用生命周期管理）
+    QWEN_MAX_CONNECTIONS: int = 100
+    QWEN_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    QWEN_KEEPALIVE_EXPIRY: float = 60.0
+    QWEN_CONNECT_TIMEOUT: float = 10.0
+    QWEN_TIMEOUT: float = 120.0
+    
+    # 上下文构建配置（按token预算从新到旧填充历史消息）
+    AI_SYSTEM_PROMPT: str = "你是一个有用的AI助手。"
+    AI_CONTEXT_TOKEN_BUDGET: int = 4000
+    AI_MESSAGE_TOKEN_OVERHEAD: int = 4
+    
+    # 滚动摘要配置（未摘要部分超过阈值时，将较早的消息折叠进摘要）
+    AI_SUMMARY_ENABLED: bool = True
+    AI_SUMMARY_TRIGGER_TOKENS: int = 3000
+    AI_SUMMARY_KEEP_TOKENS: int = 1500
+    AI_SUMMARY_MAX_TOKENS: int = 500
+    AI_SUMMARY_TURN_CHARS: int = 2000
+    
+    # AI回复精确匹配缓存配置
+    AI_CACHE_ENABLED: bool = True
+    AI_CACHE_MAX_SIZE: int = 1000
+    AI_CACHE_TTL: float = 3600.0
+    AI_CACHE_REPLAY_CHUNK_CHARS: int = 20
+    
+    # 首轮问题语义缓存配置（需要numpy）
+    AI_SEMANTIC_CACHE_ENABLED: bool = False
+    AI_SEMANTIC_CACHE_THRESHOLD: float = 0.85
+    AI_SEMANTIC_CACHE_MAX_ENTRIES: int = 100000
+    AI_SEMANTIC_CACHE_DIM: int = 256
+    
+    # 相同提示的并发上游请求合并
+    AI_SINGLEFLIGHT_ENABLED: bool = True
+    
+    # 上游自适应并发限制（AIMD）
+    AI_LIMITER_INITIAL: int = 20
+    AI_LIMITER_MIN: int = 2
+    AI_LIMITER_MAX: int = 200
+    AI_LIMITER_BACKOFF: float = 0.7
+    AI_LIMITER_LATENCY_TOLERANCE: float = 2.0
+    AI_LIMITER_QUEUE_TIMEOUT: float = 30.0
+    
+    # 对冲请求（首token超过最近TTFT的指定分位数仍未到达时发起第二次尝试）
+    AI_HEDGE_ENABLED: bool = False
+    AI_HEDGE_PERCENTILE: float = 95.0
+    AI_HEDGE_MIN_SAMPLES: int = 20
+    AI_HEDGE_MIN_DELAY: float = 0.5
+    
+    # 熔断器（连续失败次数阈值、打开后的冷却秒数）
+    AI_BREAKER_FAILURE_THRESHOLD: int = 5
+    AI_BREAKER_RESET_TIMEOUT: float = 30.0
+    
+    # 多端点路由（按首token延迟和错误率的滑动估计选择端点，异常端点暂时摘除）
+    AI_ROUTER_EWMA_ALPHA: float = 0.2
+    AI_ROUTER_EJECT_FAILURES: int = 3
+    AI_ROUTER_EJECT_ERROR_RATE: float = 0.5
+    AI_ROUTER_EJECT_SECONDS: float = 30.0
+    AI_ROUTER_MAX_EJECT_SECONDS: float = 300.0
+    
+    # SSE分块合并（缓冲达到字节阈值或刷新间隔时输出一帧，客户端可通过flush_ms协商间隔）
+    SSE_FLUSH_INTERVAL_MS: int = 20
+    SSE_MAX_FLUSH_INTERVAL_MS: int = 1000
+    SSE_FLUSH_BYTES: int = 1024
+    
+    # 可恢复的SSE流（事件保存在环形缓冲中，断线重连凭Last-Event-ID续传；完成后按TTL过期）
+    SSE_REPLAY_MAX_EVENTS: int = 2000
+    SSE_REPLAY_MAX_BYTES: int = 1024 * 1024
+    SSE_REPLAY_TOTAL_MAX_BYTES: int = 64 * 1024 * 1024
+    SSE_REPLAY_TTL: float = 300.0
+    
+    # 流式回复检查点（生成中的AI消息每累计指定token数或间隔秒数追加写入一次数据库）
+    AI_CHECKPOINT_TOKENS: int = 200
+    AI_CHECKPOINT_INTERVAL: float = 2.0
+    
+    # 客户端全部断开后等待重连的宽限秒数，超时则取消上游生成（0表示立即取消）
+    SSE_DISCONNECT_GRACE: float = 15.0
+    
+    # WebSocket对话（认证超时、单个连接同时进行的流数、发送队列长度）
+    WS_AUTH_TIMEOUT: float = 10.0
+    WS_MAX_STREAMS: int = 8
+    WS_SEND_QUEUE_SIZE: int = 256
+    
+    # 批量提交（进程内所有任务共享的并发数、单个任务的最大条目数、熔断时的重试次数、完成后保留秒数）
+    BATCH_CONCURRENCY: int = 8
+    BATCH_MAX_ITEMS: int = 1000
+    BATCH_ITEM_RETRIES: int = 2
+    BATCH_JOB_TTL: float = 3600.0
+    
+    # 单进程运行（批量任务、可恢复流和上游并发名额保存在进程内存中，多个worker之间不共享；
+    # 启动时对该文件加排他锁，同一部署的第二个进程拒绝启动，留空不检查）
+    SINGLE_PROCESS_LOCK_FILE: str = ".aitalk.lock"
+    
+    # 消息内容压缩（zlib或zstd，留空不压缩；UTF-8字节数达到阈值的内容压缩后存储，
+    # 读取时按前缀标记解码，压缩前写入的行照常读取。MySQL全文索引建在单独的原文列search_text上，不受压缩影响）
+    MESSAGE_COMPRESSION: str = ""
+    MESSAGE_COMPRESSION_MIN_BYTES: int = 1024
+    
+    # 消息全文检索（MySQL使用ngram全文索引，其他数据库使用进程内倒排索引；
+    # 结果片段的字符数、进程内索引最多保留的用户数）
+    SEARCH_SNIPPET_CHARS: int = 120
+    SEARCH_INDEX_MAX_USERS: int = 64
+    
+    # 导出/导入（导出时服务端游标每批读取的行数、导入时每批插入的行数、导入时单行的最大字节数）
+    EXPORT_YIELD_PER: int = 1000
+    IMPORT_BATCH_SIZE: int = 2000
+    IMPORT_MAX_LINE_BYTES: int = 8 * 1024 * 1024
+    
+    # 列表接口的条件请求（ETag）与序列化响应缓存（按总字节数限制容量，0表示只校验ETag不缓存）
+    PAGE_CACHE_MAX_BYTES: int = 32 * 1024 * 1024
+    
+    # 流式回复缓冲队列长度（客户端读取过慢时对上游形成反压）
+    AI_STREAM_QUEUE_SIZE: int = 64
+    
     # 应用配置
     APP_NAME: str = "AI Talk"
     APP_VERSION: str = "1.0.0"
     DEBUG: bool = True
     
+    def ai_backends(self) -> List[BackendConfig]:
+        """实际使用的上游端点列表"""
+        if self.QWEN_BACKENDS:
+            return self.QWEN_BACKENDS
+        if not self.DASHSCOPE_API_KEY:
+            return []
+        return [BackendConfig(
+            name="default",
+            base_url=self.QWEN_BASE_URL,
+            api_key=self.DASHSCOPE_API_KEY,
+            model=self.QWEN_MODEL
+        )]
+    
     class Config:
         env_file = ".env"
         env_file_encoding = "utf-8"
@@ -1,14 +1,78 @@
-from sqlalchemy import create_engine
+import time
+from collections import deque
+from typing import List
+from sqlalchemy import create_engine, inspect, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
 from app.config import settings
 
+
+class TimedQueuePool(QueuePool):
+    """记录每次从连接池取出连接的等待时间（池满时等待其他请求归还连接）"""
+    
+    WINDOW = 1000
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait = 0.0
+        self.timeouts = 0
+        self._recent_waits: deque = deque(maxlen=self.WINDOW)
+    
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except Exception:
+            self.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - started
+            self.checkouts += 1
+            self.wait_seconds += waited
+            self.max_wait = max(self.max_wait, waited)
+            self._recent_waits.append(waited)
+    
+    def recreate(self):
+        # dispose()后引擎会重建连接池，保留累计统计
+        pool = super().recreate()
+        pool.checkouts, pool.wait_seconds, pool.max_wait, pool.timeouts = (
+            self.checkouts, self.wait_seconds, self.max_wait, self.timeouts
+        )
+        pool._recent_waits = self._recent_waits
+        return pool
+    
+    def stats(self) -> dict:
+        ordered = sorted(self._recent_waits)
+        
+        def percentile(p: float) -> float:
+            if not ordered:
+                return 0.0
+            return round(ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))] * 1000, 2)
+        
+        return {
+            "size": self.size(),
+            "checked_out": self.checkedout(),
+            "overflow": max(0, self.overflow()),
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "avg_wait_ms": round(self.wait_seconds / self.checkouts * 1000, 2) if self.checkouts else 0.0,
+            "p95_wait_ms": percentile(95),
+            "p99_wait_ms": percentile(99),
+            "max_wait_ms": round(self.max_wait * 1000, 2)
+        }
+
+
 # 创建数据库引擎
 engine = create_engine(
     settings.DATABASE_URL,
+    poolclass=TimedQueuePool,
     pool_pre_ping=True,
-    pool_size=10,
-    max_overflow=20
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_timeout=settings.DB_POOL_TIMEOUT
 )
 
 # 创建会话工厂
@@ -17,10 +81,84 @@ SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 # 创建基类
 Base = declarative_base()
 
+def session_factory_for(db):
+    """创建与给定会话绑定同一引擎的会话工厂（供请求之外的后台任务使用）"""
+    return sessionmaker(autocommit=False, autoflush=False, bind=db.get_bind())
+
+def pool_stats() -> dict:
+    """连接池占用与取连接等待时间"""
+    return engine.pool.stats()
+
 # 依赖项：获取数据库会话
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close() 
\ No newline at end of file
+        db.close()
+
+
+# 已被替换、升级时删除的索引（表名 -> 索引名）
+OBSOLETE_INDEXES = {
+    # 全文索引改建在原文列search_text上（content列压缩后是base64载荷）
+    "messages": ["ix_messages_content_fulltext"],
+}
+
+
+def pending_schema_changes(bind=None) -> List[str]:
+    """
+    已有表相对模型缺少的列、索引和待删除的索引（只读取表结构，不执行DDL）
+    
+    返回 "+ 表.列"、"+ 表.索引"、"- 表.索引" 形式的列表
+    """
+    bind = bind if bind is not None else engine
+    inspector = inspect(bind)
+    changes = []
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        changes += [f"+ {table.name}.{column.name}" for column in table.columns if column.name not in existing]
+        existing_indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            # 只对特定数据库创建的索引（如MySQL全文索引）
+            if index._ddl_if is not None and index._ddl_if.dialect not in (None, bind.dialect.name):
+                continue
+            if index.name not in existing_indexes:
+                changes.append(f"+ {table.name}.{index.name}")
+        changes += [f"- {table.name}.{name}" for name in OBSOLETE_INDEXES.get(table.name, []) if name in existing_indexes]
+    return changes
+
+
+def upgrade_schema(bind=None) -> List[str]:
+    """
+    为已存在的表补充模型中新增的列和索引并删除已替换的索引（create_all不会修改已有表）
+    
+    大表上加列和建索引（尤其是全文索引）耗时较长，由 manage.py migrate 显式执行，不在服务启动时执行；
+    返回执行的变更
+    """
+    bind = bind if bind is not None else engine
+    changes = pending_schema_changes(bind)
+    tables = {table.name: table for table in Base.metadata.sorted_tables}
+    with bind.begin() as conn:
+        for change in changes:
+            action, qualified = change.split(" ", 1)
+            table_name, name = qualified.split(".", 1)
+            table = tables[table_name]
+            if action == "-":
+                conn.execute(text(f"DROP INDEX {name} ON {table_name}" if bind.dialect.name == "mysql" else f"DROP INDEX {name}"))
+            elif name in table.columns:
+                column = table.columns[name]
+                ddl = f"ALTER TABLE {table_name} ADD COLUMN {name} {column.type.compile(dialect=bind.dialect)}"
+                if column.server_default is not None:
+                    default = column.server_default.arg
+                    if isinstance(default, str):
+                        default = "'" + default.replace("'", "''") + "'"
+                    else:
+                        default = default.text
+                    ddl += f" NOT NULL DEFAULT {default}" if not column.nullable else f" DEFAULT {default}"
+                conn.execute(text(ddl))
+            else:
+                next(index for index in table.indexes if index.name == name).create(bind=conn)
+            print(f"  {change}")
+    return changes
@@ -2,18 +2,28 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 from app.config import settings
-from app.api import auth, conversations, messages
-from app.database import engine, Base
+from app.api import archive, auth, batches, conversations, messages, metrics, search, ws
+from app.database import engine, Base, pending_schema_changes
+from app.services.ai import AIService
+from app.utils.process_lock import process_lock
+from app.utils.serialization import APIResponse, ContentNegotiationMiddleware
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """应用生命周期管理"""
     # 启动时执行
+    # 进程内状态不在worker之间共享，只允许单个服务进程（多个worker时其余进程启动失败）
+    process_lock.acquire()
+    
     print("正在初始化数据库...")
     try:
         # 创建所有表（如果不存在）
         Base.metadata.create_all(bind=engine)
+        # 已有表的加列和建索引由 manage.py migrate 执行，这里只检查并提示
+        pending = pending_schema_changes()
+        if pending:
+            print(f"⚠️ 数据库结构落后于当前版本（{', '.join(pending)}），请执行 python manage.py migrate")
         print("✅ 数据库初始化完成")
         
         # 打印已创建的表
@@ -23,10 +33,15 @@ async def lifespan(app: FastAPI):
     except Exception as e:
         print(f"❌ 数据库初始化失败：{str(e)}")
     
+    # 创建共享的AI客户端连接池
+    AIService.init_client()
+    
     yield
     
     # 关闭时执行（如果需要清理资源）
     print("应用正在关闭...")
+    await AIService.close_client()
+    process_lock.release()
 
 
 # 创建FastAPI应用
@@ -36,6 +51,7 @@ app = FastAPI(
     description="基于 FastAPI 的多用户 AI 对话系统",
     docs_url="/docs",
     redoc_url="/redoc",
+    default_response_class=APIResponse,
     lifespan=lifespan
 )
 
@@ -46,12 +62,21 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Prev-Cursor", "X-Stream-ID"],
 )
 
+# 按Accept头协商JSON或msgpack响应
+app.add_middleware(ContentNegotiationMiddleware)
+
 # 注册路由
 app.include_router(auth.router)
 app.include_router(conversations.router)
 app.include_router(messages.router)
+app.include_router(batches.router)
+app.include_router(archive.router)
+app.include_router(search.router)
+app.include_router(ws.router)
+app.include_router(metrics.router)
 
 
 @app.get("/")
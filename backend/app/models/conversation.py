@@ -1,18 +1,38 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Index, Text, literal_column
 from sqlalchemy.orm import relationship
 from datetime import datetime, UTC
 from app.database import Base
 
+# 对话列表中最后一条消息预览的最大字符数
+PREVIEW_CHARS = 100
+
 
 class Conversation(Base):
     __tablename__ = "conversations"
+    __table_args__ = (
+        # 用户对话列表按(updated_at, id)的游标分页
+        Index("ix_conversations_user_updated", "user_id", "updated_at", "id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     title = Column(String(200), nullable=False, default="新对话")
     created_at = Column(DateTime, default=lambda: datetime.now(UTC))
     updated_at = Column(DateTime, default=lambda: datetime.now(UTC), onupdate=lambda: datetime.now(UTC))
+    summary = Column(Text, nullable=True)  # 较早对话的滚动摘要
+    summary_message_id = Column(Integer, nullable=True)  # 已折叠进摘要的最后一条消息ID
+    # 行版本：每条UPDATE语句（ORM或Core）都加1，作为列表和消息接口ETag的版本（不受updated_at时间精度的影响）
+    version = Column(Integer, nullable=False, default=0, server_default="0", onupdate=literal_column("version") + 1)
+    # 消息统计（写入消息时维护，列表接口直接读取，可用manage.py repair-conversations重新计算）
+    message_count = Column(Integer, nullable=False, default=0, server_default="0")
+    last_message_at = Column(DateTime, nullable=True)
+    last_message_preview = Column(String(PREVIEW_CHARS), nullable=True)
     
     # 关系
     user = relationship("User", back_populates="conversations")
-    messages = relationship("Message", back_populates="conversation", cascade="all, delete-orphan", order_by="Message.created_at") 
\ No newline at end of file
+    messages = relationship("Message", back_populates="conversation", cascade="all, delete-orphan", order_by="Message.created_at")
+
+
+def message_preview(content: str) -> str:
+    """最后一条消息的预览：空白合并为单个空格，截断到PREVIEW_CHARS个字符"""
+    return " ".join(content[:PREVIEW_CHARS * 2].split())[:PREVIEW_CHARS]
@@ -1,8 +1,11 @@
-from sqlalchemy import Column, Integer, DateTime, ForeignKey, Text, Enum
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, DateTime, ForeignKey, Index, String, Enum, Text, event, update
+from sqlalchemy.orm import deferred, relationship, validates
 from datetime import datetime, UTC
 import enum
 from app.database import Base
+from app.models.conversation import Conversation, message_preview
+from app.utils.compression import CompressedText
+from app.utils.tokenizer import count_tokens
 
 
 class MessageRole(str, enum.Enum):
@@ -11,14 +14,64 @@ class MessageRole(str, enum.Enum):
     SYSTEM = "system"
 
 
+class MessageStatus(str, enum.Enum):
+    COMPLETE = "complete"
+    STREAMING = "streaming"  # 正在生成
+    TRUNCATED = "truncated"  # 生成被取消，内容不完整
+
+
 class Message(Base):
     __tablename__ = "messages"
+    __table_args__ = (
+        # 对话内按(created_at, id)的游标分页
+        Index("ix_messages_conversation_created", "conversation_id", "created_at", "id"),
+        # 消息全文检索（MySQL，ngram分词支持中文，建在原文列上，不受内容压缩影响）；其他数据库使用进程内倒排索引
+        Index(
+            "ix_messages_search_fulltext",
+            "search_text",
+            mysql_prefix="FULLTEXT",
+            mysql_with_parser="ngram"
+        ).ddl_if(dialect="mysql"),
+        # SQLite上ID不复用，进程内倒排索引可按ID增量同步
+        {"sqlite_autoincrement": True}
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     conversation_id = Column(Integer, ForeignKey("conversations.id"), nullable=False)
     role = Column(Enum(MessageRole), nullable=False)
-    content = Column(Text, nullable=False)
+    content = Column(CompressedText, nullable=False)  # 较长的内容按配置透明压缩
+    # 供全文索引使用的原文（content压缩保存时索引仍按原文分词）；只在检索时读取，默认不加载
+    search_text = deferred(Column(Text, nullable=True))
+    token_count = Column(Integer, nullable=True)  # 写入时计算并缓存的token数
+    status = Column(
+        String(20),
+        nullable=False,
+        default=MessageStatus.COMPLETE.value,
+        server_default=MessageStatus.COMPLETE.value
+    )
     created_at = Column(DateTime, default=lambda: datetime.now(UTC))
     
     # 关系
-    conversation = relationship("Conversation", back_populates="messages") 
\ No newline at end of file
+    conversation = relationship("Conversation", back_populates="messages")
+    
+    @validates("content")
+    def _update_token_count(self, key, content):
+        """内容变更时同步更新token数和检索用的原文"""
+        self.token_count = count_tokens(content)
+        self.search_text = str(content)
+        return content
+
+
+@event.listens_for(Message, "after_insert")
+def _count_message(mapper, connection, target):
+    """插入消息时在同一事务中更新对话的消息数和最后一条消息（对话的updated_at随之更新）"""
+    conversations = Conversation.__table__
+    connection.execute(
+        update(conversations).where(
+            conversations.c.id == target.conversation_id
+        ).values(
+            message_count=conversations.c.message_count + 1,
+            last_message_at=target.created_at,
+            last_message_preview=message_preview(target.content)
+        )
+    )
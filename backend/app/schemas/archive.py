@@ -0,0 +1,6 @@
+from pydantic import BaseModel
+
+
+class ImportResponse(BaseModel):
+    conversations: int
+    messages: int
@@ -0,0 +1,37 @@
+from pydantic import BaseModel, Field
+from datetime import datetime
+from typing import Dict, List, Optional
+from app.services.batch import BatchItemStatus
+
+
+class BatchItemCreate(BaseModel):
+    conversation_id: int
+    content: str = Field(..., min_length=1)
+
+
+class BatchCreate(BaseModel):
+    items: List[BatchItemCreate] = Field(..., min_length=1)
+
+
+class BatchItemResponse(BaseModel):
+    index: int
+    conversation_id: int
+    status: BatchItemStatus
+    attempts: int
+    user_message_id: Optional[int] = None
+    ai_message_id: Optional[int] = None
+    reply: Optional[str] = None
+    error: Optional[str] = None
+    
+    class Config:
+        from_attributes = True
+
+
+class BatchJobResponse(BaseModel):
+    id: str
+    status: str
+    total: int
+    counts: Dict[str, int]
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+    items: Optional[List[BatchItemResponse]] = None
@@ -22,6 +22,8 @@ class ConversationResponse(ConversationBase):
     created_at: datetime
     updated_at: datetime
     message_count: Optional[int] = 0
+    last_message_at: Optional[datetime] = None
+    last_message_preview: Optional[str] = None
     
     class Config:
         from_attributes = True
@@ -1,6 +1,7 @@
 from pydantic import BaseModel, Field
 from datetime import datetime
-from app.models.message import MessageRole
+from typing import List
+from app.models.message import MessageRole, MessageStatus
 
 
 class MessageBase(BaseModel):
@@ -15,7 +16,17 @@ class MessageResponse(MessageBase):
     id: int
     conversation_id: int
     role: MessageRole
+    status: MessageStatus = MessageStatus.COMPLETE
     created_at: datetime
     
     class Config:
-        from_attributes = True 
\ No newline at end of file
+        from_attributes = True
+
+
+# 列表接口直接按响应字段从ORM对象取值，跳过逐条from_attributes校验
+_RESPONSE_FIELDS = tuple(MessageResponse.model_fields)
+
+
+def dump_messages(messages: list) -> List[dict]:
+    """构建与MessageResponse一致的字典列表（由APIResponse编码枚举和时间）"""
+    return [{name: getattr(message, name) for name in _RESPONSE_FIELDS} for message in messages]
@@ -0,0 +1,15 @@
+from pydantic import BaseModel, Field
+from datetime import datetime
+from typing import List
+from app.models.message import MessageRole
+
+
+class SearchHit(BaseModel):
+    message_id: int
+    conversation_id: int
+    conversation_title: str
+    role: MessageRole
+    created_at: datetime
+    score: float
+    snippet: str
+    highlights: List[List[int]] = Field(default=[], description="片段中命中位置的[起, 止)字符偏移")
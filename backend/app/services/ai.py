@@ -1,95 +1,272 @@
 from typing import Optional, AsyncGenerator
-from openai import OpenAI
 from app.config import settings
+from app.services.cache import ResponseCache, response_cache
+from app.services.context import ContextBuilder
+from app.services.limiter import LimiterTimeout, ai_limiter
+from app.services.resilience import CircuitOpenError, circuit_breaker, hedger, ttft_tracker
+from app.services.router import Backend, BackendRouter, create_router
+from app.services.semantic_cache import SemanticCache, semantic_cache
+from app.services.singleflight import singleflight
+from app.utils.streaming import iterate_in_task
+
+# 进程内共享的上游端点路由（由应用生命周期创建和关闭）
+_router: Optional[BackendRouter] = None
 
 
 class AIService:
     @staticmethod
-    def _get_client() -> Optional[OpenAI]:
-        """获取OpenAI客户端"""
-        if not settings.DASHSCOPE_API_KEY:
-            return None
-        
-        return OpenAI(
-            api_key=settings.DASHSCOPE_API_KEY,
-            base_url=settings.QWEN_BASE_URL,
-        )
+    def init_client() -> None:
+        """为各上游端点创建共享客户端（应用启动时调用）"""
+        global _router
+        if _router is None:
+            _router = create_router()
+    
+    @staticmethod
+    async def close_client() -> None:
+        """关闭各端点的客户端及其连接池（应用关闭时调用）"""
+        global _router
+        if _router is not None:
+            await _router.close()
+            _router = None
     
     @staticmethod
-    async def get_ai_response(message: str, conversation_history: Optional[list] = None) -> str:
+    def _get_router() -> Optional[BackendRouter]:
+        """获取共享的上游端点路由"""
+        # 未经过应用生命周期（如脚本、测试）时按需创建
+        if _router is None:
+            AIService.init_client()
+        return _router
+    
+    @staticmethod
+    def backend_stats() -> list:
+        """各上游端点的延迟、错误率和摘除状态"""
+        return _router.stats() if _router is not None else []
+    
+    @staticmethod
+    async def get_ai_response(
+        message: str,
+        conversation_history: Optional[list] = None,
+        summary: Optional[str] = None
+    ) -> str:
         """调用通义千问API获取AI回复（非流式）"""
-        client = AIService._get_client()
+        router = AIService._get_router()
         
         # 如果没有配置API密钥，返回模拟响应
-        if not client:
+        if not router:
             return f"这是对 '{message}' 的模拟AI回复。请配置DASHSCOPE_API_KEY以使用真实的AI服务。"
         
-        # 构建消息列表
-        messages = [{"role": "system", "content": "你是一个有用的AI助手。"}]
-        
-        # 添加历史对话（如果有）
-        if conversation_history:
-            for msg in conversation_history[-10:]:  # 只保留最近10条消息作为上下文
-                messages.append({
-                    "role": msg.role.value,
-                    "content": msg.content
-                })
+        # 按token预算构建消息列表
+        messages = ContextBuilder.build(message, conversation_history, summary=summary)
         
-        # 添加当前用户消息
-        messages.append({
-            "role": "user",
-            "content": message
-        })
+        # 命中缓存时直接返回
+        cache_key = ResponseCache.make_key(router.models, messages)
+        cached = await AIService._lookup_cache(router, cache_key, messages)
+        if cached is not None:
+            return cached
         
         try:
-            completion = client.chat.completions.create(
-                model=settings.QWEN_MODEL,
-                messages=messages,
-                stream=False
-            )
-            
-            return completion.choices[0].message.content
+            # 相同提示的并发请求只调用一次上游
+            if settings.AI_SINGLEFLIGHT_ENABLED:
+                return await singleflight.do(
+                    cache_key,
+                    lambda: AIService._complete(router, messages, cache_key)
+                )
+            return await AIService._complete(router, messages, cache_key)
             
+        except (CircuitOpenError, LimiterTimeout):
+            # 熔断中或排队超时（过载）直接失败，由调用方返回明确的错误，不当作回复保存
+            raise
         except Exception as e:
             return f"抱歉，调用AI服务时发生错误：{str(e)}"
     
     @staticmethod
-    async def get_ai_response_stream(message: str, conversation_history: Optional[list] = None) -> AsyncGenerator[str, None]:
+    async def get_ai_response_stream(
+        message: str,
+        conversation_history: Optional[list] = None,
+        summary: Optional[str] = None
+    ) -> AsyncGenerator[str, None]:
         """调用通义千问API获取AI回复（流式）"""
-        client = AIService._get_client()
+        router = AIService._get_router()
         
         # 如果没有配置API密钥，返回模拟响应
-        if not client:
+        if not router:
             yield f"这是对 '{message}' 的模拟AI回复。请配置DASHSCOPE_API_KEY以使用真实的AI服务。"
             return
         
-        # 构建消息列表
-        messages = [{"role": "system", "content": "你是一个有用的AI助手。"}]
+        # 按token预算构建消息列表
+        messages = ContextBuilder.build(message, conversation_history, summary=summary)
         
-        # 添加历史对话（如果有）
-        if conversation_history:
-            for msg in conversation_history[-10:]:  # 只保留最近10条消息作为上下文
-                messages.append({
-                    "role": msg.role.value,
-                    "content": msg.content
-                })
+        # 命中缓存时按分块重放
+        cache_key = ResponseCache.make_key(router.models, messages)
+        cached = await AIService._lookup_cache(router, cache_key, messages)
+        if cached is not None:
+            size = settings.AI_CACHE_REPLAY_CHUNK_CHARS
+            for start in range(0, len(cached), size):
+                yield cached[start:start + size]
+            return
+        
+        try:
+            # 上游读取在独立任务中进行，通过有界缓冲交给SSE生成器；
+            # 相同提示的并发请求订阅同一个上游流
+            if settings.AI_SINGLEFLIGHT_ENABLED:
+                stream = singleflight.stream(
+                    cache_key,
+                    lambda: AIService._generate_stream(router, messages, cache_key),
+                    settings.AI_STREAM_QUEUE_SIZE
+                )
+            else:
+                stream = iterate_in_task(
+                    AIService._generate_stream(router, messages, cache_key),
+                    settings.AI_STREAM_QUEUE_SIZE
+                )
+            async for content in stream:
+                yield content
+                    
+        except (CircuitOpenError, LimiterTimeout):
+            # 熔断中或排队超时（过载）直接失败，由调用方返回明确的错误，不当作回复保存
+            raise
+        except Exception as e:
+            yield f"抱歉，调用AI服务时发生错误：{str(e)}"
+    
+    @staticmethod
+    def _semantic_scope(router: BackendRouter, messages: list) -> Optional[int]:
+        """仅首轮问题（无历史上下文）使用语义缓存，返回其作用域"""
+        if semantic_cache is None or len(messages) != 2:
+            return None
+        return SemanticCache.scope_of(router.models, messages[0]["content"])
+    
+    @staticmethod
+    async def _lookup_cache(router: BackendRouter, cache_key: str, messages: list) -> Optional[str]:
+        """依次查询精确匹配缓存和语义缓存"""
+        if settings.AI_CACHE_ENABLED:
+            cached = await response_cache.get(cache_key)
+            if cached is not None:
+                return cached
         
-        # 添加当前用户消息
-        messages.append({
-            "role": "user",
-            "content": message
-        })
+        scope = AIService._semantic_scope(router, messages)
+        if scope is not None:
+            return semantic_cache.lookup(messages[-1]["content"], scope)
+        return None
+    
+    @staticmethod
+    async def _store_cache(router: BackendRouter, cache_key: str, messages: list, content: str) -> None:
+        """将完整回复写入缓存"""
+        if settings.AI_CACHE_ENABLED:
+            await response_cache.set(cache_key, content)
         
+        scope = AIService._semantic_scope(router, messages)
+        if scope is not None:
+            semantic_cache.add(messages[-1]["content"], content, scope)
+    
+    @staticmethod
+    async def summarize(previous_summary: Optional[str], turns: list) -> Optional[str]:
+        """将新的对话轮次增量合并进已有摘要"""
+        router = AIService._get_router()
+        
+        # 未配置API密钥或上游不健康时不生成摘要
+        if not router or not circuit_breaker.closed:
+            return None
+        
+        transcript = "\n".join(
+            f"{turn['role']}: {turn['content'][:settings.AI_SUMMARY_TURN_CHARS]}" for turn in turns
+        )
+        prompt = (
+            f"已有摘要：\n{previous_summary or '（无）'}\n\n"
+            f"新增对话：\n{transcript}\n\n"
+            "请将新增对话合并进已有摘要，保留关键事实、用户偏好和未解决的问题，只输出更新后的摘要。"
+        )
+        
+        messages = [
+            {"role": "system", "content": "你负责维护一段对话的简明摘要。"},
+            {"role": "user", "content": prompt}
+        ]
         try:
-            completion = client.chat.completions.create(
-                model=settings.QWEN_MODEL,
-                messages=messages,
-                stream=True
-            )
+            # 与对话回复走同一条路径：端点选择、熔断和路由统计、对冲
+            attempt = AIService._attempt_factory(router, messages, max_tokens=settings.AI_SUMMARY_MAX_TOKENS)
+            chunks = [content async for content in hedger.stream(attempt)]
+            return "".join(chunks)
             
-            for chunk in completion:
-                if chunk.choices and chunk.choices[0].delta.content:
-                    yield chunk.choices[0].delta.content
-                    
         except Exception as e:
-            yield f"抱歉，调用AI服务时发生错误：{str(e)}" 
\ No newline at end of file
+            print(f"生成对话摘要失败：{str(e)}")
+            return None
+    
+    @staticmethod
+    def _attempt_factory(router: BackendRouter, messages: list, max_tokens: Optional[int] = None):
+        """每次尝试选择一个端点，对冲的第二次尝试优先使用不同的端点"""
+        tried = []
+        
+        def attempt() -> AsyncGenerator[str, None]:
+            backend = router.pick(exclude=tried)
+            tried.append(backend)
+            return AIService._stream_upstream(router, backend, messages, max_tokens)
+        
+        return attempt
+    
+    @staticmethod
+    async def _complete(router: BackendRouter, messages: list, cache_key: str) -> str:
+        """调用上游获取完整回复并写入缓存"""
+        # 同样走流式调用，以便按首token延迟对冲并向限流器提供延迟信号
+        chunks = []
+        async for content in hedger.stream(AIService._attempt_factory(router, messages)):
+            chunks.append(content)
+        
+        content = "".join(chunks)
+        if content:
+            await AIService._store_cache(router, cache_key, messages, content)
+        return content
+    
+    @staticmethod
+    async def _generate_stream(router: BackendRouter, messages: list, cache_key: str) -> AsyncGenerator[str, None]:
+        """读取上游流式回复，完整生成后写入缓存"""
+        chunks = []
+        async for content in hedger.stream(AIService._attempt_factory(router, messages)):
+            chunks.append(content)
+            yield content
+        
+        if chunks:
+            await AIService._store_cache(router, cache_key, messages, "".join(chunks))
+    
+    @staticmethod
+    async def _stream_upstream(
+        router: BackendRouter,
+        backend: Backend,
+        messages: list,
+        max_tokens: Optional[int] = None
+    ) -> AsyncGenerator[str, None]:
+        """读取上游流式响应，结束或取消时释放连接"""
+        # 熔断中不排队也不请求上游
+        circuit_breaker.before_call()
+        healthy = False
+        router.on_start(backend)
+        try:
+            async with ai_limiter.slot() as permit:
+                # 未限制长度时不传max_tokens，使用上游默认值
+                options = {"max_tokens": max_tokens} if max_tokens else {}
+                completion = await backend.client.chat.completions.create(
+                    model=backend.model,
+                    messages=messages,
+                    stream=True,
+                    **options
+                )
+                try:
+                    async for chunk in completion:
+                        if chunk.choices and chunk.choices[0].delta.content:
+                            if not healthy:
+                                # 收到首token即视为上游健康
+                                healthy = True
+                                permit.mark_first_token()
+                                ttft_tracker.record(permit.latency)
+                                router.on_first_token(backend, permit.latency)
+                                circuit_breaker.on_success()
+                            yield chunk.choices[0].delta.content
+                finally:
+                    await completion.response.aclose()
+            if not healthy:
+                circuit_breaker.on_success()
+        except BaseException as e:
+            # 取消（对冲落败、客户端断开）不计入失败，但需结束半开探测
+            circuit_breaker.on_failure(e)
+            router.on_failure(backend, e)
+            raise
+        finally:
+            router.on_finish(backend)
@@ -0,0 +1,274 @@
+import zlib
+from datetime import datetime, UTC
+from typing import AsyncIterator, Dict, Iterator, List, Tuple
+from fastapi import HTTPException, status
+from sqlalchemy import insert, select
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+from app.config import settings
+from app.models.conversation import Conversation
+from app.models.message import Message, MessageRole, MessageStatus
+from app.models.user import User
+from app.services.conversation import ConversationService
+from app.utils.serialization import dumps_json, loads_json
+from app.utils.tokenizer import count_tokens
+
+# 导出格式版本（写在第一行的export记录中）
+FORMAT_VERSION = 1
+GZIP_MAGIC = b"\x1f\x8b"
+# 导出时合并成一块再发送的字节数
+CHUNK_BYTES = 64 * 1024
+
+
+class ArchiveService:
+    """
+    对话的NDJSON导出与导入
+    
+    每行一个JSON记录：首行为export，之后每个对话先输出一行conversation，再依次输出其message；
+    导出和导入都按行流式处理，内存占用与对话中的消息总数无关
+    """
+    
+    @staticmethod
+    def export_records(session_factory, user_id: int) -> Iterator[dict]:
+        """逐条产出导出记录，消息通过服务端游标按批读取"""
+        db = session_factory()
+        try:
+            yield {"type": "export", "version": FORMAT_VERSION, "exported_at": datetime.now(UTC)}
+            # 对话数量有限，先全部取出，避免与消息游标同时占用连接上的结果集（MySQL的流式游标不允许）
+            conversations = db.execute(
+                select(
+                    Conversation.id,
+                    Conversation.title,
+                    Conversation.created_at,
+                    Conversation.updated_at,
+                    Conversation.summary
+                ).where(
+                    Conversation.user_id == user_id
+                ).order_by(Conversation.id)
+            ).all()
+            
+            for conversation in conversations:
+                yield {
+                    "type": "conversation",
+                    "id": conversation.id,
+                    "title": conversation.title,
+                    "created_at": conversation.created_at,
+                    "updated_at": conversation.updated_at,
+                    "summary": conversation.summary
+                }
+                messages = db.execute(
+                    select(
+                        Message.id,
+                        Message.role,
+                        Message.content,
+                        Message.status,
+                        Message.token_count,
+                        Message.created_at
+                    ).where(
+                        Message.conversation_id == conversation.id
+                    ).order_by(
+                        Message.created_at, Message.id
+                    ).execution_options(yield_per=settings.EXPORT_YIELD_PER)
+                )
+                for message in messages:
+                    yield {
+                        "type": "message",
+                        "id": message.id,
+                        "conversation_id": conversation.id,
+                        "role": message.role.value,
+                        "content": message.content,
+                        "status": message.status,
+                        "token_count": message.token_count,
+                        "created_at": message.created_at
+                    }
+        finally:
+            db.close()
+    
+    @staticmethod
+    def export_stream(session_factory, user_id: int, compress: bool = False) -> Iterator[bytes]:
+        """把导出记录编码为NDJSON，合并成较大的块发送，compress时输出gzip"""
+        compressor = zlib.compressobj(wbits=31) if compress else None
+        buffer = bytearray()
+        for record in ArchiveService.export_records(session_factory, user_id):
+            buffer += dumps_json(record)
+            buffer += b"\n"
+            if len(buffer) >= CHUNK_BYTES:
+                chunk = compressor.compress(bytes(buffer)) if compressor else bytes(buffer)
+                buffer.clear()
+                if chunk:
+                    yield chunk
+        chunk = bytes(buffer)
+        if compressor:
+            chunk = compressor.compress(chunk) + compressor.flush()
+        if chunk:
+            yield chunk
+    
+    @staticmethod
+    async def _lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[Tuple[int, bytes]]:
+        """把请求体按行切分（以gzip魔数开头时先解压），产出(行号, 行内容)"""
+        decompressor = None
+        detected = False
+        buffer = bytearray()
+        scanned = 0
+        line_number = 0
+        
+        async def split(data: bytes, final: bool = False):
+            nonlocal scanned, line_number
+            buffer.extend(data)
+            start = 0
+            while True:
+                end = buffer.find(b"\n", max(start, scanned))
+                if end == -1:
+                    break
+                line_number += 1
+                yield line_number, bytes(buffer[start:end])
+                start = end + 1
+            del buffer[:start]
+            scanned = len(buffer)
+            if len(buffer) > settings.IMPORT_MAX_LINE_BYTES:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"第{line_number + 1}行超过{settings.IMPORT_MAX_LINE_BYTES}字节"
+                )
+            if final and buffer:
+                line_number += 1
+                yield line_number, bytes(buffer)
+                buffer.clear()
+        
+        pending = b""
+        async for chunk in chunks:
+            if not detected:
+                # 凑够两个字节再判断是否为gzip
+                pending += chunk
+                if len(pending) < len(GZIP_MAGIC):
+                    continue
+                detected = True
+                if pending.startswith(GZIP_MAGIC):
+                    decompressor = zlib.decompressobj(wbits=47)
+                chunk, pending = pending, b""
+            pieces = ArchiveService._inflate(decompressor, chunk) if decompressor is not None else (chunk,)
+            for piece in pieces:
+                async for item in split(piece):
+                    yield item
+        
+        tail = pending
+        if decompressor is not None:
+            tail = decompressor.flush()
+            if not decompressor.eof:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="gzip数据不完整")
+        async for item in split(tail, final=True):
+            yield item
+    
+    @staticmethod
+    def _inflate(decompressor, data: bytes) -> Iterator[bytes]:
+        """
+        分段解压一块gzip数据
+        
+        每段输出不超过IMPORT_MAX_LINE_BYTES，由调用方切行后再解压下一段，
+        压缩比极高的数据（gzip炸弹）不会一次性展开到内存中
+        """
+        try:
+            while data:
+                output = decompressor.decompress(data, settings.IMPORT_MAX_LINE_BYTES)
+                data = decompressor.unconsumed_tail
+                yield output
+        except zlib.error:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="gzip数据损坏")
+    
+    @staticmethod
+    def _parse_time(value) -> datetime:
+        return datetime.fromisoformat(value) if value else datetime.now(UTC)
+    
+    @staticmethod
+    def _insert_conversation(db: Session, user: User, record: dict) -> int:
+        # 滚动摘要对应的消息ID在导入后会变化，不导入摘要，需要时由摘要服务重新生成
+        created_at = ArchiveService._parse_time(record.get("created_at"))
+        result = db.execute(insert(Conversation).values(
+            user_id=user.id,
+            title=str(record.get("title") or "新对话")[:200],
+            created_at=created_at,
+            updated_at=ArchiveService._parse_time(record["updated_at"]) if record.get("updated_at") else created_at
+        ))
+        return result.inserted_primary_key[0]
+    
+    @staticmethod
+    def _message_row(conversation_id: int, record: dict) -> dict:
+        content = record["content"]
+        if not isinstance(content, str):
+            raise ValueError("content必须是字符串")
+        token_count = record.get("token_count")
+        message_status = MessageStatus(record.get("status") or MessageStatus.COMPLETE.value)
+        if message_status == MessageStatus.STREAMING:
+            # 导出时仍在生成的消息已不会再继续
+            message_status = MessageStatus.TRUNCATED
+        return {
+            "conversation_id": conversation_id,
+            "role": MessageRole(record["role"]),
+            "content": content,
+            # 批量插入不经过ORM的校验器，检索原文和token数在这里补上
+            "search_text": content,
+            "token_count": token_count if isinstance(token_count, int) else count_tokens(content),
+            "status": message_status.value,
+            "created_at": ArchiveService._parse_time(record.get("created_at"))
+        }
+    
+    @staticmethod
+    async def import_stream(db: Session, user: User, chunks: AsyncIterator[bytes]) -> Dict[str, int]:
+        """
+        从NDJSON流导入对话（作为当前用户的新对话）
+        
+        消息按IMPORT_BATCH_SIZE条一批executemany插入，全部成功后一次提交；
+        任一行无效时整体回滚并返回400。
+        同步的数据库操作在线程池中执行，大批量插入期间不阻塞事件循环
+        """
+        conversation_ids: Dict[int, int] = {}
+        batch: List[dict] = []
+        imported = {"conversations": 0, "messages": 0}
+        
+        def flush():
+            if batch:
+                # 直接在表上executemany，跳过ORM批量插入的逐行处理
+                db.connection().execute(insert(Message.__table__), batch)
+                imported["messages"] += len(batch)
+                batch.clear()
+        
+        def finish():
+            flush()
+            # 批量插入不经过ORM事件，导入完成后统一计算各对话的消息统计
+            ConversationService.refresh_message_stats(db, list(conversation_ids.values()))
+            db.commit()
+        
+        try:
+            async for line_number, line in ArchiveService._lines(chunks):
+                if not line.strip():
+                    continue
+                try:
+                    record = loads_json(line)
+                    record_type = record["type"]
+                    if record_type == "export":
+                        if record.get("version") != FORMAT_VERSION:
+                            raise ValueError(f"不支持的导出格式版本: {record.get('version')}")
+                    elif record_type == "conversation":
+                        conversation_ids[record["id"]] = await run_in_threadpool(
+                            ArchiveService._insert_conversation, db, user, record
+                        )
+                        imported["conversations"] += 1
+                    elif record_type == "message":
+                        conversation_id = conversation_ids.get(record["conversation_id"])
+                        if conversation_id is None:
+                            raise ValueError(f"消息所属的对话{record['conversation_id']}未在之前出现")
+                        batch.append(ArchiveService._message_row(conversation_id, record))
+                        if len(batch) >= settings.IMPORT_BATCH_SIZE:
+                            await run_in_threadpool(flush)
+                    else:
+                        raise ValueError(f"未知的记录类型: {record_type}")
+                except (KeyError, TypeError, ValueError) as e:
+                    raise HTTPException(
+                        status_code=status.HTTP_400_BAD_REQUEST,
+                        detail=f"第{line_number}行格式错误: {e}"
+                    )
+            await run_in_threadpool(finish)
+        except Exception:
+            await run_in_threadpool(db.rollback)
+            raise
+        return imported
@@ -0,0 +1,243 @@
+import asyncio
+import enum
+import time
+import uuid
+from collections import OrderedDict, deque
+from datetime import datetime, UTC
+from typing import Dict, List, Optional
+from fastapi import HTTPException, status
+from sqlalchemy.orm import Session
+from app.config import settings
+from app.models.conversation import Conversation
+from app.models.user import User
+from app.schemas.message import MessageCreate
+from app.services.conversation import ConversationService
+
+
+class BatchItemStatus(str, enum.Enum):
+    """批量条目状态"""
+    PENDING = "pending"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+
+class BatchItem:
+    def __init__(self, index: int, conversation_id: int, content: str):
+        self.index = index
+        self.conversation_id = conversation_id
+        self.content = content
+        self.status = BatchItemStatus.PENDING
+        self.attempts = 0
+        self.user_message_id: Optional[int] = None
+        self.ai_message_id: Optional[int] = None
+        self.reply: Optional[str] = None
+        self.error: Optional[str] = None
+
+
+class BatchJob:
+    """
+    一个批量提交任务
+    
+    条目按对话分成若干通道，同一对话内严格按提交顺序执行（后一条的上下文包含前一条的回复），
+    不同对话之间由有限个工作协程并行处理；条目执行时占用全部任务共享的并发名额
+    """
+    
+    def __init__(self, user_id: int, items: List[BatchItem], concurrency: int):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.items = items
+        self.concurrency = concurrency
+        self.created_at = datetime.now(UTC)
+        self.finished_at: Optional[datetime] = None
+        self._finished_monotonic: Optional[float] = None
+        self.cancelled = False
+        self.tasks: List[asyncio.Task] = []
+        
+        lanes: "OrderedDict[int, List[BatchItem]]" = OrderedDict()
+        for item in items:
+            lanes.setdefault(item.conversation_id, []).append(item)
+        self._lanes = deque(lanes.values())
+    
+    @property
+    def done(self) -> bool:
+        return self.finished_at is not None
+    
+    @property
+    def status(self) -> str:
+        if self.cancelled:
+            return "cancelled"
+        if self.done:
+            return "completed"
+        if all(item.status == BatchItemStatus.PENDING for item in self.items):
+            return "queued"
+        return "running"
+    
+    def counts(self) -> Dict[str, int]:
+        counts = {item_status.value: 0 for item_status in BatchItemStatus}
+        for item in self.items:
+            counts[item.status.value] += 1
+        return counts
+    
+    def _finish(self) -> None:
+        if self.done:
+            return
+        for item in self.items:
+            if item.status in (BatchItemStatus.PENDING, BatchItemStatus.RUNNING):
+                item.status = BatchItemStatus.CANCELLED
+        self.finished_at = datetime.now(UTC)
+        self._finished_monotonic = time.monotonic()
+    
+    def cancel(self) -> bool:
+        """取消尚未完成的条目（已保存的消息不回滚），返回是否确实取消"""
+        if self.done:
+            return False
+        self.cancelled = True
+        for task in self.tasks:
+            task.cancel()
+        self._finish()
+        return True
+
+
+class BatchService:
+    @staticmethod
+    def check_conversations(db: Session, user: User, conversation_ids: set) -> None:
+        """提交前一次性校验所有对话均属于当前用户"""
+        owned = {
+            row[0] for row in db.query(Conversation.id).filter(
+                Conversation.id.in_(conversation_ids),
+                Conversation.user_id == user.id
+            )
+        }
+        missing = sorted(conversation_ids - owned)
+        if missing:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"对话不存在: {', '.join(str(conversation_id) for conversation_id in missing)}"
+            )
+    
+    @staticmethod
+    async def _process_item(session_factory, user_id: int, item: BatchItem) -> None:
+        """通过与单条发送相同的流程处理一个条目，上游熔断时按Retry-After等待后重试"""
+        item.status = BatchItemStatus.RUNNING
+        while True:
+            item.attempts += 1
+            db = session_factory()
+            try:
+                user = db.get(User, user_id)
+                user_message, ai_message = await ConversationService.send_message(
+                    db, user, item.conversation_id, MessageCreate(content=item.content)
+                )
+                item.user_message_id = user_message.id
+                item.ai_message_id = ai_message.id
+                item.reply = ai_message.content
+                item.status = BatchItemStatus.SUCCEEDED
+                return
+            except HTTPException as e:
+                retry_after = (e.headers or {}).get("Retry-After")
+                if (
+                    e.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+                    and retry_after is not None
+                    and item.attempts <= settings.BATCH_ITEM_RETRIES
+                ):
+                    db.close()
+                    await asyncio.sleep(float(retry_after))
+                    continue
+                item.error = str(e.detail)
+            except Exception as e:
+                item.error = str(e)
+            finally:
+                db.close()
+            item.status = BatchItemStatus.FAILED
+            return
+    
+    @staticmethod
+    async def _worker(job: BatchJob, session_factory) -> None:
+        """不断领取下一个对话通道，按顺序处理其中的条目"""
+        while job._lanes:
+            lane = job._lanes.popleft()
+            for item in lane:
+                # 进程内所有批量任务共享并发名额，多个任务同时提交时对上游的并发仍不超过BATCH_CONCURRENCY
+                async with batch_registry.slots():
+                    await BatchService._process_item(session_factory, job.user_id, item)
+    
+    @staticmethod
+    def submit(session_factory, user_id: int, items: List[tuple]) -> BatchJob:
+        """登记批量任务并在后台启动工作协程，立即返回任务句柄"""
+        job = batch_registry.create(user_id, [
+            BatchItem(index, conversation_id, content)
+            for index, (conversation_id, content) in enumerate(items)
+        ])
+        workers = [
+            asyncio.create_task(BatchService._worker(job, session_factory))
+            for _ in range(min(job.concurrency, len(job._lanes)))
+        ]
+        
+        async def wait_all():
+            await asyncio.gather(*workers, return_exceptions=True)
+            job._finish()
+        
+        # 持有汇总任务的引用，防止被垃圾回收
+        job.tasks = workers + [asyncio.create_task(wait_all())]
+        return job
+
+
+class BatchRegistry:
+    """进程内的批量任务登记表，完成的任务在TTL后清除"""
+    
+    def __init__(self, ttl: float, concurrency: int):
+        self.ttl = ttl
+        self.concurrency = concurrency
+        self._jobs: "OrderedDict[str, BatchJob]" = OrderedDict()
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._slots_loop: Optional[asyncio.AbstractEventLoop] = None
+        self.submitted = 0
+        self.items_submitted = 0
+        self.expired = 0
+    
+    def slots(self) -> asyncio.Semaphore:
+        """全部任务共享的执行名额（在运行中的事件循环里按需创建，避免绑定到其他事件循环）"""
+        loop = asyncio.get_running_loop()
+        if self._slots is None or self._slots_loop is not loop:
+            self._slots = asyncio.Semaphore(self.concurrency)
+            self._slots_loop = loop
+        return self._slots
+    
+    def create(self, user_id: int, items: List[BatchItem]) -> BatchJob:
+        self.cleanup()
+        job = BatchJob(user_id, items, self.concurrency)
+        self._jobs[job.id] = job
+        self.submitted += 1
+        self.items_submitted += len(items)
+        return job
+    
+    def get(self, job_id: str, user_id: int) -> Optional[BatchJob]:
+        """获取属于指定用户的批量任务（不存在或已过期时返回None）"""
+        self.cleanup()
+        job = self._jobs.get(job_id)
+        if job is None or job.user_id != user_id:
+            return None
+        return job
+    
+    def cleanup(self) -> None:
+        now = time.monotonic()
+        for job_id, job in list(self._jobs.items()):
+            if job.done and now - job._finished_monotonic > self.ttl:
+                del self._jobs[job_id]
+                self.expired += 1
+    
+    def stats(self) -> dict:
+        active = [job for job in self._jobs.values() if not job.done]
+        return {
+            "active_jobs": len(active),
+            "pending_items": sum(job.counts()[BatchItemStatus.PENDING.value] for job in active),
+            "running_items": sum(job.counts()[BatchItemStatus.RUNNING.value] for job in active),
+            "submitted": self.submitted,
+            "items_submitted": self.items_submitted,
+            "expired": self.expired
+        }
+
+
+# 全局批量任务登记表
+batch_registry = BatchRegistry(settings.BATCH_JOB_TTL, settings.BATCH_CONCURRENCY)
@@ -0,0 +1,125 @@
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+from app.config import settings
+from app.utils.tokenizer import count_tokens
+
+
+class LRUCache:
+    """带容量和过期时间限制的内存LRU缓存"""
+    
+    def __init__(self, max_size: int, ttl: Optional[float] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()
+    
+    def get(self, key) -> Optional[Any]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at is not None and expires_at < time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+    
+    def set(self, key, value) -> None:
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        self._data[key] = (value, expires_at)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+    
+    def clear(self) -> None:
+        self._data.clear()
+    
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class CacheBackend:
+    """AI回复缓存后端接口（可替换为Redis等共享存储）"""
+    
+    async def get(self, key: str) -> Optional[str]:
+        raise NotImplementedError
+    
+    async def set(self, key: str, value: str) -> None:
+        raise NotImplementedError
+    
+    async def clear(self) -> None:
+        raise NotImplementedError
+    
+    def size(self) -> Optional[int]:
+        return None
+
+
+class MemoryCacheBackend(CacheBackend):
+    """进程内LRU+TTL缓存后端"""
+    
+    def __init__(self, max_size: int, ttl: Optional[float]):
+        self._cache = LRUCache(max_size, ttl)
+    
+    async def get(self, key: str) -> Optional[str]:
+        return self._cache.get(key)
+    
+    async def set(self, key: str, value: str) -> None:
+        self._cache.set(key, value)
+    
+    async def clear(self) -> None:
+        self._cache.clear()
+    
+    def size(self) -> Optional[int]:
+        return len(self._cache)
+
+
+class ResponseCache:
+    """按完整提示精确匹配的AI回复缓存"""
+    
+    def __init__(self, backend: CacheBackend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.saved_tokens = 0
+    
+    @staticmethod
+    def make_key(model: str, messages: list) -> str:
+        """根据模型和消息列表（系统提示、截断后的历史、当前消息）计算规范化哈希"""
+        canonical = json.dumps(
+            [model, messages],
+            ensure_ascii=False,
+            sort_keys=True,
+            separators=(",", ":")
+        )
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+    
+    async def get(self, key: str) -> Optional[str]:
+        value = await self.backend.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.saved_tokens += count_tokens(value)
+        return value
+    
+    async def set(self, key: str, value: str) -> None:
+        await self.backend.set(key, value)
+    
+    async def clear(self) -> None:
+        await self.backend.clear()
+    
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "saved_completion_tokens": self.saved_tokens,
+            "size": self.backend.size()
+        }
+
+
+# 全局回复缓存
+response_cache = ResponseCache(MemoryCacheBackend(settings.AI_CACHE_MAX_SIZE, settings.AI_CACHE_TTL))
@@ -0,0 +1,53 @@
+from typing import Optional, List
+from app.config import settings
+from app.utils.tokenizer import count_tokens
+
+
+class ContextBuilder:
+    @staticmethod
+    def message_tokens(msg) -> int:
+        """获取单条历史消息的token数（优先使用写入时缓存的值）"""
+        token_count = getattr(msg, "token_count", None)
+        if token_count is None:
+            token_count = count_tokens(msg.content)
+        return token_count + settings.AI_MESSAGE_TOKEN_OVERHEAD
+    
+    @staticmethod
+    def build(
+        message: str,
+        conversation_history: Optional[list] = None,
+        token_budget: Optional[int] = None,
+        system_prompt: Optional[str] = None,
+        summary: Optional[str] = None
+    ) -> List[dict]:
+        """
+        构建发送给模型的消息列表
+        
+        从最新到最旧依次加入历史消息，直到填满token预算；
+        如有对话摘要，附加在系统提示之后
+        """
+        budget = token_budget if token_budget is not None else settings.AI_CONTEXT_TOKEN_BUDGET
+        system_prompt = system_prompt if system_prompt is not None else settings.AI_SYSTEM_PROMPT
+        if summary:
+            system_prompt = f"{system_prompt}\n\n以下是此前对话的摘要：\n{summary}"
+        overhead = settings.AI_MESSAGE_TOKEN_OVERHEAD
+        
+        # 系统提示和当前消息始终保留
+        used = count_tokens(system_prompt) + count_tokens(message) + overhead * 2
+        
+        selected = []
+        for msg in reversed(conversation_history or []):
+            tokens = ContextBuilder.message_tokens(msg)
+            if used + tokens > budget:
+                break
+            used += tokens
+            selected.append({
+                "role": msg.role.value,
+                "content": msg.content
+            })
+        selected.reverse()
+        
+        return [{"role": "system", "content": system_prompt}] + selected + [{
+            "role": "user",
+            "content": message
+        }]
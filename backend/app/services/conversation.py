@@ -1,13 +1,23 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy import bindparam, func, select, update
 from fastapi import HTTPException, status
-from typing import List
-from app.models.conversation import Conversation
+from datetime import datetime, UTC
+from typing import List, Optional
+from app.database import session_factory_for
+from app.models.conversation import Conversation, message_preview
 from app.models.message import Message, MessageRole
 from app.models.user import User
 from app.schemas.conversation import ConversationCreate, ConversationUpdate
 from app.schemas.message import MessageCreate
 from app.services.ai import AIService
+from app.services.limiter import LimiterTimeout
+from app.services.resilience import CircuitOpenError
+from app.services.stream_registry import stream_registry
+from app.services.summary import SummaryService
+from app.utils.pagination import Page, keyset_paginate
+
+# 重新计算消息统计时每条语句处理的对话数（IN列表的参数个数）
+STATS_CHUNK = 500
 
 
 class ConversationService:
@@ -34,27 +44,118 @@ class ConversationService:
         skip: int = 0,
         limit: int = 20
     ) -> List[Conversation]:
-        """获取用户的对话列表"""
-        conversations = db.query(
-            Conversation,
-            func.count(Message.id).label("message_count")
-        ).outerjoin(
-            Message
-        ).filter(
+        """获取用户的对话列表（消息数和最后一条消息已存在对话表中，不读取消息表）"""
+        return db.query(Conversation).filter(
             Conversation.user_id == user.id
-        ).group_by(
-            Conversation.id
         ).order_by(
             Conversation.updated_at.desc()
         ).offset(skip).limit(limit).all()
+    
+    @staticmethod
+    def get_user_conversations_page(
+        db: Session,
+        user: User,
+        limit: int = 20,
+        cursor: Optional[str] = None
+    ) -> Page:
+        """按(updated_at, id)倒序的游标分页获取对话列表，只在(user_id, updated_at, id)索引上扫描对话表"""
+        query = db.query(Conversation).filter(Conversation.user_id == user.id)
+        return keyset_paginate(
+            query,
+            (Conversation.updated_at, Conversation.id),
+            limit,
+            cursor,
+            descending=True
+        )
+    
+    @staticmethod
+    def refresh_message_stats(db: Session, conversation_ids: List[int]) -> List[dict]:
+        """
+        按消息表重新计算对话的消息数和最后一条消息（批量导入、撤回消息和修复数据时使用）
+        
+        不改变对话的updated_at，但递增version，使列表和消息页的ETag与页面缓存失效；
+        返回计算出的各对话统计
+        """
+        conversations = Conversation.__table__
+        statement = update(conversations).where(
+            conversations.c.id == bindparam("_id")
+        ).values(
+            message_count=bindparam("_count"),
+            last_message_at=bindparam("_at"),
+            last_message_preview=bindparam("_preview"),
+            updated_at=conversations.c.updated_at,
+            version=conversations.c.version + 1
+        )
         
-        # 添加消息计数到对话对象
-        result = []
-        for conv, msg_count in conversations:
-            conv.message_count = msg_count
-            result.append(conv)
+        computed = []
+        for start in range(0, len(conversation_ids), STATS_CHUNK):
+            chunk = conversation_ids[start:start + STATS_CHUNK]
+            counts = db.execute(
+                select(
+                    Message.conversation_id,
+                    func.count(Message.id),
+                    func.max(Message.id)
+                ).where(
+                    Message.conversation_id.in_(chunk)
+                ).group_by(Message.conversation_id)
+            ).all()
+            last_messages = {
+                row.id: row
+                for row in db.execute(
+                    select(Message.id, Message.created_at, Message.content).where(
+                        Message.id.in_([last_id for _, _, last_id in counts])
+                    )
+                )
+            }
+            stats = {conversation_id: (count, last_messages[last_id]) for conversation_id, count, last_id in counts}
+            
+            values = []
+            for conversation_id in chunk:
+                count, last = stats.get(conversation_id, (0, None))
+                values.append({
+                    "_id": conversation_id,
+                    "_count": count,
+                    "_at": last.created_at if last else None,
+                    "_preview": message_preview(last.content) if last else None
+                })
+            if values:
+                db.connection().execute(statement, values)
+            computed.extend(values)
+        return computed
+    
+    @staticmethod
+    def get_conversations_version(db: Session, user: User) -> tuple:
+        """
+        用户对话列表的版本
         
-        return result
+        新增消息、改名、统计变化都会递增对话的version，删除对话会改变数量；
+        只读取用户自己的对话行，不读取消息
+        """
+        count, max_id, total_version = db.query(
+            func.count(Conversation.id),
+            func.max(Conversation.id),
+            func.coalesce(func.sum(Conversation.version), 0)
+        ).filter(
+            Conversation.user_id == user.id
+        ).one()
+        return count, max_id, int(total_version)
+    
+    @staticmethod
+    def get_messages_version(db: Session, user: User, conversation_id: int) -> Optional[tuple]:
+        """
+        对话消息列表的版本：对话的version和最新消息ID（在索引上取得，不读取消息行）
+        
+        正在生成回复时消息内容持续变化，返回None表示不缓存
+        """
+        # 验证对话所有权
+        conversation = ConversationService.get_conversation(db, user, conversation_id)
+        if stream_registry.generating(conversation_id):
+            return None
+        
+        last_message_id = db.query(func.max(Message.id)).filter(
+            Message.conversation_id == conversation_id
+        ).scalar()
+        return conversation.version, last_message_id
     
     @staticmethod
     def get_conversation(
@@ -110,28 +211,56 @@ class ConversationService:
         conversation_id: int,
         message_data: MessageCreate
     ) -> tuple[Message, Message]:
-        """发送消息并获取AI回复"""
+        """
+        发送消息并获取AI回复
+        
+        拆成两个短事务：先保存用户消息并读取历史，提交后归还数据库连接再调用AI；
+        拿到回复后重新取连接保存AI消息，避免生成期间占用连接池
+        """
         # 验证对话所有权
         conversation = ConversationService.get_conversation(db, user, conversation_id)
         
-        # 创建用户消息
+        # 获取对话历史（已折叠进摘要的消息除外）
+        history = db.query(Message).filter(
+            Message.conversation_id == conversation_id,
+            Message.id > (conversation.summary_message_id or 0)
+        ).order_by(Message.created_at).all()
+        summary = conversation.summary
+        first_turn = len(history) == 0 and conversation.summary_message_id is None
+        
+        # 历史消息脱离会话，提交后保持已加载的属性，AI调用期间不会触发懒加载重新占用连接
+        for msg in history:
+            db.expunge(msg)
+        
+        # 创建用户消息，提交后连接归还连接池
         user_message = Message(
             conversation_id=conversation_id,
             role=MessageRole.USER,
             content=message_data.content
         )
         db.add(user_message)
-        
-        # 获取对话历史
-        history = db.query(Message).filter(
-            Message.conversation_id == conversation_id
-        ).order_by(Message.created_at).all()
+        conversation.updated_at = datetime.now(UTC)
+        db.commit()
         
         # 调用AI服务获取回复
-        ai_response = await AIService.get_ai_response(
-            message_data.content,
-            history
-        )
+        try:
+            ai_response = await AIService.get_ai_response(
+                message_data.content,
+                history,
+                summary=summary
+            )
+        except (CircuitOpenError, LimiterTimeout) as e:
+            # 熔断中或排队超时时撤回用户消息，客户端按Retry-After重试不会产生重复消息
+            db.delete(user_message)
+            conversation.updated_at = datetime.now(UTC)
+            db.flush()
+            ConversationService.refresh_message_stats(db, [conversation_id])
+            db.commit()
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail=str(e),
+                headers={"Retry-After": str(int(e.retry_after) + 1)}
+            )
         
         # 创建AI回复消息
         ai_message = Message(
@@ -142,10 +271,10 @@ class ConversationService:
         db.add(ai_message)
         
         # 更新对话的更新时间
-        conversation.updated_at = func.now()
+        conversation.updated_at = datetime.now(UTC)
         
         # 如果是第一条消息，使用用户输入作为对话标题
-        if len(history) == 0 and conversation.title == "新对话":
+        if first_turn and conversation.title == "新对话":
             # 截取前50个字符作为标题
             conversation.title = message_data.content[:50] + ("..." if len(message_data.content) > 50 else "")
         
@@ -153,6 +282,10 @@ class ConversationService:
         db.refresh(user_message)
         db.refresh(ai_message)
         
+        # 未摘要部分过长时在后台更新滚动摘要
+        if SummaryService.needs_summary(history + [user_message, ai_message]):
+            SummaryService.schedule(session_factory_for(db), conversation_id)
+        
         return user_message, ai_message
     
     @staticmethod
@@ -173,4 +306,19 @@ class ConversationService:
             Message.created_at
         ).offset(skip).limit(limit).all()
         
-        return messages 
\ No newline at end of file
+        return messages
+    
+    @staticmethod
+    def get_conversation_messages_page(
+        db: Session,
+        user: User,
+        conversation_id: int,
+        limit: int = 100,
+        cursor: Optional[str] = None
+    ) -> Page:
+        """按(created_at, id)正序的游标分页获取对话中的消息，游标可向后或向前翻页"""
+        # 验证对话所有权
+        ConversationService.get_conversation(db, user, conversation_id)
+        
+        query = db.query(Message).filter(Message.conversation_id == conversation_id)
+        return keyset_paginate(query, (Message.created_at, Message.id), limit, cursor)
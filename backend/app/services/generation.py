@@ -0,0 +1,396 @@
+import asyncio
+import time
+from datetime import datetime, UTC
+from typing import List, Optional
+from sqlalchemy import Text, literal
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import flag_modified
+from app.config import settings
+from app.database import session_factory_for
+from app.models.conversation import Conversation, message_preview
+from app.models.message import Message, MessageRole, MessageStatus
+from app.models.user import User
+from app.services.ai import AIService
+from app.services.conversation import ConversationService
+from app.services.limiter import LimiterTimeout
+from app.services.resilience import CircuitOpenError
+from app.services.stream_registry import StreamSession, stream_registry
+from app.services.summary import SummaryService
+from app.utils.compression import RawText, should_compress
+from app.utils.sse import coalesce
+from app.utils.tokenizer import count_tokens
+
+
+class GenerationStats:
+    """
+    生成完成与取消统计
+    
+    取消节省的token按已完成回复的平均长度减去取消时已生成的长度估算，
+    节省的秒数按平均生成速度换算
+    """
+    
+    def __init__(self):
+        self.completed = 0
+        self.cancelled = {"disconnect": 0, "stop": 0}
+        self.avg_reply_tokens: Optional[float] = None
+        self.avg_tokens_per_second: Optional[float] = None
+        self.tokens_before_cancel = 0
+        self.estimated_tokens_saved = 0
+        self.estimated_seconds_saved = 0.0
+    
+    def record_complete(self, tokens: int, seconds: float) -> None:
+        self.completed += 1
+        if tokens <= 0:
+            return
+        self.avg_reply_tokens = tokens if self.avg_reply_tokens is None else 0.9 * self.avg_reply_tokens + 0.1 * tokens
+        if seconds > 0:
+            rate = tokens / seconds
+            self.avg_tokens_per_second = rate if self.avg_tokens_per_second is None else 0.9 * self.avg_tokens_per_second + 0.1 * rate
+    
+    def record_cancel(self, reason: str, tokens: int) -> None:
+        self.cancelled[reason] = self.cancelled.get(reason, 0) + 1
+        self.tokens_before_cancel += tokens
+        if self.avg_reply_tokens is None:
+            return
+        saved = max(0.0, self.avg_reply_tokens - tokens)
+        self.estimated_tokens_saved += int(saved)
+        if self.avg_tokens_per_second:
+            self.estimated_seconds_saved += saved / self.avg_tokens_per_second
+    
+    def stats(self) -> dict:
+        return {
+            "completed": self.completed,
+            "cancelled": dict(self.cancelled),
+            "tokens_before_cancel": self.tokens_before_cancel,
+            "estimated_tokens_saved": self.estimated_tokens_saved,
+            "estimated_seconds_saved": round(self.estimated_seconds_saved, 1)
+        }
+
+
+# 全局生成统计
+generation_stats = GenerationStats()
+
+
+class MessageCheckpoint:
+    """
+    生成中的AI消息检查点
+    
+    首次写入时插入一条streaming状态的消息，之后每累计AI_CHECKPOINT_TOKENS个token
+    或距上次写入超过AI_CHECKPOINT_INTERVAL秒时，只把新增的部分追加到content末尾，
+    进程崩溃时已写入的部分不会丢失
+    """
+    
+    def __init__(self, session_factory, conversation_id: int):
+        self.session_factory = session_factory
+        self.conversation_id = conversation_id
+        self.message_id: Optional[int] = None
+        self.pending: List[str] = []
+        self.pending_tokens = 0
+        self.tokens = 0
+        self.writes = 0
+        self.last_write = time.monotonic()
+    
+    def add(self, chunk: str) -> None:
+        tokens = count_tokens(chunk)
+        self.pending.append(chunk)
+        self.pending_tokens += tokens
+        self.tokens += tokens
+        if (
+            self.pending_tokens >= settings.AI_CHECKPOINT_TOKENS
+            or time.monotonic() - self.last_write >= settings.AI_CHECKPOINT_INTERVAL
+        ):
+            self.flush()
+    
+    def _take(self) -> str:
+        delta = "".join(self.pending)
+        self.pending = []
+        self.pending_tokens = 0
+        self.last_write = time.monotonic()
+        return delta
+    
+    def _append(self, db, delta: str, status: MessageStatus) -> None:
+        # 生成中的内容保持原文，在数据库中直接拼接（增量按Text绑定，不经过压缩），检索用的原文同步追加
+        db.query(Message).filter(Message.id == self.message_id).update(
+            {
+                Message.content: Message.content + literal(delta, Text),
+                Message.search_text: Message.search_text + literal(delta, Text),
+                Message.status: status.value
+            },
+            synchronize_session=False
+        )
+    
+    def flush(self) -> None:
+        """把未写入的部分作为一次短事务写入数据库，失败时保留到下次再写"""
+        if not self.pending:
+            return
+        db = self.session_factory()
+        try:
+            delta = "".join(self.pending)
+            if self.message_id is None:
+                message = Message(
+                    conversation_id=self.conversation_id,
+                    role=MessageRole.ASSISTANT,
+                    content=RawText(delta),
+                    status=MessageStatus.STREAMING.value
+                )
+                db.add(message)
+                db.flush()
+                self.message_id = message.id
+            else:
+                self._append(db, delta, MessageStatus.STREAMING)
+            # 同时更新对话时间，列表接口的版本随之变化
+            db.query(Conversation).filter(Conversation.id == self.conversation_id).update(
+                {Conversation.updated_at: datetime.now(UTC)},
+                synchronize_session=False
+            )
+            db.commit()
+            self._take()
+            self.writes += 1
+        except Exception as e:
+            db.rollback()
+            print(f"AI回复检查点写入失败: {str(e)}")
+        finally:
+            db.close()
+    
+    def finalize(self, db, status: MessageStatus, content: Optional[str] = None) -> Message:
+        """
+        在调用方的事务中写入最终状态
+        
+        未写过检查点时插入完整消息；否则追加剩余部分。
+        传入content时（如出错改写为错误提示）整体替换已写入的内容
+        """
+        if self.message_id is None:
+            message = Message(
+                conversation_id=self.conversation_id,
+                role=MessageRole.ASSISTANT,
+                content=content if content is not None else self._take(),
+                status=status.value
+            )
+            db.add(message)
+            db.flush()
+            self.message_id = message.id
+            return message
+        
+        if content is not None:
+            self._take()
+            db.query(Message).filter(Message.id == self.message_id).update(
+                {Message.content: content, Message.search_text: content, Message.status: status.value},
+                synchronize_session=False
+            )
+        else:
+            self._append(db, self._take(), status)
+        message = db.get(Message, self.message_id)
+        # 追加和替换都是批量UPDATE，不经过content的校验器，按完整内容重新计算token数
+        message.token_count = count_tokens(message.content)
+        if should_compress(message.content):
+            # 生成结束后内容不再变化，整体重写一次以压缩保存
+            flag_modified(message, "content")
+        return message
+
+
+class GenerationService:
+    @staticmethod
+    def begin(
+        db: Session,
+        user: User,
+        conversation_id: int,
+        content: str,
+        flush_ms: Optional[int] = None
+    ) -> StreamSession:
+        """
+        保存用户消息、读取历史并在后台启动流式生成（SSE和WebSocket共用）
+        
+        生成任务使用独立会话，返回前关闭传入的会话，流式响应期间不再占用连接
+        """
+        try:
+            # 验证对话所有权
+            conversation = ConversationService.get_conversation(db, user, conversation_id)
+            
+            # 创建用户消息
+            user_message = Message(
+                conversation_id=conversation_id,
+                role=MessageRole.USER,
+                content=content
+            )
+            db.add(user_message)
+            conversation.updated_at = datetime.now(UTC)
+            db.commit()
+            db.refresh(user_message)
+            
+            # 获取对话历史（已折叠进摘要的消息除外）
+            history = db.query(Message).filter(
+                Message.conversation_id == conversation_id,
+                Message.id > (conversation.summary_message_id or 0)
+            ).order_by(Message.created_at).all()
+            summary = conversation.summary
+            
+            # 协商的刷新间隔不超过服务端上限
+            if flush_ms is None:
+                flush_ms = settings.SSE_FLUSH_INTERVAL_MS
+            flush_interval = min(flush_ms, settings.SSE_MAX_FLUSH_INTERVAL_MS) / 1000
+            
+            stream = GenerationService.start(
+                session_factory_for(db),
+                user.id,
+                conversation_id,
+                user_message,
+                history,
+                summary,
+                # history包含了刚添加的用户消息
+                first_turn=len(history) == 1 and conversation.summary_message_id is None,
+                flush_interval=flush_interval
+            )
+            return stream
+        finally:
+            db.close()
+    
+    @staticmethod
+    def start(
+        session_factory,
+        user_id: int,
+        conversation_id: int,
+        user_message: Message,
+        history: list,
+        summary: Optional[str],
+        first_turn: bool,
+        flush_interval: float
+    ) -> StreamSession:
+        """登记事件流并在后台任务中生成AI回复（不依赖发起请求的HTTP连接）"""
+        stream = stream_registry.create(user_id, conversation_id)
+        stream.publish({
+            'type': 'stream_start',
+            'stream_id': stream.id
+        })
+        stream.publish({
+            'type': 'user_message',
+            'message': {'id': user_message.id, 'content': user_message.content, 'role': 'user'}
+        })
+        stream.task = asyncio.create_task(GenerationService._run(
+            stream,
+            session_factory,
+            conversation_id,
+            user_message.id,
+            user_message.content,
+            history,
+            summary,
+            first_turn,
+            flush_interval
+        ))
+        # 任务在开始执行前就被取消时也要结束事件流
+        stream.task.add_done_callback(lambda task: stream.done or GenerationService._close(stream))
+        return stream
+    
+    @staticmethod
+    def _close(stream: StreamSession) -> None:
+        stream.publish({'type': 'done'})
+        stream.finish()
+    
+    @staticmethod
+    def _retract(session_factory, conversation_id: int, user_message_id: int) -> None:
+        """撤回用户消息并重新计算对话统计，客户端按retry_after重试不会产生重复消息"""
+        db = session_factory()
+        try:
+            db.query(Message).filter(Message.id == user_message_id).delete(synchronize_session=False)
+            ConversationService.refresh_message_stats(db, [conversation_id])
+            db.commit()
+        finally:
+            db.close()
+    
+    @staticmethod
+    async def _run(
+        stream: StreamSession,
+        session_factory,
+        conversation_id: int,
+        user_message_id: int,
+        content: str,
+        history: list,
+        summary: Optional[str],
+        first_turn: bool,
+        flush_interval: float
+    ) -> None:
+        started = time.monotonic()
+        try:
+            # 发送AI回复开始标记
+            stream.publish({'type': 'ai_start'})
+            
+            # 收集AI回复内容（列表累积，结束时一次拼接），并定期写入检查点
+            ai_chunks = []
+            checkpoint = MessageCheckpoint(session_factory, conversation_id)
+            replacement: Optional[str] = None
+            status = MessageStatus.COMPLETE
+            try:
+                # 当前用户消息会单独附加到上下文末尾，这里从历史中排除
+                context_history = [msg for msg in history if msg.id != user_message_id]
+                source = AIService.get_ai_response_stream(content, context_history, summary)
+                # 细碎分块按字节阈值或刷新间隔合并成一个事件
+                async for chunk in coalesce(source, settings.SSE_FLUSH_BYTES, flush_interval):
+                    if chunk:  # 确保chunk不为空
+                        ai_chunks.append(chunk)
+                        stream.publish({'type': 'ai_chunk', 'content': chunk})
+                        checkpoint.add(chunk)
+            except asyncio.CancelledError:
+                # 客户端断开或主动停止：上游请求已随取消关闭，保存已生成的部分
+                status = MessageStatus.TRUNCATED
+            except (CircuitOpenError, LimiterTimeout) as circuit_error:
+                # 上游熔断中或排队超时（过载）：撤回已提交的用户消息，发送明确的错误事件，不保存AI回复
+                GenerationService._retract(session_factory, conversation_id, user_message_id)
+                stream.publish({
+                    'type': 'error',
+                    'code': 'upstream_unavailable',
+                    'message': str(circuit_error),
+                    'retry_after': round(circuit_error.retry_after, 1)
+                })
+                return
+            except Exception as ai_error:
+                error_msg = f"AI服务错误: {str(ai_error)}"
+                ai_chunks = [error_msg]
+                replacement = error_msg
+                stream.publish({'type': 'ai_chunk', 'content': error_msg})
+            ai_content = "".join(ai_chunks)
+            
+            tokens = checkpoint.tokens if replacement is None else count_tokens(ai_content)
+            if status == MessageStatus.TRUNCATED:
+                generation_stats.record_cancel(stream.cancel_reason or "disconnect", tokens)
+                if not ai_content:
+                    # 尚未生成任何内容时不保存AI回复
+                    return
+            else:
+                generation_stats.record_complete(tokens, time.monotonic() - started)
+            
+            # 保存AI回复消息（使用独立的数据库会话）
+            db = session_factory()
+            try:
+                if not ai_content:
+                    replacement = "抱歉，AI服务暂时不可用。"
+                ai_message = checkpoint.finalize(db, status, replacement)
+                
+                # 更新对话时间、最后一条消息预览（检查点插入时只有开头部分）和标题
+                conversation = db.get(Conversation, conversation_id)
+                conversation.updated_at = datetime.now(UTC)
+                conversation.last_message_preview = message_preview(ai_message.content)
+                if first_turn and conversation.title == "新对话":
+                    conversation.title = content[:50] + ("..." if len(content) > 50 else "")
+                
+                db.commit()
+                db.refresh(ai_message)
+                
+                # 未摘要部分过长时在后台更新滚动摘要
+                if SummaryService.needs_summary(history + [ai_message]):
+                    SummaryService.schedule(session_factory, conversation_id)
+                
+                # 发送AI回复完成标记
+                stream.publish({
+                    'type': 'ai_complete',
+                    'message': {'id': ai_message.id, 'content': ai_content, 'role': 'assistant', 'status': status.value}
+                })
+            
+            except Exception as db_error:
+                stream.publish({'type': 'error', 'message': f'数据库错误: {str(db_error)}'})
+            finally:
+                db.close()
+        
+        except Exception as stream_error:
+            stream.publish({'type': 'error', 'message': f'流式处理错误: {str(stream_error)}'})
+        finally:
+            # 发送结束标记
+            GenerationService._close(stream)
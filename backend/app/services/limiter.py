@@ -0,0 +1,183 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+import httpx
+import openai
+from app.config import settings
+
+
+class LimiterTimeout(Exception):
+    """排队等待上游并发名额超时"""
+    
+    # 建议客户端重试前等待的秒数
+    retry_after = 5.0
+    
+    def __init__(self, waited: float):
+        super().__init__(f"AI服务繁忙，排队{waited:.1f}秒后仍未获得处理名额，请稍后重试")
+        self.waited = waited
+
+
+def is_overload_error(error: BaseException) -> bool:
+    """判断是否为上游过载信号（429、超时）"""
+    return isinstance(error, (
+        openai.RateLimitError,
+        openai.APITimeoutError,
+        asyncio.TimeoutError,
+        httpx.TimeoutException
+    ))
+
+
+class Permit:
+    """一次上游调用占用的并发名额"""
+    
+    def __init__(self):
+        self.started = time.monotonic()
+        self.latency: Optional[float] = None
+    
+    def mark_first_token(self) -> None:
+        """流式调用以首token延迟作为延迟信号"""
+        if self.latency is None:
+            self.latency = time.monotonic() - self.started
+
+
+class AdaptiveLimiter:
+    """
+    AIMD自适应并发限制器
+    
+    延迟正常时每完成一个"窗口"的请求并发上限加1；
+    遇到429、超时或首token延迟突增时按比例下调上限。
+    """
+    
+    def __init__(
+        self,
+        initial_limit: int,
+        min_limit: int,
+        max_limit: int,
+        backoff: float = 0.7,
+        latency_tolerance: float = 2.0,
+        queue_timeout: float = 30.0
+    ):
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.latency_tolerance = latency_tolerance
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.baseline_latency: Optional[float] = None
+        self._waiters: deque = deque()
+        self._last_decrease = 0.0
+        
+        # 监控指标
+        self.acquired = 0
+        self.timeouts = 0
+        self.decreases = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+    
+    def _wake(self) -> None:
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+    
+    async def acquire(self, timeout: Optional[float] = None) -> None:
+        """获取并发名额，超过排队时间上限时抛出LimiterTimeout"""
+        started = time.monotonic()
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await asyncio.wait([waiter], timeout=timeout if timeout is not None else self.queue_timeout)
+            except asyncio.CancelledError:
+                if waiter.done():
+                    self.release()
+                else:
+                    waiter.cancel()
+                raise
+            if not waiter.done():
+                waiter.cancel()
+                self._waiters.remove(waiter)
+                self.timeouts += 1
+                raise LimiterTimeout(time.monotonic() - started)
+        
+        waited = time.monotonic() - started
+        self.acquired += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+    
+    def release(self) -> None:
+        self.in_flight -= 1
+        self._wake()
+    
+    def on_success(self, latency: Optional[float] = None) -> None:
+        """记录一次成功调用（latency为首token延迟，非流式调用不提供）"""
+        if latency is not None:
+            if self.baseline_latency is None:
+                self.baseline_latency = latency
+            if latency > self.baseline_latency * self.latency_tolerance:
+                # 基线缓慢跟随，避免上游整体变慢后持续误判
+                self.baseline_latency = 0.98 * self.baseline_latency + 0.02 * latency
+                self.on_overload()
+                return
+            self.baseline_latency = 0.9 * self.baseline_latency + 0.1 * latency
+        
+        # 加性增：每完成约limit个请求，上限加1
+        self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+        self._wake()
+    
+    def on_overload(self) -> None:
+        """乘性减：同一延迟窗口内的多次过载信号只下调一次"""
+        now = time.monotonic()
+        window = self.baseline_latency or 1.0
+        if now - self._last_decrease < window:
+            return
+        self._last_decrease = now
+        self.limit = max(self.min_limit, self.limit * self.backoff)
+        self.decreases += 1
+    
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[Permit]:
+        """占用名额执行一次上游调用，并根据结果调整并发上限"""
+        await self.acquire()
+        permit = Permit()
+        try:
+            yield permit
+        except Exception as e:
+            if is_overload_error(e):
+                self.on_overload()
+            raise
+        else:
+            # 总耗时随回复长度变化，不作为延迟信号；非流式调用依靠429/超时信号下调
+            self.on_success(permit.latency)
+        finally:
+            self.release()
+    
+    def stats(self) -> dict:
+        return {
+            "limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "queue_depth": len(self._waiters),
+            "baseline_latency_ms": round(self.baseline_latency * 1000, 1) if self.baseline_latency else None,
+            "acquired": self.acquired,
+            "avg_wait_ms": round(self.total_wait / self.acquired * 1000, 3) if self.acquired else 0.0,
+            "max_wait_ms": round(self.max_wait * 1000, 3),
+            "timeouts": self.timeouts,
+            "decreases": self.decreases
+        }
+
+
+# 全局上游并发限制器
+ai_limiter = AdaptiveLimiter(
+    initial_limit=settings.AI_LIMITER_INITIAL,
+    min_limit=settings.AI_LIMITER_MIN,
+    max_limit=settings.AI_LIMITER_MAX,
+    backoff=settings.AI_LIMITER_BACKOFF,
+    latency_tolerance=settings.AI_LIMITER_LATENCY_TOLERANCE,
+    queue_timeout=settings.AI_LIMITER_QUEUE_TIMEOUT
+)
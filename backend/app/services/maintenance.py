@@ -0,0 +1,164 @@
+from datetime import datetime, timedelta, UTC
+from typing import Dict, Optional
+from sqlalchemy import Text, bindparam, select, type_coerce, update
+from sqlalchemy.orm import Session
+from app.models.conversation import Conversation
+from app.models.message import Message, MessageStatus
+from app.services.conversation import ConversationService
+from app.utils.compression import active_codec, codec_for, decode, encode
+from app.utils.tokenizer import count_tokens
+
+
+class MaintenanceService:
+    """数据维护任务（由manage.py调用，可在服务运行时执行）"""
+    
+    @staticmethod
+    def compress_messages(
+        db: Session,
+        batch_size: int = 1000,
+        codec: Optional[str] = None,
+        decompress: bool = False
+    ) -> Dict[str, int]:
+        """
+        按ID分批把已有消息改写为压缩存储（decompress时还原为原文）
+        
+        codec为zlib / zstd，默认使用MESSAGE_COMPRESSION的配置；
+        
+        直接读写列中的存储形式，只更新形式有变化的行，每批单独提交，中断后重新运行即可继续；
+        生成中的消息跳过，生成结束时会自动压缩
+        """
+        target = None if decompress else (codec_for(codec) if codec else active_codec())
+        if not decompress and target is None:
+            raise ValueError("未指定压缩编码（--codec或MESSAGE_COMPRESSION）")
+        table = Message.__table__
+        stored = type_coerce(table.c.content, Text)
+        statement = update(table).where(
+            table.c.id == bindparam("_id")
+        ).values(content=bindparam("_content", type_=Text))
+        
+        result = {"scanned": 0, "rewritten": 0, "bytes_before": 0, "bytes_after": 0}
+        last_id = 0
+        while True:
+            rows = db.execute(
+                select(table.c.id, stored.label("content")).where(
+                    table.c.id > last_id,
+                    table.c.status != MessageStatus.STREAMING.value
+                ).order_by(table.c.id).limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            last_id = rows[-1].id
+            
+            changes = []
+            for row in rows:
+                text = decode(row.content)
+                value = encode(text, target)
+                before = len(row.content.encode("utf-8"))
+                after = len(value.encode("utf-8")) if value != row.content else before
+                result["bytes_before"] += before
+                result["bytes_after"] += after
+                if value != row.content:
+                    changes.append({"_id": row.id, "_content": value})
+            if changes:
+                db.connection().execute(statement, changes)
+            db.commit()
+            result["scanned"] += len(rows)
+            result["rewritten"] += len(changes)
+        return result
+    
+    @staticmethod
+    def fill_search_text(db: Session, batch_size: int = 1000) -> Dict[str, int]:
+        """
+        为升级前写入的消息回填检索用的原文（search_text，MySQL全文索引建在此列上）
+        
+        按ID分批处理，每批单独提交，中断后重新运行即可继续；新写入的消息在写入时即带有原文
+        """
+        table = Message.__table__
+        stored = type_coerce(table.c.content, Text)
+        statement = update(table).where(
+            table.c.id == bindparam("_id")
+        ).values(search_text=bindparam("_text"))
+        
+        result = {"filled": 0}
+        last_id = 0
+        while True:
+            rows = db.execute(
+                select(table.c.id, stored.label("content")).where(
+                    table.c.id > last_id,
+                    table.c.search_text.is_(None)
+                ).order_by(table.c.id).limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            last_id = rows[-1].id
+            db.connection().execute(statement, [{"_id": row.id, "_text": decode(row.content)} for row in rows])
+            db.commit()
+            result["filled"] += len(rows)
+        return result
+    
+    @staticmethod
+    def repair_conversations(db: Session, batch_size: int = 500) -> Dict[str, int]:
+        """
+        按消息表重新计算全部对话的消息数和最后一条消息（升级后回填、修复不一致的数据）
+        
+        按对话ID分批处理，每批单独提交
+        """
+        result = {"scanned": 0, "repaired": 0}
+        last_id = 0
+        while True:
+            rows = db.execute(
+                select(
+                    Conversation.id,
+                    Conversation.message_count,
+                    Conversation.last_message_at,
+                    Conversation.last_message_preview
+                ).where(
+                    Conversation.id > last_id
+                ).order_by(Conversation.id).limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            last_id = rows[-1].id
+            
+            computed = ConversationService.refresh_message_stats(db, [row.id for row in rows])
+            db.commit()
+            result["scanned"] += len(rows)
+            result["repaired"] += sum(
+                1 for row, values in zip(rows, computed)
+                if (row.message_count, row.last_message_at, row.last_message_preview)
+                != (values["_count"], values["_at"], values["_preview"])
+            )
+        return result
+    
+    @staticmethod
+    def recover_streaming(db: Session, older_than: float = 600.0) -> Dict[str, int]:
+        """
+        把生成进程已退出（崩溃或被强制终止）而遗留为streaming状态的消息标记为truncated
+        
+        检查点每次写入都会更新对话时间，对话超过older_than秒没有写入的视为生成已中断，
+        仍在生成的回复不受影响；同时按已写入的内容重新计算token数，并递增对话的version使页面缓存失效
+        """
+        cutoff = datetime.now(UTC) - timedelta(seconds=older_than)
+        messages = db.query(Message).join(
+            Conversation, Conversation.id == Message.conversation_id
+        ).filter(
+            Message.status == MessageStatus.STREAMING.value,
+            Conversation.updated_at < cutoff
+        ).all()
+        for message in messages:
+            message.status = MessageStatus.TRUNCATED.value
+            message.token_count = count_tokens(message.content)
+        
+        conversation_ids = sorted({message.conversation_id for message in messages})
+        if conversation_ids:
+            conversations = Conversation.__table__
+            db.execute(
+                update(conversations).where(
+                    conversations.c.id.in_(conversation_ids)
+                ).values(
+                    updated_at=conversations.c.updated_at,
+                    version=conversations.c.version + 1
+                )
+            )
+        db.commit()
+        return {"recovered": len(messages), "conversations": len(conversation_ids)}
@@ -0,0 +1,129 @@
+import hashlib
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Tuple
+from fastapi import Response
+from app.config import settings
+from app.utils.serialization import msgpack, response_media_type
+
+
+class CachedPage:
+    """一个已编码的响应：正文字节、媒体类型和需要原样返回的响应头（如分页游标）"""
+    
+    __slots__ = ("body", "media_type", "headers")
+    
+    def __init__(self, body: bytes, media_type: str, headers: Dict[str, str]):
+        self.body = body
+        self.media_type = media_type
+        self.headers = headers
+
+
+class PageCache:
+    """
+    列表接口的条件请求与序列化响应缓存
+    
+    键包含资源的版本（对话更新时间、最新消息ID等），数据变化后版本随之改变，
+    旧条目不会再被命中，按LRU淘汰即可，无需主动失效；容量按正文总字节数限制
+    """
+    
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._data: "OrderedDict[tuple, CachedPage]" = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.evictions = 0
+    
+    def get(self, key: tuple) -> Optional[CachedPage]:
+        page = self._data.get(key)
+        if page is None:
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return page
+    
+    def set(self, key: tuple, page: CachedPage) -> None:
+        if len(page.body) > self.max_bytes:
+            return
+        previous = self._data.pop(key, None)
+        if previous is not None:
+            self.bytes -= len(previous.body)
+        self._data[key] = page
+        self.bytes += len(page.body)
+        while self.bytes > self.max_bytes:
+            _, evicted = self._data.popitem(last=False)
+            self.bytes -= len(evicted.body)
+            self.evictions += 1
+    
+    def clear(self) -> None:
+        self._data.clear()
+        self.bytes = 0
+    
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._data),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "not_modified": self.not_modified,
+            "evictions": self.evictions
+        }
+    
+    @staticmethod
+    def make_etag(key: tuple) -> str:
+        """由缓存键生成强ETag（键中含响应格式，JSON和msgpack表示的ETag不同）"""
+        return '"' + hashlib.sha1(repr(key).encode("utf-8")).hexdigest()[:32] + '"'
+    
+    @staticmethod
+    def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+        """If-None-Match按弱比较匹配（忽略W/前缀），*匹配任意版本"""
+        if not if_none_match:
+            return False
+        for candidate in if_none_match.split(","):
+            candidate = candidate.strip()
+            if candidate == "*" or candidate.removeprefix("W/") == etag:
+                return True
+        return False
+    
+    def respond(
+        self,
+        key: Optional[tuple],
+        if_none_match: Optional[str],
+        render: Callable[[], Tuple[Response, Dict[str, str]]]
+    ) -> Response:
+        """
+        按版本化的键应答列表请求
+        
+        ETag匹配时直接返回304；命中缓存时返回已编码的字节；否则调用render查询并编码，
+        render返回响应及需要随缓存保存的响应头。key为None表示资源正在变化，不缓存也不带ETag
+        """
+        if key is None:
+            response, _ = render()
+            return response
+        
+        key = key + (response_media_type(),)
+        etag = self.make_etag(key)
+        headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+        if msgpack is not None:
+            headers["Vary"] = "Accept"
+        
+        if self.etag_matches(if_none_match, etag):
+            self.not_modified += 1
+            return Response(status_code=304, headers=headers)
+        
+        page = self.get(key)
+        if page is None:
+            response, page_headers = render()
+            if response.status_code != 200:
+                return response
+            page = CachedPage(bytes(response.body), response.media_type, page_headers)
+            self.set(key, page)
+        return Response(page.body, media_type=page.media_type, headers={**page.headers, **headers})
+
+
+# 全局列表响应缓存
+page_cache = PageCache(settings.PAGE_CACHE_MAX_BYTES)
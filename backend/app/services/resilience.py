@@ -0,0 +1,207 @@
+import asyncio
+import time
+from collections import deque
+from typing import AsyncGenerator, Callable, Optional
+import httpx
+import openai
+from app.config import settings
+
+
+class CircuitOpenError(Exception):
+    """上游不健康，熔断器处于打开状态"""
+    
+    def __init__(self, retry_after: float):
+        super().__init__(f"AI服务暂时不可用，请在{retry_after:.0f}秒后重试")
+        self.retry_after = retry_after
+
+
+def is_upstream_failure(error: BaseException) -> bool:
+    """判断是否为上游健康问题（连接失败、超时、429、5xx），客户端参数错误不计入"""
+    return isinstance(error, (
+        openai.APIConnectionError,
+        openai.RateLimitError,
+        openai.InternalServerError,
+        asyncio.TimeoutError,
+        httpx.TransportError
+    ))
+
+
+class LatencyTracker:
+    """最近若干次首token延迟（TTFT）的滑动窗口"""
+    
+    def __init__(self, window: int = 200):
+        self.samples: deque = deque(maxlen=window)
+    
+    def record(self, latency: float) -> None:
+        self.samples.append(latency)
+    
+    def percentile(self, p: float) -> Optional[float]:
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, int(len(ordered) * p / 100))
+        return ordered[index]
+
+
+class CircuitBreaker:
+    """
+    熔断器
+    
+    连续失败达到阈值后打开，打开期间直接失败；
+    冷却时间过后进入半开状态，放行一个探测请求，成功则关闭。
+    """
+    
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+    
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.rejected = 0
+        self.trips = 0
+        self._probing = False
+    
+    @property
+    def closed(self) -> bool:
+        return self.state == self.CLOSED
+    
+    def before_call(self) -> None:
+        """调用前检查，熔断中抛出CircuitOpenError"""
+        if self.state == self.CLOSED:
+            return
+        elapsed = time.monotonic() - self.opened_at
+        if self.state == self.OPEN and elapsed >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN and not self._probing:
+            self._probing = True
+            return
+        self.rejected += 1
+        raise CircuitOpenError(max(0.0, self.reset_timeout - elapsed))
+    
+    def on_success(self) -> None:
+        self.state = self.CLOSED
+        self.failures = 0
+        self._probing = False
+    
+    def on_failure(self, error: BaseException) -> None:
+        if not is_upstream_failure(error):
+            # 非健康类错误只结束探测，不计入失败
+            self._probing = False
+            return
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                self.trips += 1
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+        self._probing = False
+    
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "trips": self.trips,
+            "rejected": self.rejected
+        }
+
+
+class Hedger:
+    """对冲请求：首token迟迟未到时并发发起第二次尝试，采用先返回的结果"""
+    
+    def __init__(self, tracker: LatencyTracker):
+        self.tracker = tracker
+        self.hedged = 0
+        self.hedge_wins = 0
+    
+    def delay(self) -> Optional[float]:
+        """对冲等待时间：最近TTFT的指定分位数，样本不足时不对冲"""
+        if not settings.AI_HEDGE_ENABLED or len(self.tracker.samples) < settings.AI_HEDGE_MIN_SAMPLES:
+            return None
+        return max(settings.AI_HEDGE_MIN_DELAY, self.tracker.percentile(settings.AI_HEDGE_PERCENTILE))
+    
+    @staticmethod
+    def _succeeded(task: asyncio.Future) -> bool:
+        error = task.exception()
+        return error is None or isinstance(error, StopAsyncIteration)
+    
+    @staticmethod
+    async def _discard(source: AsyncGenerator, pending: asyncio.Future) -> None:
+        """取消未胜出的尝试并关闭其上游连接"""
+        pending.cancel()
+        await asyncio.wait([pending])
+        if not pending.cancelled():
+            # 标记异常已读取，避免告警
+            pending.exception()
+        await source.aclose()
+    
+    async def stream(self, attempt: Callable[[], AsyncGenerator[str, None]]) -> AsyncGenerator[str, None]:
+        """执行attempt产生的流式调用，必要时对冲，返回先产出首个分块的那一路"""
+        delay = self.delay()
+        if delay is None:
+            source = attempt()
+            try:
+                async for chunk in source:
+                    yield chunk
+            finally:
+                await source.aclose()
+            return
+        
+        primary = attempt()
+        attempts = {asyncio.ensure_future(primary.__anext__()): primary}
+        winner = first = None
+        try:
+            done, _ = await asyncio.wait(list(attempts), timeout=delay)
+            if not done:
+                self.hedged += 1
+                secondary = attempt()
+                attempts[asyncio.ensure_future(secondary.__anext__())] = secondary
+            
+            pending = set(attempts)
+            while winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                # 优先采用成功的一路；全部失败时以最后一个错误为准
+                for task in sorted(done, key=lambda t: not self._succeeded(t)):
+                    if self._succeeded(task) or not pending:
+                        winner, first = attempts[task], task
+                        break
+            if winner is not primary:
+                self.hedge_wins += 1
+        finally:
+            for task, source in attempts.items():
+                if source is not winner:
+                    await self._discard(source, task)
+        
+        try:
+            try:
+                chunk = first.result()
+            except StopAsyncIteration:
+                return
+            yield chunk
+            async for chunk in winner:
+                yield chunk
+        finally:
+            await winner.aclose()
+    
+    def stats(self) -> dict:
+        p50 = self.tracker.percentile(50)
+        p95 = self.tracker.percentile(95)
+        return {
+            "enabled": settings.AI_HEDGE_ENABLED,
+            "ttft_p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+            "ttft_p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins
+        }
+
+
+# 全局熔断器和对冲器
+circuit_breaker = CircuitBreaker(
+    failure_threshold=settings.AI_BREAKER_FAILURE_THRESHOLD,
+    reset_timeout=settings.AI_BREAKER_RESET_TIMEOUT
+)
+ttft_tracker = LatencyTracker()
+hedger = Hedger(ttft_tracker)
@@ -0,0 +1,173 @@
+import random
+import time
+from typing import Iterable, List, Optional
+import httpx
+from openai import AsyncOpenAI
+from app.config import BackendConfig, settings
+from app.services.resilience import is_upstream_failure
+
+
+class Backend:
+    """一个上游端点及其健康状态估计"""
+    
+    def __init__(self, config: BackendConfig, client: AsyncOpenAI):
+        # 名称出现在运行指标和日志中，不使用可能含内部地址的base_url
+        self.name = config.name or config.model
+        self.model = config.model
+        self.weight = max(config.weight, 0.01)
+        self.client = client
+        
+        # 首token延迟和错误率的指数滑动平均
+        self.ttft: Optional[float] = None
+        self.error_rate = 0.0
+        self.in_flight = 0
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self.ejections = 0
+        
+        self.requests = 0
+        self.failures = 0
+    
+    def available(self, now: float) -> bool:
+        return now >= self.ejected_until
+    
+    def cost(self, default_ttft: float) -> float:
+        """预估代价：延迟越高、排队越多、错误率越高、权重越低，代价越大"""
+        ttft = self.ttft if self.ttft is not None else default_ttft
+        return ttft * (1 + self.in_flight) / self.weight / max(0.05, 1.0 - self.error_rate)
+    
+    def stats(self) -> dict:
+        return {
+            "name": self.name,
+            "model": self.model,
+            "weight": self.weight,
+            "ttft_ms": round(self.ttft * 1000, 1) if self.ttft is not None else None,
+            "error_rate": round(self.error_rate, 4),
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "failures": self.failures,
+            "ejected": not self.available(time.monotonic()),
+            "ejections": self.ejections
+        }
+
+
+class BackendRouter:
+    """
+    多上游端点路由
+    
+    按权重随机抽取两个可用端点，选择预估代价较低的一个（power of two choices），
+    既偏向快的端点又避免所有请求同时涌向同一个端点。
+    连续失败或错误率过高的端点被暂时摘除，摘除时间到期后重新参与路由。
+    """
+    
+    def __init__(self, backends: List[Backend], rng: Optional[random.Random] = None):
+        self.backends = backends
+        self.rng = rng or random.Random()
+        # 请求可能路由到任一端点，回复缓存的键按全部端点的模型集合区分
+        self.models = ",".join(sorted({backend.model for backend in backends}))
+    
+    def pick(self, exclude: Iterable[Backend] = ()) -> Backend:
+        """选择一个端点，exclude中的端点（如对冲时已使用的）仅在别无选择时使用"""
+        now = time.monotonic()
+        excluded = set(map(id, exclude))
+        candidates = [b for b in self.backends if b.available(now) and id(b) not in excluded]
+        if not candidates:
+            candidates = [b for b in self.backends if b.available(now)]
+        if not candidates:
+            # 全部被摘除时选择最早恢复的端点，避免完全不可用
+            return min(self.backends, key=lambda b: b.ejected_until)
+        if len(candidates) == 1:
+            return candidates[0]
+        
+        # 尚无延迟样本的端点按已知最快的延迟估计，保证新端点能获得流量
+        known = [b.ttft for b in self.backends if b.ttft is not None]
+        default_ttft = min(known) if known else 1.0
+        first, second = self._sample_two(candidates)
+        return first if first.cost(default_ttft) <= second.cost(default_ttft) else second
+    
+    def _sample_two(self, candidates: List[Backend]) -> tuple:
+        first = self.rng.choices(candidates, weights=[b.weight for b in candidates])[0]
+        rest = [b for b in candidates if b is not first]
+        second = self.rng.choices(rest, weights=[b.weight for b in rest])[0]
+        return first, second
+    
+    def on_start(self, backend: Backend) -> None:
+        backend.requests += 1
+        backend.in_flight += 1
+    
+    def on_finish(self, backend: Backend) -> None:
+        backend.in_flight -= 1
+    
+    def on_first_token(self, backend: Backend, ttft: float) -> None:
+        """收到首token：更新延迟估计并清除失败计数"""
+        alpha = settings.AI_ROUTER_EWMA_ALPHA
+        backend.ttft = ttft if backend.ttft is None else (1 - alpha) * backend.ttft + alpha * ttft
+        backend.error_rate *= 1 - alpha
+        backend.consecutive_failures = 0
+        backend.ejections = 0
+    
+    def on_failure(self, backend: Backend, error: BaseException) -> None:
+        """上游健康类错误计入错误率，达到阈值时摘除端点"""
+        if not is_upstream_failure(error):
+            return
+        alpha = settings.AI_ROUTER_EWMA_ALPHA
+        backend.failures += 1
+        backend.consecutive_failures += 1
+        backend.error_rate = (1 - alpha) * backend.error_rate + alpha
+        
+        if (
+            backend.consecutive_failures >= settings.AI_ROUTER_EJECT_FAILURES
+            or backend.error_rate >= settings.AI_ROUTER_EJECT_ERROR_RATE
+        ):
+            self._eject(backend)
+    
+    @staticmethod
+    def _eject(backend: Backend) -> None:
+        # 连续被摘除时摘除时间指数增长
+        duration = min(
+            settings.AI_ROUTER_EJECT_SECONDS * (2 ** backend.ejections),
+            settings.AI_ROUTER_MAX_EJECT_SECONDS
+        )
+        backend.ejected_until = time.monotonic() + duration
+        backend.ejections += 1
+        # 恢复后以半数阈值的错误率重新开始，一次失败不会立即再次摘除
+        backend.error_rate = settings.AI_ROUTER_EJECT_ERROR_RATE / 2
+        backend.consecutive_failures = 0
+        print(f"⚠️ 上游端点 {backend.name} 已暂时摘除 {duration:.0f} 秒")
+    
+    async def close(self) -> None:
+        for backend in self.backends:
+            await backend.client.close()
+    
+    def stats(self) -> list:
+        return [backend.stats() for backend in self.backends]
+
+
+def create_router() -> Optional[BackendRouter]:
+    """根据配置为每个端点创建带keep-alive连接池的异步客户端"""
+    configs = settings.ai_backends()
+    if not configs:
+        return None
+    
+    backends = []
+    for index, config in enumerate(configs):
+        if not config.name:
+            config = config.model_copy(update={"name": f"backend-{index}"})
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=settings.QWEN_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.QWEN_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=settings.QWEN_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(settings.QWEN_TIMEOUT, connect=settings.QWEN_CONNECT_TIMEOUT),
+        )
+        client = AsyncOpenAI(
+            # 本地兼容服务可能不校验密钥，但客户端要求非空
+            api_key=config.api_key or settings.DASHSCOPE_API_KEY or "EMPTY",
+            base_url=config.base_url,
+            # 调用都在限流名额内进行，SDK内部重试429会让限流器收不到过载信号；失败由对冲和端点切换处理
+            max_retries=0,
+            http_client=http_client,
+        )
+        backends.append(Backend(config, client))
+    return BackendRouter(backends)
@@ -0,0 +1,341 @@
+import math
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+from fastapi import HTTPException, status
+from sqlalchemy import Float, literal_column, select, type_coerce
+from sqlalchemy.dialects.mysql import match
+from sqlalchemy.orm import Session
+from app.config import settings
+from app.models.conversation import Conversation
+from app.models.message import Message, MessageStatus
+from app.models.user import User
+from app.services.conversation import ConversationService
+from app.utils.pagination import NEXT, Page, decode_cursor, encode_cursor, keyset_paginate
+
+# 分词规则：CJK连续字符按相邻两字切分（与MySQL ngram_token_size=2一致），字母数字按单词（小写）
+_CJK = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af"
+_SEGMENT_PATTERN = re.compile(rf"[{_CJK}]+|[A-Za-z0-9_]+")
+_CJK_PATTERN = re.compile(rf"[{_CJK}]")
+
+# 进程内索引的BM25参数
+_K1 = 1.2
+_B = 0.75
+
+# 相关度排序的游标列：(score, id)
+_SCORE = literal_column("score", Float)
+
+
+def search_terms(query: str) -> List[str]:
+    """把查询拆成检索词（CJK连续片段或单词，去掉标点），每个词都必须出现"""
+    terms = []
+    for term in _SEGMENT_PATTERN.findall(query.lower()):
+        if term not in terms:
+            terms.append(term)
+    return terms
+
+
+def tokenize(text: str) -> List[str]:
+    tokens = []
+    for segment in _SEGMENT_PATTERN.findall(text.lower()):
+        if _CJK_PATTERN.match(segment) and len(segment) > 1:
+            tokens.extend(segment[i:i + 2] for i in range(len(segment) - 1))
+        else:
+            tokens.append(segment)
+    return tokens
+
+
+def make_snippet(content: str, terms: List[str], width: int) -> Tuple[str, List[List[int]]]:
+    """截取包含第一个命中词的片段，返回片段及其中命中位置的[起, 止)偏移"""
+    lowered = content.lower()
+    positions = [lowered.find(term) for term in terms]
+    positions = [position for position in positions if position >= 0]
+    first = min(positions) if positions else 0
+    start = max(0, min(first - width // 4, len(content) - width))
+    end = min(len(content), start + width)
+    prefix = "…" if start > 0 else ""
+    snippet = prefix + content[start:end].replace("\n", " ") + ("…" if end < len(content) else "")
+    
+    window = lowered[start:end]
+    spans = []
+    for term in terms:
+        offset = window.find(term)
+        while offset != -1:
+            spans.append([offset + len(prefix), offset + len(prefix) + len(term)])
+            offset = window.find(term, offset + len(term))
+    spans.sort()
+    highlights: List[List[int]] = []
+    for span in spans:
+        if highlights and span[0] <= highlights[-1][1]:
+            highlights[-1][1] = max(highlights[-1][1], span[1])
+        else:
+            highlights.append(span)
+    return snippet, highlights
+
+
+class UserIndex:
+    """
+    一个用户全部消息的倒排索引
+    
+    按消息ID增量同步：每次检索前补充索引ID大于水位的新消息；
+    生成中的消息内容还会变化，先记下，完成后再索引。已删除的消息在取回结果时剔除
+    """
+    
+    def __init__(self):
+        self.postings: Dict[str, Dict[int, int]] = {}
+        self.lengths: Dict[int, int] = {}
+        self.conversations: Dict[int, int] = {}
+        self.total_length = 0
+        self.watermark = 0
+        self.pending: set = set()
+        self.lock = threading.Lock()
+    
+    def add(self, message_id: int, conversation_id: int, content: str) -> None:
+        tokens = tokenize(content)
+        counts: Dict[str, int] = {}
+        for token in tokens:
+            counts[token] = counts.get(token, 0) + 1
+        for token, frequency in counts.items():
+            self.postings.setdefault(token, {})[message_id] = frequency
+        self.lengths[message_id] = len(tokens)
+        self.conversations[message_id] = conversation_id
+        self.total_length += len(tokens)
+    
+    def discard(self, message_id: int) -> None:
+        """移除已删除的消息（倒排表中的残留项在排序时跳过）"""
+        length = self.lengths.pop(message_id, None)
+        if length is not None:
+            self.total_length -= length
+            del self.conversations[message_id]
+    
+    def _index_row(self, row) -> None:
+        if row.status == MessageStatus.STREAMING.value:
+            self.pending.add(row.id)
+        else:
+            self.pending.discard(row.id)
+            self.add(row.id, row.conversation_id, row.content)
+    
+    def sync(self, db: Session, user_id: int) -> None:
+        columns = (Message.id, Message.conversation_id, Message.content, Message.status)
+        if self.pending:
+            rows = db.execute(select(*columns).where(Message.id.in_(self.pending))).all()
+            found = {row.id for row in rows}
+            self.pending &= found
+            for row in rows:
+                self._index_row(row)
+        
+        rows = db.execute(
+            select(*columns).join(
+                Conversation, Conversation.id == Message.conversation_id
+            ).where(
+                Conversation.user_id == user_id,
+                Message.id > self.watermark
+            ).order_by(Message.id).execution_options(yield_per=settings.EXPORT_YIELD_PER)
+        )
+        for row in rows:
+            self._index_row(row)
+            self.watermark = row.id
+    
+    def rank(self, terms: List[str], conversation_id: Optional[int] = None) -> List[Tuple[float, int]]:
+        """返回同时包含全部检索词分词的消息，按BM25得分和ID倒序"""
+        tokens = set()
+        for term in terms:
+            tokens.update(tokenize(term))
+        postings = [self.postings.get(token) for token in tokens]
+        if not postings or not all(postings) or not self.lengths:
+            return []
+        postings.sort(key=len)
+        candidates = set(postings[0]).intersection(*postings[1:])
+        
+        documents = len(self.lengths)
+        average_length = self.total_length / documents or 1
+        weights = [
+            (math.log(1 + (documents - len(posting) + 0.5) / (len(posting) + 0.5)), posting)
+            for posting in postings
+        ]
+        ranked = []
+        for message_id in candidates:
+            length = self.lengths.get(message_id)
+            if length is None:
+                continue
+            if conversation_id is not None and self.conversations[message_id] != conversation_id:
+                continue
+            score = 0.0
+            for idf, posting in weights:
+                frequency = posting[message_id]
+                score += idf * frequency * (_K1 + 1) / (frequency + _K1 * (1 - _B + _B * length / average_length))
+            ranked.append((round(score, 6), message_id))
+        ranked.sort(reverse=True)
+        return ranked
+
+
+class SearchIndex:
+    """进程内倒排索引（非MySQL数据库使用），按用户分别建立，最近最少使用的用户索引被淘汰"""
+    
+    def __init__(self, max_users: int):
+        self.max_users = max_users
+        self._users: "OrderedDict[int, UserIndex]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.builds = 0
+        self.searches = 0
+    
+    def for_user(self, user_id: int) -> UserIndex:
+        with self._lock:
+            index = self._users.get(user_id)
+            if index is None:
+                index = self._users[user_id] = UserIndex()
+                self.builds += 1
+                while len(self._users) > self.max_users:
+                    self._users.popitem(last=False)
+            self._users.move_to_end(user_id)
+            self.searches += 1
+            return index
+    
+    def clear(self) -> None:
+        with self._lock:
+            self._users.clear()
+    
+    def stats(self) -> dict:
+        with self._lock:
+            indexes = list(self._users.values())
+        return {
+            "users": len(indexes),
+            "documents": sum(len(index.lengths) for index in indexes),
+            "terms": sum(len(index.postings) for index in indexes),
+            "builds": self.builds,
+            "searches": self.searches
+        }
+
+
+class SearchService:
+    @staticmethod
+    def _hit(message: Message, title: str, score: float, terms: List[str]) -> dict:
+        snippet, highlights = make_snippet(message.content, terms, settings.SEARCH_SNIPPET_CHARS)
+        return {
+            "message_id": message.id,
+            "conversation_id": message.conversation_id,
+            "conversation_title": title,
+            "role": message.role,
+            "created_at": message.created_at,
+            "score": score,
+            "snippet": snippet,
+            "highlights": highlights
+        }
+    
+    @staticmethod
+    def _search_fulltext(
+        db: Session,
+        user: User,
+        terms: List[str],
+        limit: int,
+        cursor: Optional[str],
+        conversation_id: Optional[int]
+    ) -> Page:
+        """MySQL：在ngram全文索引上按布尔模式检索，每个词作为必须出现的短语"""
+        fulltext = match(Message.search_text, against=" ".join(f'+"{term}"' for term in terms)).in_boolean_mode()
+        score = type_coerce(fulltext, Float)
+        query = db.query(Message, Conversation.title, score).join(
+            Conversation, Conversation.id == Message.conversation_id
+        ).filter(
+            Conversation.user_id == user.id,
+            fulltext
+        )
+        if conversation_id is not None:
+            query = query.filter(Message.conversation_id == conversation_id)
+        page = keyset_paginate(
+            query,
+            (score, Message.id),
+            limit,
+            cursor,
+            descending=True,
+            key=lambda row: (row[2], row[0].id)
+        )
+        page.items = [SearchService._hit(message, title, value, terms) for message, title, value in page.items]
+        # 相关度排序只向后翻页
+        page.prev_cursor = None
+        return page
+    
+    @staticmethod
+    def _search_index(
+        db: Session,
+        user: User,
+        terms: List[str],
+        limit: int,
+        cursor: Optional[str],
+        conversation_id: Optional[int]
+    ) -> Page:
+        """其他数据库：在进程内倒排索引上排序，再按页从数据库取回消息并确认包含检索词"""
+        index = search_index.for_user(user.id)
+        with index.lock:
+            index.sync(db, user.id)
+            ranked = index.rank(terms, conversation_id)
+        
+        if cursor:
+            _, after = decode_cursor(cursor, (_SCORE, Message.id))
+            after = tuple(after)
+            ranked = [item for item in ranked if item < after]
+        
+        hits = []
+        position = 0
+        while position < len(ranked) and len(hits) <= limit:
+            chunk = ranked[position:position + limit + 1]
+            position += len(chunk)
+            rows = {
+                message.id: (message, title)
+                for message, title in db.query(Message, Conversation.title).join(
+                    Conversation, Conversation.id == Message.conversation_id
+                ).filter(
+                    Message.id.in_([message_id for _, message_id in chunk]),
+                    Conversation.user_id == user.id
+                )
+            }
+            for score, message_id in chunk:
+                row = rows.get(message_id)
+                if row is None:
+                    with index.lock:
+                        index.discard(message_id)
+                    continue
+                message, title = row
+                lowered = message.content.lower()
+                if all(term in lowered for term in terms):
+                    hits.append((score, SearchService._hit(message, title, score, terms)))
+        
+        next_cursor = None
+        if len(hits) > limit:
+            hits = hits[:limit]
+            last = hits[-1][1]
+            next_cursor = encode_cursor((hits[-1][0], last["message_id"]), NEXT)
+        return Page([hit for _, hit in hits], next_cursor, None)
+    
+    @staticmethod
+    def search(
+        db: Session,
+        user: User,
+        query: str,
+        limit: int = 20,
+        cursor: Optional[str] = None,
+        conversation_id: Optional[int] = None
+    ) -> Page:
+        """
+        检索当前用户的消息，按相关度排序并返回带高亮位置的片段
+        
+        MySQL使用search_text列上的ngram全文索引；其他数据库使用进程内倒排索引
+        """
+        terms = search_terms(query)
+        if not terms:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="检索词不能为空"
+            )
+        if conversation_id is not None:
+            # 验证对话所有权
+            ConversationService.get_conversation(db, user, conversation_id)
+        
+        if db.get_bind().dialect.name == "mysql":
+            return SearchService._search_fulltext(db, user, terms, limit, cursor, conversation_id)
+        return SearchService._search_index(db, user, terms, limit, cursor, conversation_id)
+
+
+# 全局进程内检索索引
+search_index = SearchIndex(settings.SEARCH_INDEX_MAX_USERS)
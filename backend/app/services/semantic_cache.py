@@ -0,0 +1,216 @@
+import hashlib
+import re
+import time
+import zlib
+from typing import List, Optional
+from app.config import settings
+
+try:
+    import numpy as np
+except ImportError:  # numpy为可选依赖，未安装时语义缓存不可用
+    np = None
+
+# 归一化时去除空白和标点，只保留字母、数字和CJK字符
+_STRIP_PATTERN = re.compile(r"[^0-9a-z\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af]+")
+
+
+class HashedNgramEmbedder:
+    """
+    基于字符n-gram哈希的本地离线向量化器
+    
+    不使用单字特征：单字在同类问题间大量重合（"黄金价格"和"白银价格"、"delete"和"create"），
+    会把只差一两个关键字的问题算成近似
+    """
+    
+    def __init__(self, dim: int = 256, ngram_range: tuple = (2, 4)):
+        self.dim = dim
+        self.ngram_range = ngram_range
+    
+    @staticmethod
+    def normalize(text: str) -> str:
+        return _STRIP_PATTERN.sub("", text.lower())
+    
+    def embed(self, text: str):
+        """将文本转换为L2归一化的float32向量"""
+        vector = np.zeros(self.dim, dtype=np.float32)
+        normalized = self.normalize(text)
+        # 短于最小n的文本整体作为一个特征
+        min_n, max_n = min(self.ngram_range[0], max(len(normalized), 1)), self.ngram_range[1]
+        for n in range(min_n, max_n + 1):
+            for start in range(len(normalized) - n + 1):
+                h = zlib.crc32(normalized[start:start + n].encode("utf-8"))
+                # 低位决定维度，最高位决定符号，降低哈希冲突带来的偏差
+                vector[h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector /= norm
+        return vector
+    
+    def embed_batch(self, texts: List[str]):
+        return np.stack([self.embed(text) for text in texts]) if texts else np.zeros((0, self.dim), dtype=np.float32)
+
+
+class SemanticCache:
+    """
+    近似问题的语义回复缓存
+    
+    向量保存在NumPy矩阵中。查询分两步：先用随机超平面签名（SimHash）的
+    汉明距离在全部条目上做向量化初筛，再对少量候选计算精确余弦相似度。
+    """
+    
+    def __init__(
+        self,
+        max_entries: int,
+        threshold: float,
+        dim: int = 256,
+        signature_bits: int = 256,
+        max_candidates: int = 32,
+        seed: int = 0
+    ):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.max_candidates = max_candidates
+        self.embedder = HashedNgramEmbedder(dim)
+        self.words = signature_bits // 64
+        self.planes = np.random.default_rng(seed).standard_normal((dim, self.words * 64)).astype(np.float32)
+        
+        # 余弦阈值对应的汉明距离上限（期望值加3倍标准差的余量）
+        angle_ratio = float(np.arccos(np.clip(threshold, -1.0, 1.0)) / np.pi)
+        bits = self.words * 64
+        self.max_distance = int(np.ceil(bits * angle_ratio + 3 * np.sqrt(bits * angle_ratio * (1 - angle_ratio)) + 1))
+        
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lookup_seconds = 0.0
+        
+        # 存储按需扩容，避免启动时一次性分配max_entries
+        self.capacity = min(1024, max_entries)
+        self.vectors = np.zeros((self.capacity, dim), dtype=np.float16)
+        self.signatures = [np.zeros(self.capacity, dtype=np.uint64) for _ in range(self.words)]
+        self.scopes = np.zeros(self.capacity, dtype=np.int64)
+        self.last_used = np.zeros(self.capacity, dtype=np.float64)
+        self.values: List[Optional[str]] = [None] * self.capacity
+    
+    def _grow(self) -> None:
+        """容量翻倍（不超过max_entries）"""
+        capacity = min(self.capacity * 2, self.max_entries)
+        
+        def resized(array):
+            new = np.zeros((capacity,) + array.shape[1:], dtype=array.dtype)
+            new[:self.capacity] = array
+            return new
+        
+        self.vectors = resized(self.vectors)
+        self.signatures = [resized(column) for column in self.signatures]
+        self.scopes = resized(self.scopes)
+        self.last_used = resized(self.last_used)
+        self.values.extend([None] * (capacity - self.capacity))
+        self.capacity = capacity
+    
+    @staticmethod
+    def scope_of(*parts: str) -> int:
+        """缓存作用域（模型、系统提示等必须一致才能复用回复）"""
+        digest = hashlib.sha256("\x00".join(parts).encode("utf-8")).digest()
+        return int.from_bytes(digest[:8], "little", signed=True)
+    
+    def _signatures(self, vectors):
+        """计算SimHash签名，返回形状为(batch, words)的uint64数组"""
+        bits = (vectors @ self.planes) > 0
+        return np.packbits(bits, axis=1).view(np.uint64)
+    
+    def lookup_batch(self, texts: List[str], scope: int) -> List[Optional[str]]:
+        """批量查询，返回每条文本命中的缓存回复（未命中为None）"""
+        started = time.perf_counter()
+        results: List[Optional[str]] = [None] * len(texts)
+        if self.size and texts:
+            queries = self.embedder.embed_batch(texts)
+            query_signatures = self._signatures(queries)
+            
+            # 汉明距离初筛：对所有条目按签名列做向量化异或+位计数
+            distances = np.zeros((len(texts), self.size), dtype=np.uint16)
+            for word in range(self.words):
+                column = self.signatures[word][:self.size]
+                distances += np.bitwise_count(column[None, :] ^ query_signatures[:, word:word + 1])
+            distances[:, self.scopes[:self.size] != scope] = np.iinfo(np.uint16).max
+            
+            for row in range(len(texts)):
+                candidates = np.flatnonzero(distances[row] <= self.max_distance)
+                if not len(candidates):
+                    continue
+                if len(candidates) > self.max_candidates:
+                    nearest = np.argpartition(distances[row, candidates], self.max_candidates)[:self.max_candidates]
+                    candidates = candidates[nearest]
+                
+                # 候选集上计算精确余弦相似度
+                similarities = self.vectors[candidates].astype(np.float32) @ queries[row]
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    slot = int(candidates[best])
+                    self.last_used[slot] = time.monotonic()
+                    results[row] = self.values[slot]
+        
+        for result in results:
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        self.lookup_seconds += time.perf_counter() - started
+        return results
+    
+    def lookup(self, text: str, scope: int) -> Optional[str]:
+        return self.lookup_batch([text], scope)[0]
+    
+    def add(self, text: str, value: str, scope: int) -> None:
+        """写入缓存，容量已满时淘汰最久未命中的条目"""
+        if self.size < self.capacity:
+            slot = self.size
+            self.size += 1
+        elif self.capacity < self.max_entries:
+            self._grow()
+            slot = self.size
+            self.size += 1
+        else:
+            slot = int(np.argmin(self.last_used[:self.size]))
+        
+        vector = self.embedder.embed(text)
+        signature = self._signatures(vector[None, :])[0]
+        self.vectors[slot] = vector
+        for word in range(self.words):
+            self.signatures[word][slot] = signature[word]
+        self.scopes[slot] = scope
+        self.last_used[slot] = time.monotonic()
+        self.values[slot] = value
+    
+    def clear(self) -> None:
+        self.size = 0
+        self.last_used[:] = 0
+        self.values = [None] * self.capacity
+    
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "size": self.size,
+            "threshold": self.threshold,
+            "avg_lookup_ms": round(self.lookup_seconds / total * 1000, 3) if total else 0.0
+        }
+
+
+def _create_semantic_cache() -> Optional[SemanticCache]:
+    if not settings.AI_SEMANTIC_CACHE_ENABLED:
+        return None
+    if np is None or not hasattr(np, "bitwise_count"):
+        print("⚠️ 未安装numpy 2.0及以上版本，语义缓存已禁用")
+        return None
+    return SemanticCache(
+        max_entries=settings.AI_SEMANTIC_CACHE_MAX_ENTRIES,
+        threshold=settings.AI_SEMANTIC_CACHE_THRESHOLD,
+        dim=settings.AI_SEMANTIC_CACHE_DIM
+    )
+
+
+# 全局语义缓存（未启用时为None）
+semantic_cache = _create_semantic_cache()
@@ -0,0 +1,136 @@
+import asyncio
+import itertools
+from typing import Any, AsyncGenerator, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+
+class _Broadcast:
+    """一次上游流式生成，向多个订阅者广播分块"""
+    
+    def __init__(self, max_lag: int):
+        self.max_lag = max_lag
+        self.chunks: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.positions: Dict[int, int] = {}
+        self.task: Optional[asyncio.Task] = None
+        self._produced = asyncio.Event()
+        self._consumed = asyncio.Event()
+    
+    def _notify(self, event_name: str) -> None:
+        event = getattr(self, event_name)
+        setattr(self, event_name, asyncio.Event())
+        event.set()
+    
+    async def produce(self, source: AsyncIterator[str]) -> None:
+        try:
+            async for chunk in source:
+                self.chunks.append(chunk)
+                self._notify("_produced")
+                # 最慢的订阅者落后过多时暂停读取上游（反压）
+                while self.positions and len(self.chunks) - min(self.positions.values()) > self.max_lag:
+                    await self._consumed.wait()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self._notify("_produced")
+    
+    def subscribe(self, subscriber_id: int) -> AsyncGenerator[str, None]:
+        """登记订阅者（后加入的订阅者从头重放已生成的分块）"""
+        self.positions[subscriber_id] = 0
+        return self._iterate(subscriber_id)
+    
+    def unsubscribe(self, subscriber_id: int) -> None:
+        self.positions.pop(subscriber_id, None)
+        self._notify("_consumed")
+    
+    async def _iterate(self, subscriber_id: int) -> AsyncGenerator[str, None]:
+        position = 0
+        while True:
+            produced = self._produced
+            while position < len(self.chunks):
+                yield self.chunks[position]
+                position += 1
+                self.positions[subscriber_id] = position
+                self._notify("_consumed")
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await produced.wait()
+
+
+class SingleFlight:
+    """合并相同key的并发上游请求：跟随者等待领导者的结果"""
+    
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Task] = {}
+        self._streams: Dict[str, _Broadcast] = {}
+        self._ids = itertools.count()
+        self.leaders = 0
+        self.followers = 0
+    
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """非流式：相同key同时只执行一次fn"""
+        task = self._calls.get(key)
+        if task is None:
+            self.leaders += 1
+            task = asyncio.create_task(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._finish(self._calls, key, t))
+        else:
+            self.followers += 1
+        # 单个等待者被取消不影响其他等待者
+        return await asyncio.shield(task)
+    
+    async def stream(
+        self,
+        key: str,
+        source_factory: Callable[[], AsyncIterator[str]],
+        max_lag: int
+    ) -> AsyncGenerator[str, None]:
+        """流式：相同key共享同一上游流，跟随者订阅领导者的分块"""
+        broadcast = self._streams.get(key)
+        if broadcast is None:
+            self.leaders += 1
+            broadcast = _Broadcast(max_lag)
+            broadcast.task = asyncio.create_task(broadcast.produce(source_factory()))
+            self._streams[key] = broadcast
+            broadcast.task.add_done_callback(lambda t: self._finish(self._streams, key, broadcast))
+        else:
+            self.followers += 1
+        
+        subscriber_id = next(self._ids)
+        subscription = broadcast.subscribe(subscriber_id)
+        try:
+            async for chunk in subscription:
+                yield chunk
+        finally:
+            await subscription.aclose()
+            broadcast.unsubscribe(subscriber_id)
+            # 所有订阅者都离开时取消上游读取
+            if not broadcast.positions and not broadcast.done:
+                broadcast.task.cancel()
+                if self._streams.get(key) is broadcast:
+                    del self._streams[key]
+    
+    @staticmethod
+    def _finish(registry: dict, key: str, value) -> None:
+        if registry.get(key) is value:
+            del registry[key]
+        if isinstance(value, asyncio.Task) and not value.cancelled():
+            # 标记异常已读取，避免无人等待时的告警
+            value.exception()
+    
+    def stats(self) -> dict:
+        return {
+            "leaders": self.leaders,
+            "coalesced": self.followers,
+            "in_flight": len(self._calls) + len(self._streams)
+        }
+
+
+# 全局单飞实例
+singleflight = SingleFlight()
@@ -0,0 +1,201 @@
+import asyncio
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import AsyncGenerator, Optional, Tuple
+from app.config import settings
+from app.utils.serialization import dumps_json
+from app.utils.sse import sse_frame
+
+
+class StreamSession:
+    """
+    一次AI回复生成的事件流
+    
+    事件按顺序编号，以编码好的JSON保存在有界环形缓冲中，生成在独立任务中进行，
+    与连接解耦；客户端可随时通过SSE或WebSocket订阅，从指定事件之后开始接收。
+    """
+    
+    def __init__(
+        self,
+        user_id: int,
+        conversation_id: int,
+        max_events: int,
+        max_bytes: int,
+        disconnect_grace: float = 0.0
+    ):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.conversation_id = conversation_id
+        self.max_events = max_events
+        self.max_bytes = max_bytes
+        self.events: deque = deque()
+        self.bytes = 0
+        self.next_id = 1
+        self.done = False
+        self.finished_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+        self.disconnect_grace = disconnect_grace
+        self.subscribers = 0
+        self.cancel_reason: Optional[str] = None
+        self._abandon_timer: Optional[asyncio.TimerHandle] = None
+        self._changed = asyncio.Event()
+    
+    def _notify(self) -> None:
+        event, self._changed = self._changed, asyncio.Event()
+        event.set()
+    
+    def publish(self, payload: dict) -> int:
+        """追加一个事件，超出缓冲上限时丢弃最早的事件"""
+        event_id = self.next_id
+        self.next_id += 1
+        data = dumps_json(payload).decode("utf-8")
+        size = len(data.encode("utf-8"))
+        self.events.append((event_id, data, size))
+        self.bytes += size
+        while len(self.events) > 1 and (len(self.events) > self.max_events or self.bytes > self.max_bytes):
+            self.bytes -= self.events.popleft()[2]
+        self._notify()
+        return event_id
+    
+    def finish(self) -> None:
+        self.done = True
+        self.finished_at = time.monotonic()
+        if self._abandon_timer is not None:
+            self._abandon_timer.cancel()
+        self._notify()
+    
+    def cancel(self, reason: str) -> bool:
+        """取消仍在进行的生成，返回是否确实取消"""
+        if self.done or self.task is None or self.task.done():
+            return False
+        self.cancel_reason = reason
+        self.task.cancel()
+        return True
+    
+    def _on_unsubscribe(self) -> None:
+        """最后一个订阅者断开后，宽限期内无人重连则取消生成"""
+        if self.subscribers or self.done:
+            return
+        if self.disconnect_grace <= 0:
+            self.cancel("disconnect")
+            return
+        if self._abandon_timer is not None:
+            self._abandon_timer.cancel()
+        self._abandon_timer = asyncio.get_running_loop().call_later(
+            self.disconnect_grace,
+            lambda: self.subscribers or self.cancel("disconnect")
+        )
+    
+    async def listen(self, last_event_id: int = 0) -> AsyncGenerator[Tuple[Optional[int], str], None]:
+        """从last_event_id之后的事件开始接收(事件ID, JSON)，直到生成结束"""
+        position = last_event_id
+        self.subscribers += 1
+        try:
+            while True:
+                changed = self._changed
+                while True:
+                    oldest = self.events[0][0] if self.events else self.next_id
+                    if position + 1 < oldest:
+                        # 所需事件已被挤出缓冲，告知客户端后从最早保留的事件继续
+                        yield None, dumps_json({"type": "replay_gap", "from": position + 1, "to": oldest - 1}).decode("utf-8")
+                        position = oldest - 1
+                    index = position + 1 - oldest
+                    if index >= len(self.events):
+                        break
+                    event_id, data, _ = self.events[index]
+                    position = event_id
+                    yield event_id, data
+                if self.done:
+                    return
+                await changed.wait()
+        finally:
+            # 客户端断开（连接关闭时生成器被取消或关闭）
+            self.subscribers -= 1
+            self._on_unsubscribe()
+    
+    async def subscribe(self, last_event_id: int = 0) -> AsyncGenerator[str, None]:
+        """以SSE帧的形式接收事件"""
+        events = self.listen(last_event_id)
+        try:
+            async for event_id, data in events:
+                yield sse_frame(data, event_id)
+        finally:
+            # 立即关闭内层生成器，断开能及时计入订阅者数
+            await events.aclose()
+
+
+class StreamRegistry:
+    """进程内的可恢复事件流登记表，完成的流在TTL后或超出总内存上限时清除"""
+    
+    def __init__(self, ttl: float, total_max_bytes: int):
+        self.ttl = ttl
+        self.total_max_bytes = total_max_bytes
+        self._sessions: "OrderedDict[str, StreamSession]" = OrderedDict()
+        self.created = 0
+        self.resumed = 0
+        self.expired = 0
+    
+    def create(self, user_id: int, conversation_id: int) -> StreamSession:
+        self.cleanup()
+        session = StreamSession(
+            user_id,
+            conversation_id,
+            settings.SSE_REPLAY_MAX_EVENTS,
+            settings.SSE_REPLAY_MAX_BYTES,
+            settings.SSE_DISCONNECT_GRACE
+        )
+        self._sessions[session.id] = session
+        self.created += 1
+        return session
+    
+    def get(self, stream_id: str, user_id: int) -> Optional[StreamSession]:
+        """获取属于指定用户的事件流（不存在或已过期时返回None）"""
+        self.cleanup()
+        session = self._sessions.get(stream_id)
+        if session is None or session.user_id != user_id:
+            return None
+        return session
+    
+    def generating(self, conversation_id: int) -> bool:
+        """对话是否有正在生成的流（生成期间检查点会持续改写消息内容）"""
+        return any(
+            not session.done and session.conversation_id == conversation_id
+            for session in self._sessions.values()
+        )
+    
+    def cleanup(self) -> None:
+        """清除过期的流；总内存超限时按完成先后清除已完成的流"""
+        now = time.monotonic()
+        for stream_id, session in list(self._sessions.items()):
+            if session.done and now - session.finished_at > self.ttl:
+                del self._sessions[stream_id]
+                self.expired += 1
+        
+        total = sum(session.bytes for session in self._sessions.values())
+        if total <= self.total_max_bytes:
+            return
+        finished = sorted(
+            (session for session in self._sessions.values() if session.done),
+            key=lambda session: session.finished_at
+        )
+        for session in finished:
+            if total <= self.total_max_bytes:
+                break
+            total -= session.bytes
+            del self._sessions[session.id]
+            self.expired += 1
+    
+    def stats(self) -> dict:
+        return {
+            "active": sum(1 for session in self._sessions.values() if not session.done),
+            "buffered": len(self._sessions),
+            "buffered_bytes": sum(session.bytes for session in self._sessions.values()),
+            "created": self.created,
+            "resumed": self.resumed,
+            "expired": self.expired
+        }
+
+
+# 全局事件流登记表
+stream_registry = StreamRegistry(settings.SSE_REPLAY_TTL, settings.SSE_REPLAY_TOTAL_MAX_BYTES)
@@ -0,0 +1,109 @@
+import asyncio
+from typing import Optional
+from app.config import settings
+from app.models.conversation import Conversation
+from app.models.message import Message
+from app.services.ai import AIService
+from app.services.context import ContextBuilder
+
+# 正在生成摘要的对话ID，避免同一对话并发摘要
+_running: set = set()
+# 持有后台任务的引用，防止被垃圾回收
+_tasks: set = set()
+
+
+class SummaryService:
+    @staticmethod
+    def needs_summary(unsummarized_history: list) -> bool:
+        """判断未摘要部分是否超过触发阈值"""
+        if not settings.AI_SUMMARY_ENABLED:
+            return False
+        tokens = sum(ContextBuilder.message_tokens(msg) for msg in unsummarized_history)
+        return tokens > settings.AI_SUMMARY_TRIGGER_TOKENS
+    
+    @staticmethod
+    def schedule(session_factory, conversation_id: int) -> None:
+        """在请求之外的后台任务中更新对话摘要"""
+        if conversation_id in _running:
+            return
+        _running.add(conversation_id)
+        
+        async def run():
+            try:
+                await SummaryService.update_summary(session_factory, conversation_id)
+            finally:
+                _running.discard(conversation_id)
+        
+        task = asyncio.create_task(run())
+        _tasks.add(task)
+        task.add_done_callback(_tasks.discard)
+    
+    @staticmethod
+    def _split_tail(tail: list) -> list:
+        """保留最近的AI_SUMMARY_KEEP_TOKENS不折叠，返回需要折叠进摘要的较早消息"""
+        kept_tokens = 0
+        split = len(tail)
+        for index in range(len(tail) - 1, -1, -1):
+            tokens = ContextBuilder.message_tokens(tail[index])
+            if kept_tokens + tokens > settings.AI_SUMMARY_KEEP_TOKENS:
+                break
+            kept_tokens += tokens
+            split = index
+        return tail[:split]
+    
+    @staticmethod
+    async def update_summary(session_factory, conversation_id: int) -> Optional[str]:
+        """
+        增量更新对话摘要
+        
+        只把上次摘要之后、且不在最近保留窗口内的消息合并进已有摘要
+        """
+        db = session_factory()
+        try:
+            conversation = db.get(Conversation, conversation_id)
+            if not conversation:
+                return None
+            
+            previous_summary = conversation.summary
+            previous_message_id = conversation.summary_message_id
+            tail = db.query(Message).filter(
+                Message.conversation_id == conversation_id,
+                Message.id > (previous_message_id or 0)
+            ).order_by(Message.id).all()
+            
+            if not SummaryService.needs_summary(tail):
+                return None
+            
+            to_fold = SummaryService._split_tail(tail)
+            if not to_fold:
+                return None
+            
+            turns = [{"role": msg.role.value, "content": msg.content} for msg in to_fold]
+            last_message_id = to_fold[-1].id
+            
+            # 生成摘要期间不占用数据库连接
+            db.close()
+            summary = await AIService.summarize(previous_summary, turns)
+            if not summary:
+                return None
+            
+            # 仅当摘要未被其他进程更新时写入
+            updated = db.query(Conversation).filter(
+                Conversation.id == conversation_id,
+                Conversation.summary_message_id.is_(None)
+                if previous_message_id is None
+                else Conversation.summary_message_id == previous_message_id
+            ).update({
+                Conversation.summary: summary,
+                Conversation.summary_message_id: last_message_id,
+                # 摘要不算对话更新，保持原有更新时间
+                Conversation.updated_at: Conversation.updated_at
+            }, synchronize_session=False)
+            db.commit()
+            return summary if updated else None
+        
+        except Exception as e:
+            print(f"更新对话摘要失败：{str(e)}")
+            return None
+        finally:
+            db.close()
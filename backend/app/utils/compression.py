@@ -0,0 +1,128 @@
+import base64
+import zlib
+from typing import Optional
+from sqlalchemy.types import Text, TypeDecorator
+from app.config import settings
+
+try:
+    import zstandard
+except ImportError:  # zstandard为可选依赖，未安装时只能使用zlib
+    zstandard = None
+
+# 压缩后的内容以标记开头：MARKER + 编码名 + ":" + 载荷；不以MARKER开头的是未压缩的原文
+MARKER = "\x1f"
+ZLIB = "z"
+ZSTD = "s"
+# 以MARKER开头的原文加上此前缀保存，避免被误当作压缩内容
+ESCAPED = "r"
+
+
+class RawText(str):
+    """写入时不压缩的文本（生成中的消息会在数据库中继续追加，必须保持原文）"""
+
+
+def _zstd_compressor():
+    return zstandard.ZstdCompressor(level=3)
+
+
+def _zstd_decompressor():
+    return zstandard.ZstdDecompressor()
+
+
+def codec_for(name: str) -> Optional[str]:
+    """由配置名（zlib / zstd / 空）得到编码；未安装zstandard时zstd退回zlib"""
+    name = (name or "").lower()
+    if name == "zstd":
+        return ZSTD if zstandard is not None else ZLIB
+    if name == "zlib":
+        return ZLIB
+    if name:
+        raise ValueError(f"不支持的压缩编码: {name}")
+    return None
+
+
+def active_codec() -> Optional[str]:
+    """MESSAGE_COMPRESSION配置的编码，None表示不压缩"""
+    return codec_for(settings.MESSAGE_COMPRESSION)
+
+
+def compress_bytes(data: bytes, codec: str) -> bytes:
+    if codec == ZSTD:
+        return _zstd_compressor().compress(data)
+    return zlib.compress(data, 6)
+
+
+def decompress_bytes(data: bytes, codec: str) -> bytes:
+    if codec == ZSTD:
+        if zstandard is None:
+            raise RuntimeError("内容使用zstd压缩，需要安装zstandard")
+        return _zstd_decompressor().decompress(data)
+    return zlib.decompress(data)
+
+
+def should_compress(value: str) -> bool:
+    """按当前配置，内容是否达到压缩阈值"""
+    if active_codec() is None or isinstance(value, RawText):
+        return False
+    min_bytes = settings.MESSAGE_COMPRESSION_MIN_BYTES
+    return len(value) * 4 >= min_bytes and len(value.encode("utf-8")) >= min_bytes
+
+
+def encode(value: str, codec: Optional[str], min_bytes: Optional[int] = None) -> str:
+    """
+    把文本编码为存储形式
+    
+    codec不为None、UTF-8字节数达到阈值且压缩后更短时，返回 标记+编码名+base64载荷，否则返回原文
+    """
+    if min_bytes is None:
+        min_bytes = settings.MESSAGE_COMPRESSION_MIN_BYTES
+    if isinstance(value, RawText):
+        codec = None
+    # UTF-8每个字符最多4字节，字符数过少时不必编码也能判断低于阈值
+    if codec is not None and len(value) * 4 >= min_bytes:
+        data = value.encode("utf-8")
+        if len(data) >= min_bytes:
+            stored = MARKER + codec + ":" + base64.b64encode(compress_bytes(data, codec)).decode("ascii")
+            if len(stored) < len(data):
+                return stored
+    if value.startswith(MARKER):
+        return MARKER + ESCAPED + ":" + value
+    return str(value)
+
+
+def decode(stored: str) -> str:
+    """把存储形式还原为原文；没有压缩标记的旧数据原样返回"""
+    if not stored.startswith(MARKER) or stored[2:3] != ":":
+        return stored
+    codec = stored[1]
+    if codec == ESCAPED:
+        return stored[3:]
+    if codec in (ZLIB, ZSTD):
+        return decompress_bytes(base64.b64decode(stored[3:]), codec).decode("utf-8")
+    return stored
+
+
+def is_compressed(stored: Optional[str]) -> bool:
+    return bool(stored) and stored.startswith(MARKER) and stored[1:3] in (ZLIB + ":", ZSTD + ":")
+
+
+class CompressedText(TypeDecorator):
+    """
+    透明压缩的文本列
+    
+    数据库中仍是Text列：较长的内容按MESSAGE_COMPRESSION压缩后以带标记的base64保存，
+    读取时按标记解码，压缩前写入的行和未达到阈值的行保持原文
+    """
+    
+    impl = Text
+    cache_ok = True
+    
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return encode(value, active_codec())
+    
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return decode(value)
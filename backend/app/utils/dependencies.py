@@ -1,3 +1,4 @@
+from typing import Optional
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
@@ -8,6 +9,19 @@ from app.utils.security import decode_access_token
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
 
 
+def user_from_token(db: Session, token: str) -> Optional[User]:
+    """解析访问令牌并查询对应用户（令牌无效或用户不存在时返回None）"""
+    payload = decode_access_token(token)
+    if payload is None:
+        return None
+    
+    user_id: int = payload.get("sub")
+    if user_id is None:
+        return None
+    
+    return db.query(User).filter(User.id == user_id).first()
+
+
 async def get_current_user(
     token: str = Depends(oauth2_scheme),
     db: Session = Depends(get_db)
@@ -19,15 +33,7 @@ async def get_current_user(
         headers={"WWW-Authenticate": "Bearer"},
     )
     
-    payload = decode_access_token(token)
-    if payload is None:
-        raise credentials_exception
-    
-    user_id: int = payload.get("sub")
-    if user_id is None:
-        raise credentials_exception
-    
-    user = db.query(User).filter(User.id == user_id).first()
+    user = user_from_token(db, token)
     if user is None:
         raise credentials_exception
     
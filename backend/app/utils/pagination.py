@@ -0,0 +1,129 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+from fastapi import HTTPException, status
+from sqlalchemy import and_, or_
+
+NEXT = "next"
+PREV = "prev"
+
+
+class Page:
+    """一页结果及前后页的游标（没有更多数据时为None）"""
+    
+    def __init__(self, items: list, next_cursor: Optional[str], prev_cursor: Optional[str]):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+    
+    def headers(self) -> dict:
+        headers = {}
+        if self.next_cursor:
+            headers["X-Next-Cursor"] = self.next_cursor
+        if self.prev_cursor:
+            headers["X-Prev-Cursor"] = self.prev_cursor
+        return headers
+
+
+def encode_cursor(values: Sequence[Any], direction: str) -> str:
+    """把排序键和翻页方向编码为不透明的游标"""
+    payload = {
+        "d": direction,
+        "v": [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    }
+    raw = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode("ascii")
+
+
+def decode_cursor(cursor: str, columns: Sequence) -> Tuple[str, list]:
+    """解析游标，按排序列的类型还原排序键；游标无效时返回400"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        payload = json.loads(raw)
+        direction = payload["d"]
+        values = payload["v"]
+        if direction not in (NEXT, PREV) or len(values) != len(columns):
+            raise ValueError(cursor)
+        return direction, [
+            datetime.fromisoformat(value) if column.type.python_type is datetime else column.type.python_type(value)
+            for column, value in zip(columns, values)
+        ]
+    except (binascii.Error, UnicodeDecodeError, ValueError, KeyError, TypeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="无效的分页游标"
+        )
+
+
+def _beyond(columns: Sequence, values: Sequence, descending: bool):
+    """(c1, c2, ...) 严格位于 (v1, v2, ...) 之后的条件，展开为 OR/AND 形式"""
+    column, value = columns[0], values[0]
+    strictly = column < value if descending else column > value
+    if len(columns) == 1:
+        return strictly
+    return or_(strictly, and_(column == value, _beyond(columns[1:], values[1:], descending)))
+
+
+def _seek(columns: Sequence, values: Sequence, descending: bool):
+    """
+    游标定位条件
+    
+    额外加上首列的闭区间条件，使数据库能直接在复合索引上做范围扫描
+    （单独的 OR 条件在SQLite和部分MySQL版本上无法用索引定位）
+    """
+    column, value = columns[0], values[0]
+    bound = column <= value if descending else column >= value
+    return and_(bound, _beyond(columns, values, descending))
+
+
+def keyset_paginate(
+    query,
+    columns: Sequence,
+    limit: int,
+    cursor: Optional[str] = None,
+    descending: bool = False,
+    key: Optional[Callable[[Any], Sequence[Any]]] = None
+) -> Page:
+    """
+    键集（游标）分页
+    
+    按columns排序（最后一列须唯一），从游标处直接定位而不是跳过前面的行，
+    深页与首页的开销相同，并发插入也不会导致重复或遗漏。
+    key从结果行中取出排序键，默认按列名读取属性。
+    """
+    if key is None:
+        names = [column.key for column in columns]
+        
+        def key(row):
+            return [getattr(row, name) for name in names]
+    
+    direction, values = (NEXT, None)
+    if cursor:
+        direction, values = decode_cursor(cursor, columns)
+    
+    # 向前翻页时反转排序，取出后再恢复原顺序
+    backward = direction == PREV
+    order_descending = descending != backward
+    if values is not None:
+        query = query.filter(_seek(columns, values, order_descending))
+    query = query.order_by(*[column.desc() if order_descending else column.asc() for column in columns])
+    
+    rows: List = query.limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if backward:
+        rows.reverse()
+    
+    if not rows:
+        # 已到末尾：返回原游标，客户端可稍后用它继续获取新数据
+        return Page(rows, cursor if direction == NEXT else None, cursor if backward else None)
+    
+    more_after = has_more if not backward else True
+    more_before = has_more if backward else values is not None
+    return Page(
+        rows,
+        encode_cursor(key(rows[-1]), NEXT) if more_after else None,
+        encode_cursor(key(rows[0]), PREV) if more_before else None
+    )
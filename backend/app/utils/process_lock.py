@@ -0,0 +1,57 @@
+import os
+from typing import Optional, TextIO
+from app.config import settings
+
+try:
+    import fcntl
+except ImportError:  # Windows上没有fcntl，不做检查
+    fcntl = None
+
+
+class ProcessLock:
+    """
+    保证同一份部署只有一个服务进程的文件锁
+    
+    批量任务、可恢复流和上游并发名额都保存在进程内存中，多个worker之间不共享：
+    轮询任务或断线续传落到其他worker会返回404，并发限制也会按worker数成倍放大
+    """
+    
+    def __init__(self, path: str):
+        self.path = path
+        self._file: Optional[TextIO] = None
+    
+    @property
+    def held(self) -> bool:
+        return self._file is not None
+    
+    def acquire(self) -> None:
+        """加排他锁，已被其他进程持有时抛出RuntimeError（未配置路径或平台不支持时不检查）"""
+        if not self.path or fcntl is None or self._file is not None:
+            return
+        file = open(self.path, "a+")
+        try:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            file.seek(0)
+            owner = file.read().strip() or "?"
+            file.close()
+            raise RuntimeError(
+                f"服务进程 {owner} 已持有 {self.path}：批量任务和可恢复流的状态保存在进程内存中，"
+                "只能以单个worker运行（不要使用 --workers 或 WEB_CONCURRENCY 大于1）"
+            )
+        file.seek(0)
+        file.truncate()
+        file.write(str(os.getpid()))
+        file.flush()
+        self._file = file
+    
+    def release(self) -> None:
+        if self._file is None:
+            return
+        fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        self._file.close()
+        self._file = None
+
+
+# 全局进程锁（服务启动时获取，关闭时释放）
+process_lock = ProcessLock(settings.SINGLE_PROCESS_LOCK_FILE)
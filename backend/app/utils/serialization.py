@@ -0,0 +1,127 @@
+import contextvars
+import enum
+import json
+from datetime import date, datetime
+from typing import Any
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+try:
+    import orjson
+except ImportError:  # orjson为可选依赖，未安装时使用标准库json
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # msgpack为可选依赖，未安装时不支持msgpack响应
+    msgpack = None
+
+JSON_MEDIA_TYPE = "application/json"
+MSGPACK_MEDIA_TYPES = ("application/msgpack", "application/x-msgpack")
+
+# 当前请求协商出的响应格式（由ContentNegotiationMiddleware设置）
+_response_media_type: contextvars.ContextVar = contextvars.ContextVar("response_media_type", default=JSON_MEDIA_TYPE)
+
+
+def response_media_type() -> str:
+    """当前请求协商出的响应格式"""
+    return _response_media_type.get()
+
+
+def _default(obj: Any) -> Any:
+    """编码器不认识的类型"""
+    if isinstance(obj, BaseModel):
+        return obj.model_dump(mode="json")
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, enum.Enum):
+        return obj.value
+    if isinstance(obj, (set, frozenset, tuple)):
+        return list(obj)
+    raise TypeError(f"无法序列化类型: {type(obj).__name__}")
+
+
+def dumps_json(obj: Any) -> bytes:
+    """编码为紧凑的UTF-8 JSON（不转义非ASCII字符）"""
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(
+        obj,
+        default=_default,
+        ensure_ascii=False,
+        allow_nan=False,
+        separators=(",", ":")
+    ).encode("utf-8")
+
+
+def loads_json(data) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps_msgpack(obj: Any) -> bytes:
+    return msgpack.packb(obj, default=_default, use_bin_type=True)
+
+
+def negotiate(accept: str) -> str:
+    """
+    根据Accept头选择响应格式
+    
+    只有显式请求msgpack、且其权重不低于JSON时才返回msgpack，
+    未携带Accept或为*/*时保持JSON
+    """
+    if msgpack is None or "msgpack" not in accept:
+        return JSON_MEDIA_TYPE
+    weights = {}
+    for part in accept.split(","):
+        media_range, _, params = part.strip().partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        weights[media_range.strip().lower()] = quality
+    msgpack_quality = max(weights.get(media_type, 0.0) for media_type in MSGPACK_MEDIA_TYPES)
+    json_quality = max(weights.get(JSON_MEDIA_TYPE, 0.0), weights.get("application/*", 0.0), weights.get("*/*", 0.0))
+    if msgpack_quality > 0 and msgpack_quality >= json_quality:
+        return MSGPACK_MEDIA_TYPES[0]
+    return JSON_MEDIA_TYPE
+
+
+class APIResponse(JSONResponse):
+    """默认响应类：用orjson编码JSON，客户端协商为msgpack时改用msgpack编码"""
+    
+    def __init__(self, content: Any = None, status_code: int = 200, headers=None, media_type=None, background=None):
+        if media_type is None:
+            media_type = _response_media_type.get()
+        super().__init__(content, status_code, headers, media_type, background)
+        if msgpack is not None:
+            self.headers.add_vary_header("Accept")
+    
+    def render(self, content: Any) -> bytes:
+        if self.media_type in MSGPACK_MEDIA_TYPES:
+            return dumps_msgpack(content)
+        return dumps_json(content)
+
+
+class ContentNegotiationMiddleware:
+    """按请求的Accept头为APIResponse选择JSON或msgpack编码"""
+    
+    def __init__(self, app: ASGIApp):
+        self.app = app
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or msgpack is None:
+            await self.app(scope, receive, send)
+            return
+        token = _response_media_type.set(negotiate(Headers(scope=scope).get("accept", "")))
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _response_media_type.reset(token)
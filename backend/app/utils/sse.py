@@ -0,0 +1,142 @@
+import asyncio
+import time
+from typing import AsyncGenerator, AsyncIterator, List, Optional
+from app.utils.serialization import dumps_json
+
+
+class SSEStats:
+    """SSE帧统计：帧数、字节数、每帧合并的上游分块数，以及最近一分钟的帧速率"""
+    
+    WINDOW = 60
+    
+    def __init__(self):
+        self.frames = 0
+        self.bytes = 0
+        self.content_frames = 0
+        self.deltas = 0
+        self._buckets = [0] * self.WINDOW
+        self._bucket_seconds = [0] * self.WINDOW
+    
+    def record_frame(self, size: int) -> None:
+        self.frames += 1
+        self.bytes += size
+        second = int(time.monotonic())
+        slot = second % self.WINDOW
+        if self._bucket_seconds[slot] != second:
+            self._bucket_seconds[slot] = second
+            self._buckets[slot] = 0
+        self._buckets[slot] += 1
+    
+    def record_content(self, deltas: int) -> None:
+        self.content_frames += 1
+        self.deltas += deltas
+    
+    def frames_per_second(self) -> float:
+        now = int(time.monotonic())
+        recent = sum(
+            count for count, second in zip(self._buckets, self._bucket_seconds)
+            if now - self.WINDOW < second <= now
+        )
+        return recent / self.WINDOW
+    
+    def stats(self) -> dict:
+        return {
+            "frames": self.frames,
+            "frames_per_second": round(self.frames_per_second(), 2),
+            "bytes_per_frame": round(self.bytes / self.frames, 1) if self.frames else 0.0,
+            "deltas_per_content_frame": round(self.deltas / self.content_frames, 2) if self.content_frames else 0.0
+        }
+
+
+# 全局SSE统计
+sse_stats = SSEStats()
+
+
+def sse_frame(data: str, event_id: Optional[int] = None) -> str:
+    """用已编码的JSON组装一个SSE data帧（带event_id时客户端断线重连会通过Last-Event-ID回传）"""
+    frame = f"data: {data}\n\n"
+    if event_id is not None:
+        frame = f"id: {event_id}\n{frame}"
+    sse_stats.record_frame(len(frame.encode("utf-8")))
+    return frame
+
+
+def sse_event(payload: dict, event_id: Optional[int] = None) -> str:
+    """编码一个SSE data帧"""
+    return sse_frame(dumps_json(payload).decode("utf-8"), event_id)
+
+
+async def coalesce(
+    source: AsyncIterator[str],
+    max_bytes: int,
+    flush_interval: float
+) -> AsyncGenerator[str, None]:
+    """
+    合并上游的细碎分块
+    
+    缓冲内容达到max_bytes字节，或距缓冲中第一个分块超过flush_interval秒时输出一次，
+    以先到者为准。第一个分块立即输出，不增加首token延迟。
+    flush_interval为0时不合并。
+    """
+    if flush_interval <= 0:
+        async for chunk in source:
+            sse_stats.record_content(1)
+            yield chunk
+        return
+    
+    loop = asyncio.get_running_loop()
+    iterator = source.__aiter__()
+    pending: Optional[asyncio.Future] = None
+    buffer: List[str] = []
+    size = 0
+    deadline: Optional[float] = None
+    first = True
+    
+    def take() -> str:
+        nonlocal buffer, size, deadline
+        sse_stats.record_content(len(buffer))
+        text = "".join(buffer)
+        buffer, size, deadline = [], 0, None
+        return text
+    
+    try:
+        while True:
+            # 等待中的__anext__跨越多次超时保持存活，避免丢失分块
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+            if not pending.done():
+                timeout = None if deadline is None else max(0.0, deadline - loop.time())
+                await asyncio.wait([pending], timeout=timeout)
+                if not pending.done():
+                    yield take()
+                    continue
+            
+            task, pending = pending, None
+            try:
+                chunk = task.result()
+            except StopAsyncIteration:
+                break
+            except Exception:
+                # 先输出已缓冲的内容，再向上抛出异常
+                if buffer:
+                    yield take()
+                raise
+            
+            buffer.append(chunk)
+            size += len(chunk.encode("utf-8"))
+            if first or size >= max_bytes:
+                first = False
+                yield take()
+            elif deadline is None:
+                deadline = loop.time() + flush_interval
+        
+        if buffer:
+            yield take()
+    finally:
+        if pending is not None:
+            pending.cancel()
+            await asyncio.wait([pending])
+            if not pending.cancelled():
+                pending.exception()
+        if hasattr(iterator, "aclose"):
+            await iterator.aclose()
@@ -0,0 +1,49 @@
+import asyncio
+from typing import AsyncIterator, AsyncGenerator, TypeVar
+
+T = TypeVar("T")
+
+# 队列结束标记
+_STREAM_END = object()
+
+
+class _StreamError:
+    """在队列中传递生产者异常"""
+    
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+async def iterate_in_task(source: AsyncIterator[T], maxsize: int) -> AsyncGenerator[T, None]:
+    """
+    在独立任务中读取上游异步迭代器，并通过有界队列交给消费者
+    
+    消费者读取变慢时队列被填满，生产者随之暂停读取上游（反压）；
+    消费者提前退出时取消生产者任务。
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+    
+    async def produce():
+        try:
+            async for item in source:
+                await queue.put(item)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await queue.put(_StreamError(e))
+            return
+        await queue.put(_STREAM_END)
+    
+    producer = asyncio.create_task(produce())
+    try:
+        while True:
+            item = await queue.get()
+            if item is _STREAM_END:
+                break
+            if isinstance(item, _StreamError):
+                raise item.error
+            yield item
+    finally:
+        if not producer.done():
+            producer.cancel()
+            await asyncio.wait([producer])
@@ -0,0 +1,23 @@
+import re
+
+# 本地分词规则：CJK字符按单字计，英文单词/数字按约4个字符一个token计，其余符号各计1个
+_TOKEN_PATTERN = re.compile(
+    r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af]"
+    r"|[A-Za-z0-9_]+"
+    r"|\S"
+)
+
+
+def count_tokens(text: str) -> int:
+    """估算文本的token数量（无需联网的本地分词）"""
+    if not text:
+        return 0
+    
+    tokens = 0
+    for match in _TOKEN_PATTERN.finditer(text):
+        piece = match.group()
+        if len(piece) > 1:
+            tokens += (len(piece) + 3) // 4
+        else:
+            tokens += 1
+    return tokens
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+导出/导入性能基准
+在临时SQLite数据库中生成一个用户的大量消息，测量NDJSON流式导出和批量导入的耗时与Python内存峰值
+（内存峰值应与消息总数无关）
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("SECRET_KEY", "benchmark")
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from sqlalchemy import create_engine, insert  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+from app.database import Base  # noqa: E402
+from app.models.conversation import Conversation  # noqa: E402
+from app.models.message import Message, MessageRole  # noqa: E402
+from app.models.user import User  # noqa: E402
+from app.services.archive import ArchiveService  # noqa: E402
+
+TEXT = "流式回复的内容包含中文、English words、数字123和标点。"
+
+
+def populate(session_factory, conversations: int, messages: int) -> User:
+    db = session_factory()
+    user = User(username="bench", email="bench@example.com", hashed_password="x")
+    db.add(user)
+    db.commit()
+    per_conversation = messages // conversations
+    for index in range(conversations):
+        conversation_id = db.execute(insert(Conversation).values(user_id=user.id, title=f"对话{index}")).inserted_primary_key[0]
+        for start in range(0, per_conversation, 10000):
+            db.execute(insert(Message), [
+                {
+                    "conversation_id": conversation_id,
+                    "role": MessageRole.USER if number % 2 == 0 else MessageRole.ASSISTANT,
+                    "content": TEXT,
+                    "token_count": 30
+                }
+                for number in range(start, min(start + 10000, per_conversation))
+            ])
+    db.commit()
+    db.refresh(user)
+    db.expunge(user)
+    db.close()
+    return user
+
+
+def measure(label: str, func, trace_memory: bool):
+    # tracemalloc会明显拖慢执行，只在需要时开启
+    if trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - started
+    line = f"{label}: {elapsed:.2f} s"
+    if trace_memory:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        line += f"  Python内存峰值 {peak / 1024 / 1024:.1f} MB"
+    print(line)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="导出/导入性能基准")
+    parser.add_argument("--messages", type=int, default=200000, help="消息总数")
+    parser.add_argument("--conversations", type=int, default=20, help="对话数")
+    parser.add_argument("--gzip", action="store_true", help="导出为gzip")
+    parser.add_argument("--memory", action="store_true", help="用tracemalloc记录内存峰值（耗时会明显增加）")
+    args = parser.parse_args()
+    
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine(f"sqlite:///{os.path.join(directory, 'bench.db')}")
+        Base.metadata.create_all(bind=engine)
+        session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        user = populate(session_factory, args.conversations, args.messages)
+        path = os.path.join(directory, "export.ndjson")
+        
+        def export():
+            size = 0
+            with open(path, "wb") as output:
+                for chunk in ArchiveService.export_stream(session_factory, user.id, compress=args.gzip):
+                    output.write(chunk)
+                    size += len(chunk)
+            return size
+        
+        size = measure(f"导出{args.messages}条消息", export, args.memory)
+        print(f"  文件大小 {size / 1024 / 1024:.1f} MB")
+        
+        async def read_file():
+            with open(path, "rb") as source:
+                while chunk := source.read(64 * 1024):
+                    yield chunk
+        
+        def import_all():
+            db = session_factory()
+            try:
+                return asyncio.run(ArchiveService.import_stream(db, user, read_file()))
+            finally:
+                db.close()
+        
+        imported = measure("导入", import_all, args.memory)
+        print(f"  {imported}")
+
+
+if __name__ == "__main__":
+    main()
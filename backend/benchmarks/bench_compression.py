@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+消息内容压缩基准
+在语料上测量各编码的存储比例（含base64和标记）、编码/解码耗时，以及不同阈值下被压缩的消息占比。
+语料默认按对话中常见的内容合成（短问题、中英文回答、Markdown代码块、粘贴的长文档），
+也可以用 --corpus 指定 GET /api/export 导出的NDJSON文件，测量真实数据
+"""
+
+import argparse
+import gzip
+import json
+import os
+import random
+import sys
+import time
+from typing import List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("SECRET_KEY", "benchmark")
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from app.utils.compression import ZLIB, ZSTD, decode, encode, zstandard  # noqa: E402
+
+QUESTIONS = ["这段代码为什么报错？", "帮我翻译成英文", "总结一下上面的内容", "What does this function return?", "继续"]
+PARAGRAPHS = [
+    "数据库连接池的大小需要根据并发请求数和每个请求持有连接的时间来确定，过小会导致排队，过大则会增加数据库的负担。",
+    "流式输出可以显著降低首字节时间，用户在模型生成完整回答之前就能看到部分内容。",
+    "In most cases the bottleneck is not the CPU but the round trips to the database, so batching queries helps more than micro-optimizations.",
+    "需要注意的是，缓存的失效策略比缓存本身更难设计：版本号、TTL和主动失效各有适用的场景。",
+    "The function returns None when the input list is empty, otherwise it returns the index of the first matching element.",
+]
+CODE = '''```python
+def paginate(query, cursor, limit):
+    rows = query.filter(Model.id > cursor).order_by(Model.id).limit(limit + 1).all()
+    return rows[:limit], rows[limit].id if len(rows) > limit else None
+```'''
+
+
+def synthetic_corpus(count: int, rng: random.Random) -> List[str]:
+    corpus = []
+    for index in range(count):
+        if index % 2 == 0:
+            # 用户消息：大多是短问题，少量是粘贴的长文档
+            if rng.random() < 0.1:
+                corpus.append("\n".join(rng.choice(PARAGRAPHS) for _ in range(rng.randint(20, 80))))
+            else:
+                corpus.append(rng.choice(QUESTIONS))
+        else:
+            parts = [rng.choice(PARAGRAPHS) for _ in range(rng.randint(1, 12))]
+            if rng.random() < 0.3:
+                parts.insert(rng.randint(0, len(parts)), CODE)
+            corpus.append("\n\n".join(parts))
+    return corpus
+
+
+def load_corpus(path: str) -> List[str]:
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as source:
+        return [
+            record["content"]
+            for record in map(json.loads, source)
+            if record.get("type") == "message"
+        ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="消息内容压缩基准")
+    parser.add_argument("--messages", type=int, default=20000, help="合成语料的消息数")
+    parser.add_argument("--corpus", help="使用导出的NDJSON（可为gzip）文件作为语料")
+    parser.add_argument("--thresholds", default="256,1024,4096", help="逗号分隔的压缩阈值（字节）")
+    args = parser.parse_args()
+    
+    corpus = load_corpus(args.corpus) if args.corpus else synthetic_corpus(args.messages, random.Random(42))
+    raw_bytes = sum(len(text.encode("utf-8")) for text in corpus)
+    print(f"语料: {len(corpus)} 条消息, {raw_bytes / 1024 / 1024:.1f} MB")
+    
+    codecs = [("zlib", ZLIB)]
+    if zstandard is not None:
+        codecs.append(("zstd", ZSTD))
+    else:
+        print("未安装zstandard，跳过zstd")
+    
+    print(f"{'编码':<6}{'阈值':>8}{'压缩占比':>10}{'存储比例':>10}{'编码MB/s':>12}{'解码MB/s':>12}{'编码us/条':>12}{'解码us/条':>12}")
+    for name, codec in codecs:
+        for threshold in (int(value) for value in args.thresholds.split(",")):
+            started = time.perf_counter()
+            stored = [encode(text, codec, threshold) for text in corpus]
+            encode_seconds = time.perf_counter() - started
+            
+            started = time.perf_counter()
+            for value in stored:
+                decode(value)
+            decode_seconds = time.perf_counter() - started
+            
+            stored_bytes = sum(len(value.encode("utf-8")) for value in stored)
+            compressed = sum(1 for value, text in zip(stored, corpus) if value != text)
+            print(
+                f"{name:<6}{threshold:>8}{compressed / len(corpus):>10.1%}{stored_bytes / raw_bytes:>10.1%}"
+                f"{raw_bytes / 1024 / 1024 / encode_seconds:>12.1f}{raw_bytes / 1024 / 1024 / decode_seconds:>12.1f}"
+                f"{encode_seconds / len(corpus) * 1e6:>12.1f}{decode_seconds / len(corpus) * 1e6:>12.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+语义缓存查询性能基准
+向缓存写入N条随机问题，测量单条查询和批量查询的平均耗时
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.semantic_cache import SemanticCache  # noqa: E402
+
+WORDS = (
+    "如何 怎么 为什么 可以 密码 账号 登录 注册 重置 修改 删除 订单 退款 发票 地址 "
+    "手机 邮箱 验证码 会员 价格 优惠 配送 时间 客服 电话 设置 通知 隐私 安全 支付 "
+    "how what why can password account login reset change delete order refund invoice"
+).split()
+
+
+def random_question(rng: random.Random) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 12)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="语义缓存查询性能基准")
+    parser.add_argument("--entries", type=int, default=100000, help="缓存条目数")
+    parser.add_argument("--queries", type=int, default=500, help="查询次数")
+    parser.add_argument("--batch", type=int, default=16, help="批量查询大小")
+    parser.add_argument("--threshold", type=float, default=0.85, help="余弦相似度阈值")
+    args = parser.parse_args()
+    
+    rng = random.Random(42)
+    cache = SemanticCache(max_entries=args.entries, threshold=args.threshold)
+    
+    started = time.perf_counter()
+    for i in range(args.entries):
+        cache.add(random_question(rng), f"回复{i}", scope=0)
+    print(f"写入 {args.entries} 条: {time.perf_counter() - started:.2f}s")
+    
+    questions = [random_question(rng) for _ in range(args.queries)]
+    
+    started = time.perf_counter()
+    for question in questions:
+        cache.lookup(question, scope=0)
+    single_ms = (time.perf_counter() - started) / len(questions) * 1000
+    print(f"单条查询: {single_ms:.3f} ms/次")
+    
+    started = time.perf_counter()
+    for start in range(0, len(questions), args.batch):
+        cache.lookup_batch(questions[start:start + args.batch], scope=0)
+    batch_ms = (time.perf_counter() - started) / len(questions) * 1000
+    print(f"批量查询(batch={args.batch}): {batch_ms:.3f} ms/次")
+    print(f"命中率: {cache.stats()['hit_rate']:.2%}")
+
+
+if __name__ == "__main__":
+    main()
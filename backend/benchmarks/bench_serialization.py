@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+响应序列化性能基准
+按 GET /messages 的处理流程（from_attributes校验 -> 转为JSON兼容对象 -> 编码）
+比较标准库json、orjson和msgpack编码一页消息的耗时，以及SSE帧的编码耗时
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pydantic import TypeAdapter  # noqa: E402
+from app.models.message import Message, MessageRole  # noqa: E402
+from app.schemas.message import MessageResponse, dump_messages  # noqa: E402
+from app.utils.serialization import dumps_json, dumps_msgpack, msgpack, orjson  # noqa: E402
+
+TEXT = "流式回复的内容包含中文、English words、数字123和标点。"
+
+
+def build_messages(count: int, rng: random.Random) -> List[Message]:
+    started = datetime(2024, 1, 1)
+    return [
+        Message(
+            id=index + 1,
+            conversation_id=1,
+            role=MessageRole.USER if index % 2 == 0 else MessageRole.ASSISTANT,
+            content=TEXT * rng.randint(1, 20),
+            status="complete",
+            created_at=started + timedelta(seconds=index)
+        )
+        for index in range(count)
+    ]
+
+
+def stdlib_dumps(content) -> bytes:
+    # 与starlette JSONResponse.render一致
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def measure(func, repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - started) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="响应序列化性能基准")
+    parser.add_argument("--messages", type=int, default=500, help="每页消息数")
+    parser.add_argument("--repeat", type=int, default=200, help="重复次数")
+    parser.add_argument("--frames", type=int, default=10000, help="SSE帧数")
+    args = parser.parse_args()
+    
+    messages = build_messages(args.messages, random.Random(42))
+    adapter = TypeAdapter(List[MessageResponse])
+    
+    def validate():
+        return adapter.dump_python(adapter.validate_python(messages, from_attributes=True), mode="json")
+    
+    content = validate()
+    validate_ms = measure(validate, args.repeat)
+    print(f"{args.messages}条消息，JSON大小 {len(stdlib_dumps(content)) / 1024:.1f} KB")
+    print(f"校验+转换(from_attributes): {validate_ms:.3f} ms/页")
+    
+    encoders = [("标准库json", stdlib_dumps)]
+    if orjson is not None:
+        encoders.append(("orjson", dumps_json))
+    if msgpack is not None:
+        encoders.append(("msgpack", dumps_msgpack))
+    for name, encode in encoders:
+        encode_ms = measure(lambda: encode(content), args.repeat)
+        print(
+            f"{name}: 编码 {encode_ms:.3f} ms/页  含校验 {validate_ms + encode_ms:.3f} ms/页  "
+            f"大小 {len(encode(content)) / 1024:.1f} KB"
+        )
+    
+    direct_ms = measure(lambda: dumps_json(dump_messages(messages)), args.repeat)
+    assert json.loads(dumps_json(dump_messages(messages))) == content
+    print(f"跳过校验直接编码(dump_messages + 当前实现): {direct_ms:.3f} ms/页")
+    
+    payloads = [{"type": "ai_chunk", "content": TEXT[:random.randint(1, len(TEXT))]} for _ in range(args.frames)]
+    
+    def frames_with(encode):
+        def run():
+            for payload in payloads:
+                f"data: {encode(payload)}\n\n"
+        return run
+    
+    stdlib_us = measure(frames_with(lambda payload: json.dumps(payload, ensure_ascii=False)), 5) / args.frames * 1000
+    fast_us = measure(frames_with(lambda payload: dumps_json(payload).decode("utf-8")), 5) / args.frames * 1000
+    print(f"SSE帧编码: 标准库json {stdlib_us:.2f} us/帧  当前实现 {fast_us:.2f} us/帧")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+流式消息接口压测
+对运行中的后端并发调用 /api/conversations/{id}/messages/stream，
+统计首个AI分块延迟（TTFT）和完整回复耗时的分位数
+
+配合本地模拟大模型服务使用（无需外网）:
+    python mock_llm_server.py --port 9000 --ttft-dist lognormal --ttft-mean 0.5
+    QWEN_BASE_URL=http://127.0.0.1:9000/v1 DASHSCOPE_API_KEY=mock uvicorn app.main:app --port 8000
+    python benchmarks/bench_stream.py --base-url http://127.0.0.1:8000 --concurrency 50 --requests 500
+"""
+
+import argparse
+import asyncio
+import json
+import time
+import uuid
+
+import httpx
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+async def login(client: httpx.AsyncClient) -> dict:
+    """注册一个临时用户并返回认证头"""
+    username = f"bench_{uuid.uuid4().hex[:12]}"
+    password = "benchpass123"
+    response = await client.post("/api/auth/register", json={
+        "username": username,
+        "email": f"{username}@example.com",
+        "password": password
+    })
+    response.raise_for_status()
+    response = await client.post("/api/auth/login", json={"username": username, "password": password})
+    response.raise_for_status()
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+async def stream_once(client: httpx.AsyncClient, headers: dict, conversation_id: int, content: str) -> dict:
+    """发送一条流式消息，返回TTFT、总耗时和分块数"""
+    started = time.perf_counter()
+    ttft = None
+    chunks = 0
+    error = None
+    async with client.stream(
+        "POST",
+        f"/api/conversations/{conversation_id}/messages/stream",
+        json={"content": content},
+        headers=headers
+    ) as response:
+        async for line in response.aiter_lines():
+            if not line.startswith("data: "):
+                continue
+            event = json.loads(line[6:])
+            if event["type"] == "ai_chunk":
+                if ttft is None:
+                    ttft = time.perf_counter() - started
+                chunks += 1
+            elif event["type"] == "error":
+                error = event.get("message")
+    return {"ttft": ttft, "total": time.perf_counter() - started, "chunks": chunks, "error": error}
+
+
+async def run(args) -> None:
+    timeout = httpx.Timeout(args.timeout)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=timeout, limits=limits) as client:
+        headers = await login(client)
+        
+        # 每个并发槽位使用独立对话，避免上下文无限增长
+        conversation_ids = []
+        for _ in range(args.concurrency):
+            response = await client.post("/api/conversations", json={"title": "压测"}, headers=headers)
+            response.raise_for_status()
+            conversation_ids.append(response.json()["id"])
+        
+        results = []
+        counter = iter(range(args.requests))
+        
+        async def worker(conversation_id: int):
+            for index in counter:
+                # --distinct关闭时所有请求内容相同，可观察缓存和请求合并的效果
+                content = f"压测问题 {index}" if args.distinct else "压测问题"
+                try:
+                    results.append(await stream_once(client, headers, conversation_id, content))
+                except httpx.HTTPError as e:
+                    results.append({"ttft": None, "total": 0.0, "chunks": 0, "error": str(e)})
+        
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(conversation_id) for conversation_id in conversation_ids))
+        elapsed = time.perf_counter() - started
+        
+        metrics = (await client.get("/api/metrics", headers=headers)).json()
+    
+    ttfts = [r["ttft"] for r in results if r["ttft"] is not None]
+    totals = [r["total"] for r in results if r["error"] is None]
+    errors = sum(1 for r in results if r["error"] is not None)
+    print(f"请求数: {len(results)}  并发: {args.concurrency}  耗时: {elapsed:.2f}s  吞吐: {len(results) / elapsed:.1f} req/s")
+    print(f"错误: {errors}")
+    for name, values in (("TTFT", ttfts), ("总耗时", totals)):
+        print(
+            f"{name}: p50 {percentile(values, 50) * 1000:.0f} ms  "
+            f"p95 {percentile(values, 95) * 1000:.0f} ms  "
+            f"p99 {percentile(values, 99) * 1000:.0f} ms"
+        )
+    print(f"服务端指标: {json.dumps(metrics, ensure_ascii=False)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="流式消息接口压测")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000", help="后端地址")
+    parser.add_argument("--concurrency", type=int, default=20, help="并发数")
+    parser.add_argument("--requests", type=int, default=200, help="总请求数")
+    parser.add_argument("--timeout", type=float, default=120.0, help="单个请求超时（秒）")
+    parser.add_argument("--distinct", action=argparse.BooleanOptionalAction, default=True, help="每个请求使用不同内容")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
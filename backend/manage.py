@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+数据维护命令
+用法: python manage.py <命令> [参数]，使用与服务相同的配置（.env / 环境变量）连接数据库
+"""
+
+import argparse
+import sys
+import time
+
+from app.database import Base, SessionLocal, engine, pending_schema_changes, upgrade_schema
+from app.services.maintenance import MaintenanceService
+
+
+def migrate(args):
+    started = time.perf_counter()
+    Base.metadata.create_all(bind=engine)
+    changes = upgrade_schema()
+    if changes:
+        print(f"执行 {len(changes)} 项结构变更，用时 {time.perf_counter() - started:.1f} 秒")
+    else:
+        print("数据库结构已是最新")
+
+
+def compress_messages(args):
+    db = SessionLocal()
+    try:
+        started = time.perf_counter()
+        result = MaintenanceService.compress_messages(
+            db,
+            batch_size=args.batch_size,
+            codec=args.codec,
+            decompress=args.decompress
+        )
+    finally:
+        db.close()
+    elapsed = time.perf_counter() - started
+    ratio = result["bytes_after"] / result["bytes_before"] if result["bytes_before"] else 1.0
+    print(f"扫描 {result['scanned']} 条消息，改写 {result['rewritten']} 条，用时 {elapsed:.1f} 秒")
+    print(f"内容 {result['bytes_before'] / 1024 / 1024:.1f} MB -> {result['bytes_after'] / 1024 / 1024:.1f} MB（{ratio:.1%}）")
+
+
+def fill_search_text(args):
+    db = SessionLocal()
+    try:
+        started = time.perf_counter()
+        result = MaintenanceService.fill_search_text(db, batch_size=args.batch_size)
+    finally:
+        db.close()
+    print(f"回填 {result['filled']} 条消息的检索原文，用时 {time.perf_counter() - started:.1f} 秒")
+
+
+def repair_conversations(args):
+    db = SessionLocal()
+    try:
+        started = time.perf_counter()
+        result = MaintenanceService.repair_conversations(db, batch_size=args.batch_size)
+    finally:
+        db.close()
+    elapsed = time.perf_counter() - started
+    print(f"检查 {result['scanned']} 个对话，修正 {result['repaired']} 个，用时 {elapsed:.1f} 秒")
+
+
+def recover_streaming(args):
+    db = SessionLocal()
+    try:
+        result = MaintenanceService.recover_streaming(db, older_than=args.older_than)
+    finally:
+        db.close()
+    print(f"{result['conversations']} 个对话中的 {result['recovered']} 条生成中断的消息已标记为truncated")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="AI Talk 数据维护命令")
+    commands = parser.add_subparsers(dest="command", required=True)
+    
+    command = commands.add_parser("migrate", help="为已有表添加新增的列和索引（升级后、启动服务前执行一次）")
+    command.set_defaults(handler=migrate)
+    
+    command = commands.add_parser("compress-messages", help="把已有消息改写为压缩存储（可重复运行，中断后继续）")
+    command.add_argument("--batch-size", type=int, default=1000, help="每批处理并提交的消息数")
+    command.add_argument("--codec", choices=["zlib", "zstd"], help="压缩编码，默认使用MESSAGE_COMPRESSION")
+    command.add_argument("--decompress", action="store_true", help="把压缩的消息还原为原文")
+    command.set_defaults(handler=compress_messages)
+    
+    command = commands.add_parser("fill-search-text", help="为升级前的消息回填检索用的原文（MySQL全文索引）")
+    command.add_argument("--batch-size", type=int, default=1000, help="每批处理并提交的消息数")
+    command.set_defaults(handler=fill_search_text)
+    
+    command = commands.add_parser("repair-conversations", help="重新计算对话的消息数和最后一条消息（升级后回填或修复）")
+    command.add_argument("--batch-size", type=int, default=500, help="每批处理并提交的对话数")
+    command.set_defaults(handler=repair_conversations)
+    
+    command = commands.add_parser("recover-streaming", help="把进程退出后遗留为streaming状态的回复标记为truncated")
+    command.add_argument("--older-than", type=float, default=600.0, help="对话超过多少秒没有写入时视为生成已中断")
+    command.set_defaults(handler=recover_streaming)
+    
+    args = parser.parse_args()
+    if args.handler is not migrate and pending_schema_changes():
+        print("数据库结构落后于当前版本，请先执行 python manage.py migrate")
+        sys.exit(1)
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+本地模拟的OpenAI兼容大模型服务
+支持流式和非流式chat completions，可配置首token延迟分布、生成速度、
+错误和429注入以及随机种子，用于离线压测和基准测试
+
+用法:
+    python mock_llm_server.py --port 9000 --ttft-dist lognormal --ttft-mean 0.8 --tokens-per-second 40
+    QWEN_BASE_URL=http://127.0.0.1:9000/v1 DASHSCOPE_API_KEY=mock uvicorn app.main:app
+"""
+
+import argparse
+import asyncio
+import hashlib
+import itertools
+import json
+import math
+import random
+import time
+import uuid
+from dataclasses import asdict, dataclass
+from typing import List, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+VOCABULARY = (
+    "你好 这是 一个 模拟 的 回复 用于 测试 流式 输出 并发 延迟 以及 缓存 "
+    "我们 可以 看到 系统 在 负载 下 的 表现 请求 响应 模型 服务 数据 结果 "
+    "，。"
+).split()
+
+
+@dataclass
+class MockConfig:
+    """模拟服务的行为参数"""
+    ttft_dist: str = "fixed"  # fixed / uniform / exponential / lognormal
+    ttft_mean: float = 0.3  # 首token延迟均值（秒）
+    ttft_jitter: float = 0.5  # uniform为相对半宽，lognormal为对数标准差
+    tokens_per_second: float = 50.0  # 生成速度，0表示不限速
+    min_tokens: int = 20
+    max_tokens: int = 200
+    error_rate: float = 0.0  # 返回500的概率
+    rate_limit_rate: float = 0.0  # 返回429的概率
+    max_concurrency: int = 0  # 超过并发上限时返回429，0表示不限制
+    seed: int = 0
+
+
+class MockState:
+    """请求计数和并发统计"""
+    
+    def __init__(self):
+        self.requests = 0
+        self.streams = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.tokens = 0
+
+
+def sample_ttft(config: MockConfig, rng: random.Random) -> float:
+    """按配置的分布采样首token延迟"""
+    mean = config.ttft_mean
+    if config.ttft_dist == "uniform":
+        low = mean * (1 - config.ttft_jitter)
+        return max(0.0, rng.uniform(low, mean * (1 + config.ttft_jitter)))
+    if config.ttft_dist == "exponential":
+        return rng.expovariate(1 / mean) if mean > 0 else 0.0
+    if config.ttft_dist == "lognormal":
+        # 取mu使分布均值等于ttft_mean，长尾由sigma控制
+        sigma = config.ttft_jitter
+        mu = math.log(mean) - sigma ** 2 / 2 if mean > 0 else 0.0
+        return rng.lognormvariate(mu, sigma) if mean > 0 else 0.0
+    return mean
+
+
+def reply_tokens(config: MockConfig, messages: List[dict], max_tokens: Optional[int]) -> List[str]:
+    """根据提示生成确定性的回复（相同种子和提示得到相同回复）"""
+    prompt = json.dumps(messages, ensure_ascii=False, sort_keys=True)
+    digest = hashlib.sha256(f"{config.seed}:{prompt}".encode("utf-8")).digest()
+    rng = random.Random(digest)
+    count = rng.randint(config.min_tokens, config.max_tokens)
+    if max_tokens:
+        count = min(count, max_tokens)
+    return [rng.choice(VOCABULARY) for _ in range(count)]
+
+
+def error_response(status_code: int, message: str, error_type: str, headers: Optional[dict] = None) -> JSONResponse:
+    return JSONResponse(
+        status_code=status_code,
+        content={"error": {"message": message, "type": error_type, "code": status_code}},
+        headers=headers
+    )
+
+
+def create_app(config: Optional[MockConfig] = None) -> FastAPI:
+    """创建模拟服务应用"""
+    config = config or MockConfig()
+    state = MockState()
+    # 每个请求按序号派生独立的随机数，保证同样的请求序列得到同样的延迟和错误
+    sequence = itertools.count()
+    app = FastAPI(title="Mock LLM Server")
+    app.state.config = config
+    app.state.mock = state
+    
+    @app.get("/v1/models")
+    def list_models():
+        return {"object": "list", "data": [{"id": "mock-model", "object": "model", "owned_by": "mock"}]}
+    
+    @app.get("/stats")
+    def get_stats():
+        return {"config": asdict(config), **vars(state)}
+    
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        rng = random.Random(f"{config.seed}:{next(sequence)}")
+        state.requests += 1
+        
+        if config.max_concurrency and state.in_flight >= config.max_concurrency:
+            state.rate_limited += 1
+            return error_response(429, "Too many concurrent requests", "rate_limit_error", {"Retry-After": "1"})
+        if rng.random() < config.rate_limit_rate:
+            state.rate_limited += 1
+            return error_response(429, "Rate limit exceeded", "rate_limit_error", {"Retry-After": "1"})
+        if rng.random() < config.error_rate:
+            state.errors += 1
+            return error_response(500, "Injected upstream error", "server_error")
+        
+        model = body.get("model", "mock-model")
+        tokens = reply_tokens(config, body.get("messages", []), body.get("max_tokens"))
+        ttft = sample_ttft(config, rng)
+        interval = 1 / config.tokens_per_second if config.tokens_per_second > 0 else 0.0
+        completion_id = f"chatcmpl-{uuid.UUID(int=rng.getrandbits(128)).hex}"
+        created = int(time.time())
+        
+        if not body.get("stream"):
+            state.in_flight += 1
+            state.max_in_flight = max(state.max_in_flight, state.in_flight)
+            try:
+                await asyncio.sleep(ttft + interval * (len(tokens) - 1))
+            finally:
+                state.in_flight -= 1
+            state.tokens += len(tokens)
+            return {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "".join(tokens)},
+                    "finish_reason": "stop"
+                }],
+                "usage": {"prompt_tokens": 0, "completion_tokens": len(tokens), "total_tokens": len(tokens)}
+            }
+        
+        def frame(delta: dict, finish_reason: Optional[str] = None) -> str:
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+            }
+            return f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+        
+        async def generate():
+            state.streams += 1
+            state.in_flight += 1
+            state.max_in_flight = max(state.max_in_flight, state.in_flight)
+            try:
+                await asyncio.sleep(ttft)
+                for index, token in enumerate(tokens):
+                    if index and interval:
+                        await asyncio.sleep(interval)
+                    delta = {"role": "assistant", "content": token} if index == 0 else {"content": token}
+                    yield frame(delta)
+                    state.tokens += 1
+                yield frame({}, "stop")
+                yield "data: [DONE]\n\n"
+            finally:
+                state.in_flight -= 1
+        
+        return StreamingResponse(generate(), media_type="text/event-stream")
+    
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地模拟的OpenAI兼容大模型服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--ttft-dist", choices=["fixed", "uniform", "exponential", "lognormal"], default="fixed")
+    parser.add_argument("--ttft-mean", type=float, default=0.3, help="首token延迟均值（秒）")
+    parser.add_argument("--ttft-jitter", type=float, default=0.5, help="uniform相对半宽 / lognormal对数标准差")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0, help="生成速度，0表示不限速")
+    parser.add_argument("--min-tokens", type=int, default=20)
+    parser.add_argument("--max-tokens", type=int, default=200)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回500的概率")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="返回429的概率")
+    parser.add_argument("--max-concurrency", type=int, default=0, help="并发上限（超过返回429），0表示不限制")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    
+    import uvicorn
+    
+    config = MockConfig(
+        ttft_dist=args.ttft_dist,
+        ttft_mean=args.ttft_mean,
+        ttft_jitter=args.ttft_jitter,
+        tokens_per_second=args.tokens_per_second,
+        min_tokens=args.min_tokens,
+        max_tokens=args.max_tokens,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        max_concurrency=args.max_concurrency,
+        seed=args.seed
+    )
+    print(f"🚀 模拟大模型服务: http://{args.host}:{args.port}/v1")
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
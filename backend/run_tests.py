@@ -66,6 +66,10 @@ def main():
             "command": "python -m pytest tests/test_services.py -v",
             "description": "服务层单元测试"
         },
+        {
+            "command": "python -m pytest tests/test_ai.py -v",
+            "description": "AI 服务单元测试"
+        },
         {
             "command": "python -m pytest tests/test_security.py -v",
             "description": "安全性测试"
@@ -0,0 +1,832 @@
+import asyncio
+import random
+import time
+import httpx
+import pytest
+from types import SimpleNamespace
+from openai import AsyncOpenAI
+from app.config import BackendConfig, settings
+from app.models.message import Message, MessageRole
+from app.services.ai import AIService
+from app.services.singleflight import SingleFlight
+from app.services.limiter import AdaptiveLimiter, LimiterTimeout
+from app.services.resilience import CircuitBreaker, CircuitOpenError, Hedger, LatencyTracker
+from app.services.router import Backend, BackendRouter, create_router
+from app.services.cache import LRUCache, ResponseCache, MemoryCacheBackend, response_cache
+from app.services.context import ContextBuilder
+from app.utils.tokenizer import count_tokens
+from app.utils.streaming import iterate_in_task
+from app.utils.sse import coalesce, sse_event, sse_stats
+from mock_llm_server import MockConfig, create_app, sample_ttft
+
+
+class FakeStream:
+    """模拟上游流式响应"""
+    
+    def __init__(self, pieces, delay=0.0):
+        self.pieces = pieces
+        self.delay = delay
+        self.response = self
+        self.closed = False
+    
+    async def aclose(self):
+        self.closed = True
+    
+    async def __aiter__(self):
+        for piece in self.pieces:
+            if self.delay:
+                await asyncio.sleep(self.delay)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=piece))])
+
+
+class FakeClient:
+    """模拟OpenAI兼容客户端，记录调用次数"""
+    
+    def __init__(self, reply="你好，我是AI助手。", delay=0.0):
+        self.reply = reply
+        self.delay = delay
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+    
+    async def create(self, model, messages, stream=False, **kwargs):
+        self.calls += 1
+        if stream:
+            return FakeStream([self.reply[i:i + 2] for i in range(0, len(self.reply), 2)], self.delay)
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=self.reply))])
+
+
+def make_backend(name, client, weight=1.0):
+    return Backend(BackendConfig(name=name, base_url=f"http://{name}", model="qwen-plus", weight=weight), client)
+
+
+@pytest.fixture
+def fake_client(monkeypatch):
+    """替换AI客户端并清空回复缓存"""
+    client = FakeClient()
+    router = BackendRouter([make_backend("fake", client)])
+    monkeypatch.setattr(AIService, "_get_router", staticmethod(lambda: router))
+    asyncio.run(response_cache.clear())
+    yield client
+    asyncio.run(response_cache.clear())
+
+
+class TestAIClient:
+    """AI客户端连接池测试"""
+    
+    def test_client_is_shared(self, monkeypatch):
+        """测试客户端在进程内共享并可关闭"""
+        monkeypatch.setattr(settings, "DASHSCOPE_API_KEY", "test-key")
+        
+        async def test_async():
+            AIService.init_client()
+            first = AIService._get_router()
+            second = AIService._get_router()
+            assert first is not None
+            assert first is second
+            
+            await AIService.close_client()
+            assert AIService._get_router() is not first
+            await AIService.close_client()
+        
+        asyncio.run(test_async())
+    
+    def test_no_client_without_api_key(self, monkeypatch):
+        """测试未配置API密钥时返回模拟回复"""
+        monkeypatch.setattr(settings, "DASHSCOPE_API_KEY", None)
+        
+        async def test_async():
+            await AIService.close_client()
+            assert AIService._get_router() is None
+            return await AIService.get_ai_response("你好")
+        
+        response = asyncio.run(test_async())
+        assert "模拟AI回复" in response
+
+
+class TestStreamPipeline:
+    """流式生产者/消费者管道测试"""
+    
+    def test_bounded_queue_backpressure(self):
+        """测试消费者不读取时生产者最多领先队列长度"""
+        produced = []
+        
+        async def source():
+            for i in range(100):
+                produced.append(i)
+                yield i
+        
+        async def test_async():
+            stream = iterate_in_task(source(), maxsize=4)
+            first = await stream.__anext__()
+            await asyncio.sleep(0.05)
+            # 队列容量 + 已交付的1个 + 阻塞在put上的1个
+            assert len(produced) <= 4 + 2
+            rest = [item async for item in stream]
+            return [first] + rest
+        
+        assert asyncio.run(test_async()) == list(range(100))
+    
+    def test_consumer_exit_cancels_producer(self):
+        """测试消费者提前退出时取消上游读取"""
+        state = {"closed": False}
+        
+        async def source():
+            try:
+                i = 0
+                while True:
+                    yield i
+                    i += 1
+                    await asyncio.sleep(0.001)
+            finally:
+                state["closed"] = True
+        
+        async def test_async():
+            stream = iterate_in_task(source(), maxsize=2)
+            async for item in stream:
+                if item == 3:
+                    break
+            await stream.aclose()
+        
+        asyncio.run(test_async())
+        assert state["closed"] is True
+    
+    def test_producer_error_propagates(self):
+        """测试上游异常传递给消费者"""
+        async def source():
+            yield "a"
+            raise RuntimeError("upstream failed")
+        
+        async def test_async():
+            items = []
+            with pytest.raises(RuntimeError):
+                async for item in iterate_in_task(source(), maxsize=2):
+                    items.append(item)
+            return items
+        
+        assert asyncio.run(test_async()) == ["a"]
+
+
+class TestContextBuilder:
+    """上下文构建测试"""
+    
+    def test_count_tokens(self):
+        """测试本地分词计数"""
+        assert count_tokens("") == 0
+        assert count_tokens("你好世界") == 4
+        assert count_tokens("hello") == 2
+        assert count_tokens("你好, world") == 5
+    
+    def test_token_count_cached_on_write(self):
+        """测试消息写入内容时缓存token数"""
+        message = Message(role=MessageRole.USER, content="你好世界")
+        assert message.token_count == 4
+        
+        message.content = "你好"
+        assert message.token_count == 2
+    
+    def test_fills_budget_from_newest(self):
+        """测试从最新消息开始填充token预算"""
+        history = [
+            Message(role=MessageRole.USER, content="很早的消息" * 100),
+            Message(role=MessageRole.ASSISTANT, content="较早的回复"),
+            Message(role=MessageRole.USER, content="最近的问题"),
+            Message(role=MessageRole.ASSISTANT, content="最近的回复"),
+        ]
+        
+        messages = ContextBuilder.build("新问题", history, token_budget=60, system_prompt="系统")
+        
+        assert messages[0] == {"role": "system", "content": "系统"}
+        assert messages[-1] == {"role": "user", "content": "新问题"}
+        contents = [msg["content"] for msg in messages[1:-1]]
+        assert contents == ["较早的回复", "最近的问题", "最近的回复"]
+    
+    def test_oversized_message_stops_history(self):
+        """测试超出预算的消息不会被截入上下文"""
+        history = [
+            Message(role=MessageRole.USER, content="短消息"),
+            Message(role=MessageRole.ASSISTANT, content="长" * 1000),
+        ]
+        
+        messages = ContextBuilder.build("问题", history, token_budget=100, system_prompt="系统")
+        
+        assert len(messages) == 2
+
+
+class TestResponseCache:
+    """AI回复缓存测试"""
+    
+    def test_lru_eviction(self):
+        """测试超过容量时淘汰最久未使用的条目"""
+        cache = LRUCache(max_size=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        
+        assert cache.get("a") == 1
+        assert cache.get("b") is None
+        assert cache.get("c") == 3
+    
+    def test_ttl_expiry(self):
+        """测试条目过期"""
+        cache = LRUCache(max_size=10, ttl=0.01)
+        cache.set("a", 1)
+        time.sleep(0.02)
+        
+        assert cache.get("a") is None
+        assert len(cache) == 0
+    
+    def test_key_is_canonical(self):
+        """测试缓存键只取决于模型和消息内容"""
+        messages = [{"role": "user", "content": "你好"}]
+        
+        assert ResponseCache.make_key("m", messages) == ResponseCache.make_key("m", [dict(messages[0])])
+        assert ResponseCache.make_key("m", messages) != ResponseCache.make_key("n", messages)
+    
+    def test_hit_miss_counters(self):
+        """测试命中/未命中计数"""
+        cache = ResponseCache(MemoryCacheBackend(max_size=10, ttl=None))
+        
+        async def test_async():
+            assert await cache.get("k") is None
+            await cache.set("k", "回复")
+            assert await cache.get("k") == "回复"
+        
+        asyncio.run(test_async())
+        stats = cache.stats()
+        assert stats["hits"] == 1
+        assert stats["misses"] == 1
+        assert stats["size"] == 1
+    
+    def test_identical_prompt_served_from_cache(self, fake_client):
+        """测试相同提示只调用一次上游"""
+        async def test_async():
+            first = await AIService.get_ai_response("如何重置密码")
+            second = await AIService.get_ai_response("如何重置密码")
+            return first, second
+        
+        first, second = asyncio.run(test_async())
+        assert first == second == fake_client.reply
+        assert fake_client.calls == 1
+    
+    def test_cache_scoped_to_backend_models(self, fake_client, monkeypatch):
+        """测试端点的模型集合变化后不复用其他模型的缓存回复"""
+        asyncio.run(AIService.get_ai_response("如何重置密码"))
+        other = FakeClient(reply="另一个模型的回复")
+        router = BackendRouter([
+            make_backend("fake", fake_client),
+            Backend(BackendConfig(name="other", base_url="http://other", model="qwen-max"), other)
+        ])
+        monkeypatch.setattr(AIService, "_get_router", staticmethod(lambda: router))
+        
+        reply = asyncio.run(AIService.get_ai_response("如何重置密码"))
+        
+        assert router.models == "qwen-max,qwen-plus"
+        assert fake_client.calls + other.calls == 2
+        assert reply in (fake_client.reply, other.reply)
+    
+    def test_stream_replays_cached_reply(self, fake_client):
+        """测试流式接口命中缓存时按分块重放"""
+        async def collect():
+            return [chunk async for chunk in AIService.get_ai_response_stream("如何重置密码")]
+        
+        first = asyncio.run(collect())
+        second = asyncio.run(collect())
+        
+        assert "".join(first) == "".join(second) == fake_client.reply
+        assert fake_client.calls == 1
+
+
+class TestSemanticCache:
+    """语义缓存测试"""
+    
+    @pytest.fixture
+    def cache(self):
+        pytest.importorskip("numpy", minversion="2.0")
+        from app.services.semantic_cache import SemanticCache
+        return SemanticCache(max_entries=4, threshold=0.85)
+    
+    def test_near_duplicate_hit(self, cache):
+        """测试近似问题命中"""
+        cache.add("How do I reset my password?", "重置密码的方法", scope=1)
+        
+        assert cache.lookup("how do i reset my password", scope=1) == "重置密码的方法"
+        assert cache.lookup("今天天气怎么样", scope=1) is None
+        assert cache.stats()["hits"] == 1
+        assert cache.stats()["misses"] == 1
+    
+    @pytest.mark.parametrize("cached, query", [
+        ("黄金价格是多少", "白银价格是多少"),
+        ("delete account", "create account"),
+        ("how to delete my account", "how to create my account"),
+        ("北京明天天气", "上海明天天气"),
+    ])
+    def test_near_miss_rejected(self, cache, cached, query):
+        """测试只差关键字的问题不命中"""
+        cache.add(cached, "回复", scope=1)
+        
+        assert cache.lookup(query, scope=1) is None
+        assert cache.lookup(cached, scope=1) == "回复"
+    
+    def test_short_text_embedded(self, cache):
+        """测试短于n-gram长度的文本也能命中"""
+        cache.add("好", "回复", scope=1)
+        
+        assert cache.lookup("好！", scope=1) == "回复"
+        assert cache.lookup("嗯", scope=1) is None
+    
+    def test_scope_isolation(self, cache):
+        """测试不同作用域（模型/系统提示）之间不复用回复"""
+        cache.add("如何重置密码", "回复", scope=1)
+        
+        assert cache.lookup("如何重置密码", scope=2) is None
+    
+    def test_batch_lookup(self, cache):
+        """测试批量查询"""
+        cache.add("如何重置密码", "密码", scope=1)
+        cache.add("如何修改用户名", "用户名", scope=1)
+        
+        results = cache.lookup_batch(["如何重置密码？", "如何修改用户名？", "推荐一本书"], scope=1)
+        
+        assert results == ["密码", "用户名", None]
+    
+    def test_evicts_least_recently_used(self, cache):
+        """测试容量满时淘汰最久未命中的条目"""
+        for i in range(4):
+            cache.add(f"问题编号{i}号", f"回复{i}", scope=1)
+            time.sleep(0.001)
+        cache.lookup("问题编号0号", scope=1)
+        cache.add("新的问题", "新回复", scope=1)
+        
+        assert cache.size == 4
+        assert cache.lookup("问题编号0号", scope=1) == "回复0"
+        assert cache.lookup("问题编号1号", scope=1) is None
+
+
+class TestSingleFlight:
+    """相同请求合并测试"""
+    
+    def test_concurrent_requests_coalesced(self, fake_client, monkeypatch):
+        """测试并发的相同请求只调用一次上游"""
+        monkeypatch.setattr(settings, "AI_CACHE_ENABLED", False)
+        fake_client.delay = 0.05
+        
+        async def test_async():
+            return await asyncio.gather(*[AIService.get_ai_response("热门问题") for _ in range(5)])
+        
+        results = asyncio.run(test_async())
+        assert results == [fake_client.reply] * 5
+        assert fake_client.calls == 1
+    
+    def test_concurrent_streams_share_upstream(self, fake_client, monkeypatch):
+        """测试并发的相同流式请求订阅同一个上游流"""
+        monkeypatch.setattr(settings, "AI_CACHE_ENABLED", False)
+        fake_client.delay = 0.01
+        
+        async def collect():
+            return "".join([chunk async for chunk in AIService.get_ai_response_stream("热门问题")])
+        
+        async def test_async():
+            return await asyncio.gather(*[collect() for _ in range(3)])
+        
+        assert asyncio.run(test_async()) == [fake_client.reply] * 3
+        assert fake_client.calls == 1
+    
+    def test_follower_survives_leader_leaving(self):
+        """测试领导者提前退出时跟随者仍能收到完整结果"""
+        flight = SingleFlight()
+        
+        async def source():
+            for piece in ["a", "b", "c", "d"]:
+                await asyncio.sleep(0.01)
+                yield piece
+        
+        async def leader():
+            async for chunk in flight.stream("k", source, max_lag=8):
+                break
+        
+        async def follower():
+            return "".join([chunk async for chunk in flight.stream("k", source, max_lag=8)])
+        
+        async def test_async():
+            return await asyncio.gather(leader(), follower())
+        
+        assert asyncio.run(test_async())[1] == "abcd"
+        assert flight.stats()["coalesced"] == 1
+    
+    def test_error_propagates_to_all(self):
+        """测试上游错误传递给所有等待者"""
+        flight = SingleFlight()
+        
+        async def failing():
+            await asyncio.sleep(0.01)
+            raise RuntimeError("upstream failed")
+        
+        async def test_async():
+            return await asyncio.gather(
+                flight.do("k", failing), flight.do("k", failing), return_exceptions=True
+            )
+        
+        results = asyncio.run(test_async())
+        assert all(isinstance(result, RuntimeError) for result in results)
+
+
+class TestAdaptiveLimiter:
+    """自适应并发限制测试"""
+    
+    def test_queue_and_timeout(self):
+        """测试超过上限的请求排队，超时后失败"""
+        limiter = AdaptiveLimiter(initial_limit=1, min_limit=1, max_limit=10, queue_timeout=0.05)
+        
+        async def test_async():
+            await limiter.acquire()
+            assert limiter.in_flight == 1
+            with pytest.raises(LimiterTimeout):
+                await limiter.acquire()
+            
+            waiter = asyncio.create_task(limiter.acquire(timeout=1))
+            await asyncio.sleep(0.01)
+            assert limiter.stats()["queue_depth"] == 1
+            limiter.release()
+            await waiter
+            assert limiter.in_flight == 1
+            limiter.release()
+        
+        asyncio.run(test_async())
+        assert limiter.stats()["timeouts"] == 1
+        assert limiter.in_flight == 0
+    
+    def test_additive_increase(self):
+        """测试延迟正常时逐步提高上限"""
+        limiter = AdaptiveLimiter(initial_limit=4, min_limit=1, max_limit=10)
+        for _ in range(5):
+            limiter.on_success(0.1)
+        
+        assert int(limiter.limit) == 5
+    
+    def test_decrease_on_overload(self):
+        """测试429和延迟突增时下调上限"""
+        limiter = AdaptiveLimiter(initial_limit=10, min_limit=2, max_limit=20, backoff=0.5)
+        
+        async def rate_limited():
+            async with limiter.slot():
+                raise asyncio.TimeoutError()
+        
+        with pytest.raises(asyncio.TimeoutError):
+            asyncio.run(rate_limited())
+        assert int(limiter.limit) == 5
+        assert limiter.in_flight == 0
+        
+        # 同一窗口内的再次过载不重复下调
+        limiter.on_overload()
+        assert int(limiter.limit) == 5
+        
+        limiter._last_decrease = 0
+        limiter.baseline_latency = 0.1
+        limiter.on_success(1.0)
+        assert int(limiter.limit) == 2
+
+
+class TestResilience:
+    """对冲请求与熔断器测试"""
+    
+    def test_breaker_opens_and_recovers(self):
+        """测试连续失败后熔断，冷却后放行单个探测请求"""
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+        for _ in range(2):
+            breaker.before_call()
+            breaker.on_failure(asyncio.TimeoutError())
+        assert breaker.state == CircuitBreaker.OPEN
+        with pytest.raises(CircuitOpenError):
+            breaker.before_call()
+        
+        # 参数错误等非健康类错误不计入失败
+        other = CircuitBreaker(failure_threshold=1, reset_timeout=1)
+        other.on_failure(ValueError("bad request"))
+        assert other.closed
+        
+        time.sleep(0.06)
+        breaker.before_call()
+        assert breaker.state == CircuitBreaker.HALF_OPEN
+        with pytest.raises(CircuitOpenError):
+            breaker.before_call()
+        breaker.on_success()
+        assert breaker.closed
+        assert breaker.stats()["trips"] == 1
+        assert breaker.stats()["rejected"] == 2
+    
+    def test_hedge_uses_faster_attempt(self, monkeypatch):
+        """测试首token超时后发起第二次尝试并采用先返回的结果"""
+        monkeypatch.setattr(settings, "AI_HEDGE_ENABLED", True)
+        monkeypatch.setattr(settings, "AI_HEDGE_MIN_SAMPLES", 5)
+        monkeypatch.setattr(settings, "AI_HEDGE_MIN_DELAY", 0.01)
+        tracker = LatencyTracker()
+        for _ in range(5):
+            tracker.record(0.02)
+        hedger = Hedger(tracker)
+        attempts = []
+        closed = []
+        
+        async def attempt(index, delay):
+            try:
+                await asyncio.sleep(delay)
+                yield f"第{index}次"
+                yield "完成"
+            finally:
+                closed.append(index)
+        
+        def factory():
+            attempts.append(len(attempts))
+            return attempt(len(attempts), 5.0 if len(attempts) == 1 else 0.0)
+        
+        async def test_async():
+            return [chunk async for chunk in hedger.stream(factory)]
+        
+        started = time.monotonic()
+        assert asyncio.run(test_async()) == ["第2次", "完成"]
+        assert time.monotonic() - started < 1.0
+        assert len(attempts) == 2
+        assert sorted(closed) == [1, 2]
+        assert hedger.stats()["hedged"] == 1
+        assert hedger.stats()["hedge_wins"] == 1
+    
+    def test_no_hedge_without_samples(self, monkeypatch):
+        """测试TTFT样本不足时不对冲"""
+        monkeypatch.setattr(settings, "AI_HEDGE_ENABLED", True)
+        hedger = Hedger(LatencyTracker())
+        assert hedger.delay() is None
+    
+    def test_open_circuit_fails_fast(self, fake_client, monkeypatch):
+        """测试熔断中不调用上游，流式与非流式均抛出CircuitOpenError"""
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+        breaker.on_failure(asyncio.TimeoutError())
+        monkeypatch.setattr("app.services.ai.circuit_breaker", breaker)
+        
+        async def consume_stream():
+            return [chunk async for chunk in AIService.get_ai_response_stream("熔断测试")]
+        
+        with pytest.raises(CircuitOpenError):
+            asyncio.run(AIService.get_ai_response("熔断测试"))
+        with pytest.raises(CircuitOpenError):
+            asyncio.run(consume_stream())
+        assert fake_client.calls == 0
+    
+    def test_limiter_timeout_not_saved_as_reply(self, fake_client, monkeypatch):
+        """测试排队超时（过载）抛出LimiterTimeout，而不是作为回复文本返回"""
+        limiter = AdaptiveLimiter(initial_limit=1, min_limit=1, max_limit=1, queue_timeout=0.01)
+        monkeypatch.setattr("app.services.ai.ai_limiter", limiter)
+        monkeypatch.setattr(settings, "AI_CACHE_ENABLED", False)
+        
+        async def test_async():
+            await limiter.acquire()
+            try:
+                await AIService.get_ai_response("过载测试")
+            finally:
+                limiter.release()
+        
+        with pytest.raises(LimiterTimeout):
+            asyncio.run(test_async())
+        assert fake_client.calls == 0
+    
+    def test_sdk_retries_disabled(self, monkeypatch):
+        """测试限流名额内的客户端不在SDK内重试，429直接交给限流器"""
+        monkeypatch.setattr(settings, "DASHSCOPE_API_KEY", "test-key")
+        router = create_router()
+        try:
+            assert all(backend.client.max_retries == 0 for backend in router.backends)
+        finally:
+            asyncio.run(router.close())
+    
+    def test_backend_stats_hide_base_url(self, monkeypatch):
+        """测试运行指标中的端点名称不暴露base_url"""
+        monkeypatch.setattr(settings, "QWEN_BACKENDS", [
+            BackendConfig(base_url="http://10.0.0.5:8000/v1", api_key="k", model="qwen-plus"),
+            BackendConfig(name="backup", base_url="http://10.0.0.6:8000/v1", api_key="k", model="qwen-plus")
+        ])
+        router = create_router()
+        try:
+            stats = router.stats()
+            assert [backend["name"] for backend in stats] == ["backend-0", "backup"]
+            assert "10.0.0" not in repr(stats)
+        finally:
+            asyncio.run(router.close())
+    
+    def test_upstream_success_closes_breaker(self, fake_client, monkeypatch):
+        """测试收到首token后记录为健康调用"""
+        breaker = CircuitBreaker(failure_threshold=3, reset_timeout=60)
+        breaker.on_failure(asyncio.TimeoutError())
+        monkeypatch.setattr("app.services.ai.circuit_breaker", breaker)
+        
+        reply = asyncio.run(AIService.get_ai_response("健康检查"))
+        assert reply == fake_client.reply
+        assert breaker.stats()["consecutive_failures"] == 0
+
+
+class TestBackendRouter:
+    """多上游端点路由测试"""
+    
+    def test_prefers_faster_backend(self):
+        """测试按首token延迟估计偏向较快的端点"""
+        fast = make_backend("fast", FakeClient())
+        slow = make_backend("slow", FakeClient())
+        router = BackendRouter([fast, slow], rng=random.Random(0))
+        router.on_first_token(fast, 0.1)
+        router.on_first_token(slow, 2.0)
+        
+        picks = [router.pick().name for _ in range(100)]
+        assert picks.count("fast") == 100
+    
+    def test_eject_and_readmit(self, monkeypatch):
+        """测试连续失败后摘除端点，到期后重新参与路由"""
+        monkeypatch.setattr(settings, "AI_ROUTER_EJECT_FAILURES", 2)
+        monkeypatch.setattr(settings, "AI_ROUTER_EJECT_SECONDS", 0.05)
+        bad = make_backend("bad", FakeClient())
+        good = make_backend("good", FakeClient())
+        router = BackendRouter([bad, good], rng=random.Random(0))
+        
+        for _ in range(2):
+            router.on_failure(bad, asyncio.TimeoutError())
+        assert bad.stats()["ejected"] is True
+        assert all(router.pick() is good for _ in range(20))
+        
+        # 非健康类错误不影响端点状态
+        router.on_failure(good, ValueError("bad request"))
+        assert good.failures == 0
+        
+        time.sleep(0.06)
+        assert bad.stats()["ejected"] is False
+        assert router.pick(exclude=[good]) is bad
+    
+    def test_hedge_uses_other_backend(self, monkeypatch):
+        """测试对冲的第二次尝试使用另一个端点"""
+        monkeypatch.setattr(settings, "AI_HEDGE_ENABLED", True)
+        monkeypatch.setattr(settings, "AI_HEDGE_MIN_SAMPLES", 1)
+        monkeypatch.setattr(settings, "AI_HEDGE_MIN_DELAY", 0.01)
+        tracker = LatencyTracker()
+        tracker.record(0.01)
+        monkeypatch.setattr("app.services.ai.hedger", Hedger(tracker))
+        
+        stalled = FakeClient(reply="慢端点的回复", delay=5.0)
+        healthy = FakeClient(reply="快端点的回复")
+        router = BackendRouter([make_backend("stalled", stalled), make_backend("healthy", healthy)])
+        monkeypatch.setattr(router, "pick", lambda exclude=(): [b for b in router.backends if b not in exclude][0])
+        monkeypatch.setattr(AIService, "_get_router", staticmethod(lambda: router))
+        asyncio.run(response_cache.clear())
+        
+        reply = asyncio.run(AIService.get_ai_response("对冲端点测试"))
+        assert reply == "快端点的回复"
+        assert stalled.calls == 1
+        assert healthy.calls == 1
+        assert all(backend.in_flight == 0 for backend in router.backends)
+    
+    def test_summary_goes_through_router(self, monkeypatch):
+        """测试摘要请求同样计入熔断器和端点统计，并限制摘要长度"""
+        breaker = CircuitBreaker(failure_threshold=3, reset_timeout=60)
+        monkeypatch.setattr("app.services.ai.circuit_breaker", breaker)
+        client = FakeClient(reply="用户在询问天气")
+        backend = make_backend("summary", client)
+        router = BackendRouter([backend])
+        monkeypatch.setattr(AIService, "_get_router", staticmethod(lambda: router))
+        turns = [{"role": "user", "content": "明天会下雨吗"}]
+        
+        options = []
+        create = client.create
+        
+        async def recording_create(model, messages, stream=False, **kwargs):
+            options.append(kwargs)
+            return await create(model, messages, stream, **kwargs)
+        
+        client.chat.completions.create = recording_create
+        assert asyncio.run(AIService.summarize(None, turns)) == "用户在询问天气"
+        assert options == [{"max_tokens": settings.AI_SUMMARY_MAX_TOKENS}]
+        assert backend.in_flight == 0
+        
+        async def failing_create(model, messages, stream=False, **kwargs):
+            raise asyncio.TimeoutError()
+        
+        client.chat.completions.create = failing_create
+        assert asyncio.run(AIService.summarize(None, turns)) is None
+        assert breaker.stats()["consecutive_failures"] == 1
+        assert backend.failures == 1
+        assert backend.in_flight == 0
+
+
+class TestMockLLMServer:
+    """本地模拟大模型服务测试"""
+    
+    @staticmethod
+    def use_mock(monkeypatch, config):
+        """将AI服务指向进程内的模拟服务"""
+        mock_app = create_app(config)
+        client = AsyncOpenAI(
+            api_key="mock",
+            base_url="http://mock/v1",
+            max_retries=0,
+            http_client=httpx.AsyncClient(transport=httpx.ASGITransport(app=mock_app))
+        )
+        router = BackendRouter([make_backend("mock", client)])
+        monkeypatch.setattr(AIService, "_get_router", staticmethod(lambda: router))
+        asyncio.run(response_cache.clear())
+        return mock_app.state.mock
+    
+    def test_stream_and_complete(self, monkeypatch):
+        """测试流式与非流式调用得到相同的确定性回复"""
+        state = self.use_mock(monkeypatch, MockConfig(ttft_mean=0.0, tokens_per_second=0, seed=7))
+        monkeypatch.setattr(settings, "AI_CACHE_ENABLED", False)
+        
+        async def test_async():
+            chunks = [chunk async for chunk in AIService.get_ai_response_stream("模拟服务测试")]
+            reply = await AIService.get_ai_response("模拟服务测试")
+            return chunks, reply
+        
+        chunks, reply = asyncio.run(test_async())
+        assert len(chunks) >= 20
+        assert "".join(chunks) == reply
+        assert state.requests == 2
+        assert state.in_flight == 0
+    
+    def test_rate_limit_injection(self, monkeypatch):
+        """测试注入的429以错误形式返回"""
+        state = self.use_mock(monkeypatch, MockConfig(ttft_mean=0.0, rate_limit_rate=1.0))
+        monkeypatch.setattr("app.services.ai.circuit_breaker", CircuitBreaker(failure_threshold=100, reset_timeout=1))
+        
+        reply = asyncio.run(AIService.get_ai_response("限流测试"))
+        assert reply.startswith("抱歉，调用AI服务时发生错误")
+        assert state.rate_limited == 1
+    
+    def test_ttft_distribution_is_seeded(self):
+        """测试相同种子得到相同的延迟序列"""
+        config = MockConfig(ttft_dist="lognormal", ttft_mean=0.5, ttft_jitter=1.0)
+        first = [sample_ttft(config, random.Random(f"1:{i}")) for i in range(200)]
+        second = [sample_ttft(config, random.Random(f"1:{i}")) for i in range(200)]
+        assert first == second
+        assert 0.3 < sum(first) / len(first) < 0.8
+
+
+class TestSSECoalescing:
+    """SSE分块合并测试"""
+    
+    @staticmethod
+    async def source(pieces, delay=0.0, error=None):
+        for piece in pieces:
+            if delay:
+                await asyncio.sleep(delay)
+            yield piece
+        if error is not None:
+            raise error
+    
+    def test_flush_interval(self):
+        """测试按时间间隔合并，首个分块立即输出"""
+        pieces = [str(i % 10) for i in range(60)]
+        
+        async def test_async():
+            return [frame async for frame in coalesce(self.source(pieces, delay=0.002), 4096, 0.03)]
+        
+        frames = asyncio.run(test_async())
+        assert "".join(frames) == "".join(pieces)
+        assert frames[0] == "0"
+        assert len(frames) < len(pieces) / 3
+    
+    def test_flush_bytes(self):
+        """测试缓冲达到字节阈值时立即输出"""
+        pieces = ["你好"] * 100
+        
+        async def test_async():
+            return [frame async for frame in coalesce(self.source(pieces), 30, 10.0)]
+        
+        frames = asyncio.run(test_async())
+        assert "".join(frames) == "".join(pieces)
+        assert all(len(frame.encode("utf-8")) >= 30 for frame in frames[1:-1])
+    
+    def test_zero_interval_passthrough(self):
+        """测试刷新间隔为0时逐块输出"""
+        async def test_async():
+            return [frame async for frame in coalesce(self.source(["a", "b", "c"]), 1024, 0)]
+        
+        assert asyncio.run(test_async()) == ["a", "b", "c"]
+    
+    def test_error_flushes_buffer(self):
+        """测试上游异常前已缓冲的内容先输出"""
+        frames = []
+        
+        async def test_async():
+            async for frame in coalesce(self.source(["a", "b", "c"], error=RuntimeError("boom")), 1024, 10.0):
+                frames.append(frame)
+        
+        with pytest.raises(RuntimeError):
+            asyncio.run(test_async())
+        assert "".join(frames) == "abc"
+    
+    def test_frame_stats(self):
+        """测试帧数和字节数统计"""
+        frames_before = sse_stats.frames
+        frame = sse_event({"type": "ai_chunk", "content": "你好"})
+        assert frame.startswith("data: ") and frame.endswith("\n\n")
+        assert sse_stats.frames == frames_before + 1
+        assert sse_stats.stats()["frames_per_second"] > 0
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -1,9 +1,19 @@
+import gzip
+import json
 import pytest
+from datetime import datetime
+from typing import List
 from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+from pydantic import TypeAdapter
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from app.main import app
 from app.database import Base, get_db
+from app.models.message import Message, MessageRole
+from app.schemas.message import MessageResponse, dump_messages
+from app.services.ai import AIService
+from app.utils.serialization import dumps_json, negotiate
 
 # 创建测试数据库
 SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
@@ -505,6 +515,18 @@ def test_unauthorized_access():
     assert response.status_code == 401
 
 
+def test_metrics_requires_auth():
+    """测试运行指标需要登录"""
+    response = client.get("/api/metrics")
+    assert response.status_code == 401
+    
+    headers = get_auth_headers(websocket_token("metricsuser"))
+    response = client.get("/api/metrics", headers=headers)
+    assert response.status_code == 200
+    assert "response_cache" in response.json()
+    assert "backends" in response.json()
+
+
 def test_pagination():
     """测试分页功能"""
     # 创建用户并登录
@@ -532,5 +554,280 @@ def test_pagination():
     assert len(data) == 2  # 剩余2个
 
 
+
+def test_cursor_pagination_headers():
+    """测试游标分页通过响应头返回前后页游标，skip仍然可用"""
+    headers = get_auth_headers(websocket_token("cursorapi"))
+    conversation_id = client.post("/api/conversations", json={}, headers=headers).json()["id"]
+    for i in range(3):
+        client.post("/api/conversations", json={"title": f"对话{i}"}, headers=headers)
+    
+    response = client.get("/api/conversations?limit=2", headers=headers)
+    assert len(response.json()) == 2 and "x-prev-cursor" not in response.headers
+    response = client.get(f"/api/conversations?limit=2&cursor={response.headers['x-next-cursor']}", headers=headers)
+    assert [item["id"] for item in response.json()][-1] == conversation_id
+    assert "x-next-cursor" not in response.headers and "x-prev-cursor" in response.headers
+    
+    response = client.get("/api/conversations?skip=3&limit=2", headers=headers)
+    assert [item["id"] for item in response.json()] == [conversation_id]
+    
+    response = client.get(f"/api/conversations/{conversation_id}/messages?cursor=bad", headers=headers)
+    assert response.status_code == 400
+
+
+def test_conditional_get_etag(monkeypatch):
+    """测试列表接口的ETag：未变化时返回304，新增消息或改名后返回新内容"""
+    async def fake_response(message, conversation_history=None, summary=None):
+        return f"回复: {message}"
+    
+    monkeypatch.setattr(AIService, "get_ai_response", fake_response)
+    headers = get_auth_headers(websocket_token("etaguser"))
+    conversation_id = client.post("/api/conversations", json={"title": "轮询"}, headers=headers).json()["id"]
+    client.post(f"/api/conversations/{conversation_id}/messages", json={"content": "第一条"}, headers=headers)
+    url = f"/api/conversations/{conversation_id}/messages"
+    
+    first = client.get(url, headers=headers)
+    etag = first.headers["etag"]
+    assert first.headers["cache-control"] == "private, no-cache"
+    repeat = client.get(url, headers=headers)
+    assert repeat.headers["etag"] == etag and repeat.content == first.content
+    
+    not_modified = client.get(url, headers={**headers, "If-None-Match": etag})
+    assert not_modified.status_code == 304 and not_modified.content == b""
+    assert client.get(url, headers={**headers, "If-None-Match": f"W/{etag}"}).status_code == 304
+    # 不同的分页参数是不同的表示
+    assert client.get(f"{url}?limit=1", headers={**headers, "If-None-Match": etag}).status_code == 200
+    
+    client.post(url, json={"content": "第二条"}, headers=headers)
+    changed = client.get(url, headers={**headers, "If-None-Match": etag})
+    assert changed.status_code == 200 and changed.headers["etag"] != etag
+    assert [message["content"] for message in changed.json()][-1] == "回复: 第二条"
+    
+    listed = client.get("/api/conversations", headers=headers)
+    list_etag = listed.headers["etag"]
+    assert client.get("/api/conversations", headers={**headers, "If-None-Match": list_etag}).status_code == 304
+    client.put(f"/api/conversations/{conversation_id}", json={"title": "改名"}, headers=headers)
+    renamed = client.get("/api/conversations", headers={**headers, "If-None-Match": list_etag})
+    assert renamed.status_code == 200 and renamed.json()[0]["title"] == "改名"
+    assert renamed.json()[0]["message_count"] == 4
+    
+    # 其他用户不能借ETag探测对话
+    other = get_auth_headers(websocket_token("etagother"))
+    assert client.get(url, headers={**other, "If-None-Match": etag}).status_code == 404
+
+
+def test_export_import_roundtrip(monkeypatch):
+    """测试NDJSON导出（含gzip）后导入到另一个用户，内容一致；无效行整体回滚"""
+    async def fake_response(message, conversation_history=None, summary=None):
+        return f"回复: {message}"
+    
+    monkeypatch.setattr(AIService, "get_ai_response", fake_response)
+    headers = get_auth_headers(websocket_token("exporter"))
+    conversation_id = client.post("/api/conversations", json={"title": "备份"}, headers=headers).json()["id"]
+    contents = []
+    for i in range(2):
+        client.post(f"/api/conversations/{conversation_id}/messages", json={"content": f"消息{i}"}, headers=headers)
+        contents += [f"消息{i}", f"回复: 消息{i}"]
+    
+    exported = client.get("/api/export", headers=headers)
+    assert exported.headers["content-type"] == "application/x-ndjson"
+    records = [json.loads(line) for line in exported.content.splitlines()]
+    assert [record["type"] for record in records] == ["export", "conversation"] + ["message"] * 4
+    
+    compressed = client.get("/api/export?gzip=true", headers=headers)
+    assert gzip.decompress(compressed.content).count(b"\n") == len(records)
+    
+    importer = get_auth_headers(websocket_token("importer"))
+    response = client.post("/api/import", content=compressed.content, headers=importer)
+    assert response.status_code == 201
+    assert response.json() == {"conversations": 1, "messages": 4}
+    conversations = client.get("/api/conversations", headers=importer).json()
+    assert [(item["title"], item["message_count"]) for item in conversations] == [("备份", 4)]
+    assert conversations[0]["last_message_preview"] == "回复: 消息1"
+    messages = client.get(f"/api/conversations/{conversations[0]['id']}/messages", headers=importer).json()
+    assert [message["content"] for message in messages] == contents
+    
+    lines = exported.content.splitlines()
+    lines[3] = json.dumps({"type": "message", "conversation_id": conversation_id, "role": "robot", "content": "x"}).encode()
+    response = client.post("/api/import", content=b"\n".join(lines), headers=importer)
+    assert response.status_code == 400 and "第4行" in response.json()["detail"]
+    assert len(client.get("/api/conversations", headers=importer).json()) == 1
+
+
+def test_search_messages(monkeypatch):
+    """测试消息检索：按相关度排序、片段高亮、游标翻页、按对话过滤，不能检索他人的对话"""
+    async def fake_response(message, conversation_history=None, summary=None):
+        return "收到"
+    
+    monkeypatch.setattr(AIService, "get_ai_response", fake_response)
+    headers = get_auth_headers(websocket_token("searcher"))
+    first = client.post("/api/conversations", json={"title": "数据库"}, headers=headers).json()["id"]
+    second = client.post("/api/conversations", json={"title": "其他"}, headers=headers).json()["id"]
+    for content in ["顺便问一下这里说的数据库里面的索引到底是什么意思", "数据库的全文索引和数据库的ngram索引"]:
+        client.post(f"/api/conversations/{first}/messages", json={"content": content}, headers=headers)
+    client.post(f"/api/conversations/{second}/messages", json={"content": "另一个对话里的数据库索引"}, headers=headers)
+    client.post(f"/api/conversations/{second}/messages", json={"content": "无关的内容"}, headers=headers)
+    
+    response = client.get("/api/search", params={"q": "数据库 索引"}, headers=headers)
+    assert response.status_code == 200
+    hits = response.json()
+    assert len(hits) == 3
+    assert hits[0]["snippet"] == "数据库的全文索引和数据库的ngram索引"
+    assert hits[0]["highlights"][:2] == [[0, 3], [6, 8]]
+    assert hits[0]["conversation_title"] == "数据库"
+    assert [hit["score"] for hit in hits] == sorted((hit["score"] for hit in hits), reverse=True)
+    
+    pages = []
+    cursor = None
+    while True:
+        params = {"q": "数据库 索引", "limit": 2}
+        if cursor:
+            params["cursor"] = cursor
+        response = client.get("/api/search", params=params, headers=headers)
+        pages.append([hit["message_id"] for hit in response.json()])
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    assert pages == [[hit["message_id"] for hit in hits[:2]], [hits[2]["message_id"]]]
+    
+    filtered = client.get("/api/search", params={"q": "索引", "conversation_id": second}, headers=headers).json()
+    assert [hit["conversation_id"] for hit in filtered] == [second]
+    assert client.get("/api/search", params={"q": "不存在的词"}, headers=headers).json() == []
+    assert client.get("/api/search", params={"q": "，。"}, headers=headers).status_code == 400
+    
+    other = get_auth_headers(websocket_token("searcher2"))
+    assert client.get("/api/search", params={"q": "数据库"}, headers=other).json() == []
+    response = client.get("/api/search", params={"q": "数据库", "conversation_id": first}, headers=other)
+    assert response.status_code == 404
+
+
+# 序列化与内容协商测试
+def test_msgpack_negotiation():
+    """测试Accept请求msgpack时返回msgpack编码，其余情况保持JSON"""
+    msgpack = pytest.importorskip("msgpack")
+    
+    response = client.get("/health", headers={"Accept": "application/msgpack"})
+    assert response.headers["content-type"] == "application/msgpack"
+    assert "Accept" in response.headers["vary"]
+    assert msgpack.unpackb(response.content) == {"status": "healthy"}
+    
+    response = client.get("/health", headers={"Accept": "application/json, application/msgpack;q=0.5"})
+    assert response.headers["content-type"] == "application/json"
+    assert response.json() == {"status": "healthy"}
+
+
+def test_negotiate_accept_header():
+    """测试Accept头的权重解析"""
+    pytest.importorskip("msgpack")
+    assert negotiate("") == "application/json"
+    assert negotiate("*/*") == "application/json"
+    assert negotiate("application/x-msgpack") == "application/msgpack"
+    assert negotiate("application/msgpack;q=0.9, */*;q=0.1") == "application/msgpack"
+    assert negotiate("application/msgpack;q=0") == "application/json"
+
+
+def test_dump_messages_matches_response_model():
+    """测试列表接口的直接编码与响应模型的结果一致"""
+    messages = [
+        Message(id=1, conversation_id=2, role=MessageRole.USER, content="你好", status="complete",
+                created_at=datetime(2024, 1, 1, 8, 30, 15, 123456)),
+        Message(id=2, conversation_id=2, role=MessageRole.ASSISTANT, content="部分", status="truncated",
+                created_at=datetime(2024, 1, 1, 8, 30, 16))
+    ]
+    adapter = TypeAdapter(List[MessageResponse])
+    expected = adapter.dump_python(adapter.validate_python(messages, from_attributes=True), mode="json")
+    assert json.loads(dumps_json(dump_messages(messages))) == expected
+
+
+# WebSocket对话测试
+def websocket_token(username):
+    """注册用户并通过JSON登录获取令牌"""
+    create_test_user(username, f"{username}@example.com")
+    response = client.post("/api/auth/login", json={"username": username, "password": "testpassword"})
+    return response.json()["access_token"]
+
+
+def receive_until(websocket, predicate):
+    """读取消息直到满足条件，返回读取到的全部消息"""
+    received = []
+    while True:
+        message = websocket.receive_json()
+        received.append(message)
+        if predicate(message):
+            return received
+
+
+def test_websocket_multiplexed_streams(monkeypatch):
+    """测试一次认证后在同一连接上并行进行两个对话的流"""
+    async def fake_stream(message, conversation_history=None, summary=None):
+        for piece in ("回复", message):
+            yield piece
+    
+    monkeypatch.setattr(AIService, "get_ai_response_stream", fake_stream)
+    token = websocket_token("wsuser")
+    headers = get_auth_headers(token)
+    conversation_ids = [
+        client.post("/api/conversations", json={"title": f"对话{i}"}, headers=headers).json()["id"]
+        for i in range(2)
+    ]
+    
+    with client.websocket_connect("/api/ws") as websocket:
+        websocket.send_json({"type": "auth", "token": token})
+        assert websocket.receive_json()["type"] == "ready"
+        for index, conversation_id in enumerate(conversation_ids):
+            websocket.send_json({
+                "type": "send",
+                "conversation_id": conversation_id,
+                "content": f"问题{index}",
+                "request_id": str(index),
+                "flush_ms": 0
+            })
+        
+        finished = set()
+        
+        def all_done(message):
+            if message.get("event", {}).get("type") == "done":
+                finished.add(message["stream_id"])
+            return len(finished) == 2
+        
+        received = receive_until(websocket, all_done)
+    
+    accepted = {message["request_id"]: message for message in received if message.get("type") == "accepted"}
+    assert set(accepted) == {"0", "1"}
+    for index, conversation_id in enumerate(conversation_ids):
+        stream_id = accepted[str(index)]["stream_id"]
+        events = [message for message in received if message.get("stream_id") == stream_id and "event" in message]
+        assert all(message["conversation_id"] == conversation_id for message in events)
+        assert [message["id"] for message in events] == sorted(message["id"] for message in events)
+        complete = [message["event"] for message in events if message["event"]["type"] == "ai_complete"]
+        assert complete[0]["message"]["content"] == f"回复问题{index}"
+    
+    response = client.get(f"/api/conversations/{conversation_ids[0]}/messages", headers=headers)
+    assert [message["content"] for message in response.json()] == ["问题0", "回复问题0"]
+
+
+def test_websocket_rejects_invalid_token():
+    """测试令牌无效时关闭连接"""
+    with client.websocket_connect("/api/ws?token=invalid") as websocket:
+        with pytest.raises(WebSocketDisconnect) as exc_info:
+            websocket.receive_json()
+    assert exc_info.value.code == 4401
+
+
+def test_websocket_errors_and_msgpack():
+    """测试msgpack二进制帧，以及访问他人对话和未知消息类型时返回错误"""
+    msgpack = pytest.importorskip("msgpack")
+    token = websocket_token("wsbinary")
+    
+    with client.websocket_connect(f"/api/ws?token={token}&encoding=msgpack") as websocket:
+        assert msgpack.unpackb(websocket.receive_bytes())["type"] == "ready"
+        websocket.send_bytes(msgpack.packb({"type": "send", "conversation_id": 99999, "content": "你好", "request_id": "a"}))
+        error = msgpack.unpackb(websocket.receive_bytes())
+        assert error == {"type": "error", "request_id": "a", "status": 404, "message": "对话不存在"}
+        websocket.send_bytes(msgpack.packb({"type": "unknown"}))
+        assert msgpack.unpackb(websocket.receive_bytes())["type"] == "error"
+        websocket.send_bytes(msgpack.packb({"type": "ping", "request_id": "p"}))
+        assert msgpack.unpackb(websocket.receive_bytes()) == {"type": "pong", "request_id": "p"}
+
 if __name__ == "__main__":
     pytest.main([__file__]) 
\ No newline at end of file
@@ -1,16 +1,37 @@
+import gzip
 import pytest
-from sqlalchemy import create_engine
+import asyncio
+from datetime import datetime, timedelta, UTC
+from sqlalchemy import Text, create_engine, select, type_coerce
+from sqlalchemy.exc import TimeoutError as SQLAlchemyTimeoutError
 from sqlalchemy.orm import sessionmaker
 from fastapi import HTTPException
-from app.database import Base
+from app.database import Base, TimedQueuePool, pending_schema_changes, upgrade_schema
 from app.models.conversation import Conversation
-from app.models.message import Message, MessageRole
+from app.models.message import Message, MessageRole, MessageStatus
 from app.schemas.user import UserCreate
 from app.schemas.conversation import ConversationCreate, ConversationUpdate
 from app.schemas.message import MessageCreate
+from app.services.archive import ArchiveService
 from app.services.auth import AuthService
+from app.services.batch import BatchItemStatus, BatchService, batch_registry
 from app.services.conversation import ConversationService
+from app.services.summary import SummaryService
+from app.services.ai import AIService
+from app.services.context import ContextBuilder
+from app.services.resilience import CircuitOpenError
+from app.services.search import SearchService, UserIndex, make_snippet, search_terms, tokenize
+from app.services.generation import GenerationService, generation_stats
+from app.services.limiter import LimiterTimeout
+from app.services.maintenance import MaintenanceService
+from app.services.page_cache import CachedPage, PageCache
+from app.services.stream_registry import StreamRegistry, StreamSession
+from app.config import settings
+from app.utils.compression import RawText, ZLIB, decode, encode, is_compressed
+from app.utils.pagination import decode_cursor
+from app.utils.process_lock import ProcessLock
 from app.utils.security import verify_password
+from app.utils.tokenizer import count_tokens
 
 # 创建测试数据库
 SQLALCHEMY_DATABASE_URL = "sqlite:///./test_services.db"
@@ -306,6 +327,83 @@ class TestConversationService:
         ).all()
         assert len(messages) == 2
     
+    def test_send_message_releases_connection(self, db_session, monkeypatch):
+        """测试调用AI期间不占用数据库连接，用户消息已提交"""
+        user = AuthService.register_user(db_session, UserCreate(
+            username="pooluser",
+            email="pooluser@example.com",
+            password="password123"
+        ))
+        conversation = ConversationService.create_conversation(db_session, user, ConversationCreate())
+        observed = {}
+        
+        async def fake_response(message, conversation_history=None, summary=None):
+            observed["checked_out"] = engine.pool.checkedout()
+            reader = TestingSessionLocal()
+            try:
+                observed["saved"] = reader.query(Message).filter(Message.conversation_id == conversation.id).count()
+            finally:
+                reader.close()
+            return "回复"
+        
+        monkeypatch.setattr(AIService, "get_ai_response", fake_response)
+        user_message, ai_message = asyncio.run(ConversationService.send_message(
+            db_session, user, conversation.id, MessageCreate(content="连接测试")
+        ))
+        
+        assert observed == {"checked_out": 0, "saved": 1}
+        assert ai_message.content == "回复"
+        assert db_session.get(Conversation, conversation.id).title == "连接测试"
+    
+    def test_versions_change_without_timestamp_change(self, db_session):
+        """测试同一时刻（updated_at相同）的改名和新增消息也会改变列表和消息的版本"""
+        user = AuthService.register_user(db_session, UserCreate(
+            username="versionuser",
+            email="versionuser@example.com",
+            password="password123"
+        ))
+        conversation = ConversationService.create_conversation(db_session, user, ConversationCreate())
+        frozen = conversation.updated_at
+        list_versions = [ConversationService.get_conversations_version(db_session, user)]
+        message_versions = [ConversationService.get_messages_version(db_session, user, conversation.id)]
+        
+        conversation.title = "改名"
+        conversation.updated_at = frozen
+        db_session.commit()
+        list_versions.append(ConversationService.get_conversations_version(db_session, user))
+        message_versions.append(ConversationService.get_messages_version(db_session, user, conversation.id))
+        
+        db_session.add(Message(conversation_id=conversation.id, role=MessageRole.USER, content="同一秒内"))
+        db_session.commit()
+        db_session.query(Conversation).filter(Conversation.id == conversation.id).update(
+            {Conversation.updated_at: frozen}, synchronize_session=False
+        )
+        db_session.commit()
+        list_versions.append(ConversationService.get_conversations_version(db_session, user))
+        message_versions.append(ConversationService.get_messages_version(db_session, user, conversation.id))
+        
+        assert len(set(list_versions)) == 3
+        assert len(set(message_versions)) == 3
+    
+    def test_send_message_overloaded(self, db_session, monkeypatch):
+        """测试排队超时时返回503和Retry-After，撤回用户消息，不保存错误文本作为回复"""
+        user = AuthService.register_user(db_session, UserCreate(
+            username="overloaduser",
+            email="overloaduser@example.com",
+            password="password123"
+        ))
+        conversation = ConversationService.create_conversation(db_session, user, ConversationCreate())
+        
+        async def overloaded(message, conversation_history=None, summary=None):
+            raise LimiterTimeout(30.0)
+        
+        monkeypatch.setattr(AIService, "get_ai_response", overloaded)
+        with pytest.raises(HTTPException) as error:
+            asyncio.run(ConversationService.send_message(db_session, user, conversation.id, MessageCreate(content="你好")))
+        assert error.value.status_code == 503
+        assert error.value.headers["Retry-After"] == "6"
+        assert db_session.query(Message).filter(Message.conversation_id == conversation.id).count() == 0
+    
     def test_get_conversation_messages(self, db_session, test_user, test_conversation):
         """测试获取对话消息"""
         # 先添加一些消息
@@ -461,5 +559,941 @@ class TestDataIntegrity:
         assert len(messages) == 0
 
 
+class TestSummaryService:
+    """滚动摘要测试"""
+    
+    def _create_conversation(self, db_session, username):
+        user = AuthService.register_user(db_session, UserCreate(
+            username=username,
+            email=f"{username}@example.com",
+            password="password123"
+        ))
+        return ConversationService.create_conversation(
+            db_session, user, ConversationCreate(title="摘要对话")
+        )
+    
+    def _add_messages(self, db_session, conversation, count):
+        for i in range(count):
+            db_session.add(Message(
+                conversation_id=conversation.id,
+                role=MessageRole.USER if i % 2 == 0 else MessageRole.ASSISTANT,
+                content=f"消息{i}" + "内容" * 20
+            ))
+        db_session.commit()
+    
+    def test_incremental_summary(self, db_session, monkeypatch):
+        """测试摘要只折叠新增的较早消息"""
+        monkeypatch.setattr(settings, "AI_SUMMARY_TRIGGER_TOKENS", 200)
+        monkeypatch.setattr(settings, "AI_SUMMARY_KEEP_TOKENS", 100)
+        calls = []
+        
+        async def fake_summarize(previous_summary, turns):
+            calls.append((previous_summary, turns))
+            return f"摘要{len(calls)}"
+        
+        monkeypatch.setattr(AIService, "summarize", fake_summarize)
+        conversation = self._create_conversation(db_session, "summaryuser")
+        self._add_messages(db_session, conversation, 10)
+        
+        summary = asyncio.run(SummaryService.update_summary(TestingSessionLocal, conversation.id))
+        
+        db_session.refresh(conversation)
+        assert summary == "摘要1"
+        assert conversation.summary == "摘要1"
+        first_folded = len(calls[0][1])
+        assert 0 < first_folded < 10
+        assert calls[0][0] is None
+        
+        # 未超过阈值时不重新摘要
+        assert asyncio.run(SummaryService.update_summary(TestingSessionLocal, conversation.id)) is None
+        
+        # 新增消息后只合并新的较早消息
+        self._add_messages(db_session, conversation, 10)
+        asyncio.run(SummaryService.update_summary(TestingSessionLocal, conversation.id))
+        
+        db_session.refresh(conversation)
+        assert conversation.summary == "摘要2"
+        assert calls[1][0] == "摘要1"
+        assert calls[1][1][0]["content"] == f"消息{first_folded}" + "内容" * 20
+    
+    def test_summary_prepended_to_prompt(self):
+        """测试摘要附加到系统提示之后"""
+        messages = ContextBuilder.build("问题", [], system_prompt="系统", summary="之前聊了天气")
+        
+        assert messages[0]["role"] == "system"
+        assert messages[0]["content"].startswith("系统")
+        assert "之前聊了天气" in messages[0]["content"]
+
+
+class TestResumableStream:
+    """可恢复事件流测试"""
+    
+    @staticmethod
+    def _event_ids(frames):
+        return [int(frame.split("\n")[0][4:]) for frame in frames if frame.startswith("id: ")]
+    
+    def test_ring_buffer_replay_and_gap(self):
+        """测试按Last-Event-ID重放，缓冲溢出时提示缺口"""
+        session = StreamSession(user_id=1, conversation_id=1, max_events=5, max_bytes=1 << 20)
+        for i in range(8):
+            session.publish({"type": "ai_chunk", "content": str(i)})
+        session.finish()
+        
+        async def collect(last_event_id):
+            return [frame async for frame in session.subscribe(last_event_id)]
+        
+        assert self._event_ids(asyncio.run(collect(6))) == [7, 8]
+        frames = asyncio.run(collect(0))
+        assert '"replay_gap"' in frames[0]
+        assert self._event_ids(frames) == [4, 5, 6, 7, 8]
+    
+    def test_registry_expiry(self):
+        """测试完成的流在TTL后清除，且只能由所属用户获取"""
+        registry = StreamRegistry(ttl=0.0, total_max_bytes=1 << 20)
+        active = registry.create(user_id=1, conversation_id=1)
+        finished = registry.create(user_id=1, conversation_id=1)
+        finished.finish()
+        
+        assert registry.get(active.id, user_id=2) is None
+        assert registry.get(active.id, user_id=1) is active
+        assert registry.get(finished.id, user_id=1) is None
+        assert registry.stats()["expired"] == 1
+    
+    @staticmethod
+    def _prepare(db_session, username, content):
+        user = AuthService.register_user(db_session, UserCreate(
+            username=username,
+            email=f"{username}@example.com",
+            password="password123"
+        ))
+        conversation = ConversationService.create_conversation(db_session, user, ConversationCreate())
+        user_message = Message(conversation_id=conversation.id, role=MessageRole.USER, content=content)
+        db_session.add(user_message)
+        db_session.commit()
+        db_session.refresh(user_message)
+        return user, conversation, user_message
+    
+    @staticmethod
+    def _slow_stream(state, pieces=10):
+        async def fake_stream(message, conversation_history=None, summary=None):
+            try:
+                for i in range(pieces):
+                    await asyncio.sleep(0.02)
+                    yield f"片段{i}"
+            finally:
+                state["closed"] = True
+        return fake_stream
+    
+    def _assistant_message(self, db_session, conversation):
+        return db_session.query(Message).filter(
+            Message.conversation_id == conversation.id,
+            Message.role == MessageRole.ASSISTANT
+        ).one_or_none()
+    
+    def test_generation_outlives_connection(self, db_session, monkeypatch):
+        """测试生成在后台任务中完成，重连后续传剩余事件"""
+        user, conversation, user_message = self._prepare(db_session, "streamuser", "续传测试")
+        
+        async def fake_stream(message, conversation_history=None, summary=None):
+            for piece in ["第一段", "第二段", "第三段"]:
+                await asyncio.sleep(0.01)
+                yield piece
+        
+        monkeypatch.setattr(AIService, "get_ai_response_stream", fake_stream)
+        
+        async def test_async():
+            stream = GenerationService.start(
+                TestingSessionLocal, user.id, conversation.id, user_message,
+                [user_message], None, first_turn=True, flush_interval=0
+            )
+            # 第一个连接读到首个分块后断开
+            first_connection = stream.subscribe()
+            received = []
+            async for frame in first_connection:
+                received.append(frame)
+                if '"ai_chunk"' in frame:
+                    break
+            await first_connection.aclose()
+            
+            await stream.task
+            resumed = [frame async for frame in stream.subscribe(self._event_ids(received)[-1])]
+            return received, resumed
+        
+        received, resumed = asyncio.run(test_async())
+        ids = self._event_ids(received) + self._event_ids(resumed)
+        assert ids == list(range(1, len(ids) + 1))
+        assert '"stream_start"' in received[0]
+        assert '"ai_complete"' in resumed[-2] and '"done"' in resumed[-1]
+        
+        db_session.refresh(conversation)
+        saved = self._assistant_message(db_session, conversation)
+        assert saved.content == "第一段第二段第三段"
+        assert saved.status == MessageStatus.COMPLETE.value
+        assert conversation.title == "续传测试"
+    
+    def test_circuit_open_retracts_user_message(self, db_session, monkeypatch):
+        """测试熔断中时发送错误事件，撤回已提交的用户消息并恢复对话统计"""
+        user, conversation, user_message = self._prepare(db_session, "streamcircuituser", "熔断测试")
+        user_message_id, conversation_id = user_message.id, conversation.id
+        db_session.refresh(conversation)
+        assert conversation.message_count == 1
+        
+        async def open_circuit(message, conversation_history=None, summary=None):
+            raise CircuitOpenError(2.0)
+            yield
+        
+        monkeypatch.setattr(AIService, "get_ai_response_stream", open_circuit)
+        
+        async def test_async():
+            stream = GenerationService.start(
+                TestingSessionLocal, user.id, conversation.id, user_message,
+                [user_message], None, first_turn=True, flush_interval=0
+            )
+            return [frame async for frame in stream.subscribe()]
+        
+        frames = asyncio.run(test_async())
+        assert any('"upstream_unavailable"' in frame for frame in frames)
+        assert '"done"' in frames[-1]
+        
+        db_session.expire_all()
+        assert db_session.query(Message).filter(Message.conversation_id == conversation_id).count() == 0
+        assert db_session.query(Message).filter(Message.id == user_message_id).one_or_none() is None
+        conversation = db_session.get(Conversation, conversation_id)
+        assert (conversation.message_count, conversation.last_message_preview) == (0, None)
+    
+    def test_checkpoints_partial_reply(self, db_session, monkeypatch):
+        """测试生成过程中AI消息以streaming状态追加写入，读者可看到部分回复"""
+        user, conversation, user_message = self._prepare(db_session, "checkpointuser", "检查点测试")
+        state = {"closed": False}
+        monkeypatch.setattr(AIService, "get_ai_response_stream", self._slow_stream(state, pieces=6))
+        monkeypatch.setattr(settings, "AI_CHECKPOINT_TOKENS", 3)
+        
+        async def test_async():
+            stream = GenerationService.start(
+                TestingSessionLocal, user.id, conversation.id, user_message,
+                [user_message], None, first_turn=True, flush_interval=0
+            )
+            partials = []
+            async for frame in stream.subscribe():
+                if '"ai_chunk"' in frame:
+                    reader = TestingSessionLocal()
+                    try:
+                        partial = self._assistant_message(reader, conversation)
+                        if partial is not None:
+                            partials.append((partial.status, partial.content))
+                    finally:
+                        reader.close()
+            return partials
+        
+        partials = asyncio.run(test_async())
+        # 订阅者可能落后于生成任务，最后几帧读到时消息已完成
+        assert partials[0] == (MessageStatus.STREAMING.value, "片段0")
+        assert all("片段0片段1片段2片段3片段4片段5".startswith(content) for _, content in partials)
+        
+        saved = self._assistant_message(db_session, conversation)
+        assert saved.status == MessageStatus.COMPLETE.value
+        assert saved.content == "片段0片段1片段2片段3片段4片段5"
+        # 多次追加写入后token数按完整内容计算
+        assert saved.token_count == count_tokens(saved.content)
+    
+    def test_checkpoint_replaced_on_error(self, db_session, monkeypatch):
+        """测试已写入检查点后上游出错时，消息内容改写为错误提示"""
+        user, conversation, user_message = self._prepare(db_session, "checkpointerror", "出错测试")
+        
+        async def failing_stream(message, conversation_history=None, summary=None):
+            yield "已生成的部分"
+            raise ValueError("上游中断")
+        
+        monkeypatch.setattr(AIService, "get_ai_response_stream", failing_stream)
+        monkeypatch.setattr(settings, "AI_CHECKPOINT_TOKENS", 1)
+        
+        async def test_async():
+            stream = GenerationService.start(
+                TestingSessionLocal, user.id, conversation.id, user_message,
+                [user_message], None, first_turn=True, flush_interval=0
+            )
+            return [frame async for frame in stream.subscribe()]
+        
+        asyncio.run(test_async())
+        saved = self._assistant_message(db_session, conversation)
+        assert saved.status == MessageStatus.COMPLETE.value
+        assert saved.content == "AI服务错误: 上游中断"
+        assert saved.token_count == count_tokens(saved.content)
+    
+    def test_recover_abandoned_streaming_messages(self, db_session):
+        """测试进程退出后遗留的streaming消息被标记为truncated，仍在写入的不受影响"""
+        user, abandoned, _ = self._prepare(db_session, "recoveruser", "中断的生成")
+        active = ConversationService.create_conversation(db_session, user, ConversationCreate())
+        for conversation in (abandoned, active):
+            message = Message(
+                conversation_id=conversation.id,
+                role=MessageRole.ASSISTANT,
+                content=RawText("部分"),
+                status=MessageStatus.STREAMING.value
+            )
+            db_session.add(message)
+            db_session.flush()
+            # 模拟检查点的批量追加（不经过校验器，token数停留在首次写入时）
+            db_session.query(Message).filter(Message.id == message.id).update(
+                {Message.content: Message.content + "回复的内容"},
+                synchronize_session=False
+            )
+        db_session.commit()
+        db_session.query(Conversation).filter(Conversation.id == abandoned.id).update(
+            {Conversation.updated_at: datetime.now(UTC) - timedelta(hours=1)},
+            synchronize_session=False
+        )
+        db_session.commit()
+        version = ConversationService.get_messages_version(db_session, user, abandoned.id)
+        
+        result = MaintenanceService.recover_streaming(db_session, older_than=600)
+        
+        assert result == {"recovered": 1, "conversations": 1}
+        db_session.expire_all()
+        recovered = self._assistant_message(db_session, abandoned)
+        assert recovered.status == MessageStatus.TRUNCATED.value
+        assert recovered.content == "部分回复的内容"
+        assert recovered.token_count == count_tokens("部分回复的内容")
+        assert self._assistant_message(db_session, active).status == MessageStatus.STREAMING.value
+        assert ConversationService.get_messages_version(db_session, user, abandoned.id) != version
+    
+    def test_stop_saves_truncated_message(self, db_session, monkeypatch):
+        """测试主动停止时取消上游并保存截断的回复"""
+        user, conversation, user_message = self._prepare(db_session, "stopuser", "停止测试")
+        state = {"closed": False}
+        monkeypatch.setattr(AIService, "get_ai_response_stream", self._slow_stream(state))
+        stopped_before = generation_stats.cancelled["stop"]
+        
+        async def test_async():
+            stream = GenerationService.start(
+                TestingSessionLocal, user.id, conversation.id, user_message,
+                [user_message], None, first_turn=True, flush_interval=0
+            )
+            frames = []
+            async for frame in stream.subscribe():
+                frames.append(frame)
+                if '"ai_chunk"' in frame:
+                    assert stream.cancel("stop") is True
+            return frames
+        
+        frames = asyncio.run(test_async())
+        assert '"truncated"' in frames[-2] and '"done"' in frames[-1]
+        assert state["closed"] is True
+        assert generation_stats.cancelled["stop"] == stopped_before + 1
+        
+        saved = self._assistant_message(db_session, conversation)
+        assert saved.status == MessageStatus.TRUNCATED.value
+        assert saved.content.startswith("片段0")
+        assert "片段9" not in saved.content
+    
+    def test_disconnect_cancels_after_grace(self, db_session, monkeypatch):
+        """测试所有客户端断开且宽限期内未重连时取消生成"""
+        user, conversation, user_message = self._prepare(db_session, "disconnectuser", "断开测试")
+        state = {"closed": False}
+        monkeypatch.setattr(AIService, "get_ai_response_stream", self._slow_stream(state, pieces=50))
+        monkeypatch.setattr(settings, "SSE_DISCONNECT_GRACE", 0.05)
+        
+        async def test_async():
+            stream = GenerationService.start(
+                TestingSessionLocal, user.id, conversation.id, user_message,
+                [user_message], None, first_turn=True, flush_interval=0
+            )
+            connection = stream.subscribe()
+            async for frame in connection:
+                if '"ai_chunk"' in frame:
+                    break
+            await connection.aclose()
+            await asyncio.wait_for(stream.task, timeout=0.5)
+            return stream
+        
+        stream = asyncio.run(test_async())
+        assert stream.cancel_reason == "disconnect"
+        assert state["closed"] is True
+        assert self._assistant_message(db_session, conversation).status == MessageStatus.TRUNCATED.value
+
+
 if __name__ == "__main__":
-    pytest.main([__file__]) 
\ No newline at end of file
+    pytest.main([__file__]) 
+
+class TestBatchService:
+    """测试批量提交"""
+    
+    def test_batch_preserves_order_and_bounds_concurrency(self, db_session, monkeypatch):
+        """测试同一对话内按顺序执行，并发不超过工作协程数"""
+        user = AuthService.register_user(db_session, UserCreate(
+            username="batchuser",
+            email="batchuser@example.com",
+            password="password123"
+        ))
+        conversations = [
+            ConversationService.create_conversation(db_session, user, ConversationCreate())
+            for _ in range(4)
+        ]
+        state = {"running": 0, "peak": 0}
+        
+        async def fake_response(message, conversation_history=None, summary=None):
+            state["running"] += 1
+            state["peak"] = max(state["peak"], state["running"])
+            await asyncio.sleep(0.01)
+            state["running"] -= 1
+            # 回复中带上之前的用户消息，用于验证同一对话的顺序
+            previous = [msg.content for msg in conversation_history if msg.role == MessageRole.USER]
+            return "|".join(previous)
+        
+        monkeypatch.setattr(AIService, "get_ai_response", fake_response)
+        monkeypatch.setattr(batch_registry, "concurrency", 2)
+        items = [
+            (conversation.id, f"问题{turn}")
+            for turn in range(3)
+            for conversation in conversations
+        ]
+        
+        async def test_async():
+            job = BatchService.submit(TestingSessionLocal, user.id, items)
+            assert job.status == "queued"
+            await asyncio.wait_for(job.tasks[-1], timeout=5)
+            return job
+        
+        job = asyncio.run(test_async())
+        assert job.status == "completed"
+        assert job.counts()["succeeded"] == len(items)
+        assert state["peak"] == 2
+        
+        last_turn = [item for item in job.items if item.content == "问题2"]
+        assert all(item.reply == "问题0|问题1" for item in last_turn)
+        assert db_session.query(Message).filter(
+            Message.conversation_id == conversations[0].id
+        ).count() == 6
+        assert job.created_at.tzinfo is not None and job.finished_at >= job.created_at
+    
+    def test_concurrency_shared_across_jobs(self, db_session, monkeypatch):
+        """测试同时提交的多个任务共享并发名额"""
+        user = AuthService.register_user(db_session, UserCreate(
+            username="batchshareduser",
+            email="batchshareduser@example.com",
+            password="password123"
+        ))
+        conversations = [
+            ConversationService.create_conversation(db_session, user, ConversationCreate())
+            for _ in range(4)
+        ]
+        state = {"running": 0, "peak": 0}
+        
+        async def fake_response(message, conversation_history=None, summary=None):
+            state["running"] += 1
+            state["peak"] = max(state["peak"], state["running"])
+            await asyncio.sleep(0.01)
+            state["running"] -= 1
+            return "回复"
+        
+        monkeypatch.setattr(AIService, "get_ai_response", fake_response)
+        monkeypatch.setattr(batch_registry, "concurrency", 2)
+        
+        async def test_async():
+            jobs = [
+                BatchService.submit(TestingSessionLocal, user.id, [(conversation.id, "问题") for conversation in pair])
+                for pair in (conversations[:2], conversations[2:])
+            ]
+            await asyncio.wait_for(asyncio.gather(*(job.tasks[-1] for job in jobs)), timeout=5)
+            return jobs
+        
+        jobs = asyncio.run(test_async())
+        assert all(job.counts()["succeeded"] == 2 for job in jobs)
+        assert state["peak"] == 2
+    
+    @staticmethod
+    def _prepare(db_session, username):
+        user = AuthService.register_user(db_session, UserCreate(
+            username=username,
+            email=f"{username}@example.com",
+            password="password123"
+        ))
+        return user, ConversationService.create_conversation(db_session, user, ConversationCreate())
+    
+    def test_batch_retries_when_circuit_open(self, db_session, monkeypatch):
+        """测试上游熔断时按Retry-After重试，重试耗尽后条目失败"""
+        test_user, test_conversation = self._prepare(db_session, "batchretryuser")
+        calls = []
+        
+        async def failing_response(message, conversation_history=None, summary=None):
+            calls.append(message)
+            raise CircuitOpenError(0.0)
+        
+        monkeypatch.setattr(AIService, "get_ai_response", failing_response)
+        monkeypatch.setattr(settings, "BATCH_ITEM_RETRIES", 1)
+        
+        async def test_async():
+            job = BatchService.submit(TestingSessionLocal, test_user.id, [(test_conversation.id, "熔断")])
+            await asyncio.wait_for(job.tasks[-1], timeout=5)
+            return job
+        
+        job = asyncio.run(test_async())
+        item = job.items[0]
+        assert item.status == BatchItemStatus.FAILED
+        assert item.attempts == 2 and len(calls) == 2
+        assert item.error
+        # 失败的条目不留下用户消息
+        assert db_session.query(Message).filter(Message.conversation_id == test_conversation.id).count() == 0
+    
+    def test_check_conversations_ownership(self, db_session):
+        """测试提交他人或不存在的对话时返回404"""
+        test_user, test_conversation = self._prepare(db_session, "batchowner")
+        other_user, other_conversation = self._prepare(db_session, "batchother")
+        BatchService.check_conversations(db_session, test_user, {test_conversation.id})
+        with pytest.raises(HTTPException) as exc_info:
+            BatchService.check_conversations(db_session, test_user, {test_conversation.id, other_conversation.id})
+        assert exc_info.value.status_code == 404
+        assert str(other_conversation.id) in exc_info.value.detail
+
+
+class TestConnectionPool:
+    """测试连接池取连接等待统计"""
+    
+    def test_checkout_wait_stats(self, tmp_path):
+        pool_engine = create_engine(
+            f"sqlite:///{tmp_path / 'pool.db'}",
+            poolclass=TimedQueuePool,
+            pool_size=1,
+            max_overflow=0,
+            pool_timeout=0.05
+        )
+        try:
+            held = pool_engine.connect()
+            with pytest.raises(SQLAlchemyTimeoutError):
+                pool_engine.connect()
+            held.close()
+            with pool_engine.connect():
+                pass
+            
+            stats = pool_engine.pool.stats()
+            assert stats["checkouts"] == 3
+            assert stats["timeouts"] == 1
+            assert stats["checked_out"] == 0
+            assert stats["max_wait_ms"] >= 50
+        finally:
+            pool_engine.dispose()
+
+
+class TestSchemaUpgrade:
+    """测试已有表的结构升级（由 manage.py migrate 执行）"""
+    
+    def test_upgrade_adds_missing_columns_and_indexes(self, tmp_path):
+        old_engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+        try:
+            Base.metadata.create_all(bind=old_engine)
+            with old_engine.begin() as conn:
+                conn.exec_driver_sql("DROP INDEX ix_messages_conversation_created")
+                conn.exec_driver_sql("ALTER TABLE messages DROP COLUMN search_text")
+            
+            pending = pending_schema_changes(old_engine)
+            assert pending == ["+ messages.search_text", "+ messages.ix_messages_conversation_created"]
+            # 只检查不执行
+            assert pending_schema_changes(old_engine) == pending
+            
+            assert upgrade_schema(old_engine) == pending
+            assert pending_schema_changes(old_engine) == []
+            assert upgrade_schema(old_engine) == []
+        finally:
+            old_engine.dispose()
+
+
+class TestProcessLock:
+    """测试单进程运行的文件锁"""
+    
+    def test_second_process_refused(self, tmp_path):
+        path = str(tmp_path / "worker.lock")
+        first, second = ProcessLock(path), ProcessLock(path)
+        first.acquire()
+        try:
+            with pytest.raises(RuntimeError, match="单个worker"):
+                second.acquire()
+            assert not second.held
+        finally:
+            first.release()
+        
+        second.acquire()
+        assert second.held
+        second.release()
+    
+    def test_disabled_without_path(self):
+        lock = ProcessLock("")
+        lock.acquire()
+        assert not lock.held
+
+
+class TestKeysetPagination:
+    """测试游标分页"""
+    
+    @staticmethod
+    def _walk(fetch, cursor=None, forward=True):
+        """沿一个方向翻页直到没有游标，返回每页的ID"""
+        pages = []
+        while True:
+            page = fetch(cursor)
+            pages.append([item.id for item in page.items])
+            cursor = page.next_cursor if forward else page.prev_cursor
+            if cursor is None:
+                return pages, page
+    
+    def test_messages_both_directions(self, db_session):
+        """测试消息按(created_at, id)双向翻页，时间相同的消息不重复不遗漏"""
+        user = AuthService.register_user(db_session, UserCreate(
+            username="cursoruser",
+            email="cursoruser@example.com",
+            password="password123"
+        ))
+        conversation = ConversationService.create_conversation(db_session, user, ConversationCreate())
+        same_time = datetime(2024, 1, 1, 12, 0, 0)
+        for index in range(8):
+            created_at = same_time if 2 <= index <= 5 else same_time + timedelta(minutes=index - 3)
+            db_session.add(Message(
+                conversation_id=conversation.id,
+                role=MessageRole.USER,
+                content=f"消息{index}",
+                created_at=created_at
+            ))
+        db_session.commit()
+        expected = [
+            message.id for message in db_session.query(Message).filter(
+                Message.conversation_id == conversation.id
+            ).order_by(Message.created_at, Message.id)
+        ]
+        
+        def fetch(cursor):
+            return ConversationService.get_conversation_messages_page(db_session, user, conversation.id, 3, cursor)
+        
+        pages, last_page = self._walk(fetch)
+        assert pages == [expected[0:3], expected[3:6], expected[6:8]]
+        assert fetch(None).prev_cursor is None
+        
+        backward, first_page = self._walk(fetch, last_page.prev_cursor, forward=False)
+        assert backward == [expected[3:6], expected[0:3]]
+        assert first_page.prev_cursor is None and first_page.next_cursor is not None
+    
+    def test_conversations_descending(self, db_session):
+        """测试对话列表按(updated_at, id)倒序翻页"""
+        user = AuthService.register_user(db_session, UserCreate(
+            username="cursorlist",
+            email="cursorlist@example.com",
+            password="password123"
+        ))
+        conversations = [
+            ConversationService.create_conversation(db_session, user, ConversationCreate(title=f"对话{i}"))
+            for i in range(5)
+        ]
+        db_session.add(Message(conversation_id=conversations[0].id, role=MessageRole.USER, content="你好"))
+        for conversation in conversations:
+            conversation.updated_at = datetime(2024, 1, 1)
+        conversations[0].updated_at = datetime(2024, 1, 2)
+        db_session.commit()
+        
+        def fetch(cursor):
+            return ConversationService.get_user_conversations_page(db_session, user, 2, cursor)
+        
+        pages, _ = self._walk(fetch)
+        ids = [conversation.id for conversation in conversations]
+        assert pages == [[ids[0], ids[4]], [ids[3], ids[2]], [ids[1]]]
+        assert fetch(None).items[0].message_count == 1
+    
+    def test_invalid_cursor(self):
+        """测试无效游标返回400"""
+        with pytest.raises(HTTPException) as exc_info:
+            decode_cursor("not-a-cursor", (Message.created_at, Message.id))
+        assert exc_info.value.status_code == 400
+
+
+class TestPageCache:
+    def test_byte_bound_eviction(self):
+        """测试按正文总字节数淘汰最久未使用的条目，超过容量的单个响应不缓存"""
+        cache = PageCache(max_bytes=100)
+        cache.set(("a",), CachedPage(b"x" * 40, "application/json", {}))
+        cache.set(("b",), CachedPage(b"x" * 40, "application/json", {}))
+        assert cache.get(("a",)) is not None
+        cache.set(("c",), CachedPage(b"x" * 40, "application/json", {}))
+        assert cache.get(("b",)) is None
+        assert cache.get(("a",)) is not None and cache.bytes == 80
+        cache.set(("d",), CachedPage(b"x" * 101, "application/json", {}))
+        assert cache.get(("d",)) is None and cache.stats()["evictions"] == 1
+    
+    def test_etag_matching(self):
+        """测试If-None-Match的列表、弱前缀和*匹配"""
+        etag = PageCache.make_etag((1, "messages", ("v", 2)))
+        assert PageCache.etag_matches(f'"other", {etag}', etag)
+        assert PageCache.etag_matches(f"W/{etag}", etag)
+        assert PageCache.etag_matches("*", etag)
+        assert not PageCache.etag_matches(None, etag)
+        assert etag != PageCache.make_etag((1, "messages", ("v", 3)))
+
+
+class TestArchiveService:
+    def test_lines_split_across_chunks(self):
+        """测试gzip请求体被切成任意小块时仍能正确解压和分行，超长行被拒绝"""
+        payload = "\n".join(f'{{"n": {i}, "text": "第{i}行"}}' for i in range(50)).encode("utf-8")
+        compressed = gzip.compress(payload)
+        
+        async def chunks(data, size):
+            for start in range(0, len(data), size):
+                yield data[start:start + size]
+        
+        async def collect(data, size):
+            return [line async for line in ArchiveService._lines(chunks(data, size))]
+        
+        expected = list(enumerate(payload.split(b"\n"), start=1))
+        assert asyncio.run(collect(compressed, 1)) == expected
+        assert asyncio.run(collect(payload, 7)) == expected
+        
+        original = settings.IMPORT_MAX_LINE_BYTES
+        settings.IMPORT_MAX_LINE_BYTES = 10
+        try:
+            with pytest.raises(HTTPException) as exc_info:
+                asyncio.run(collect(payload, 64))
+            assert exc_info.value.status_code == 400
+        finally:
+            settings.IMPORT_MAX_LINE_BYTES = original
+    
+    def test_gzip_bomb_inflated_in_bounded_pieces(self, monkeypatch):
+        """测试高压缩比的gzip数据分段解压，超过行长上限时在展开全部内容之前拒绝"""
+        bomb = gzip.compress(b"a" * (16 * 1024 * 1024))
+        monkeypatch.setattr(settings, "IMPORT_MAX_LINE_BYTES", 4096)
+        inflate = ArchiveService._inflate
+        pieces = []
+        
+        def recording_inflate(decompressor, data):
+            for piece in inflate(decompressor, data):
+                pieces.append(len(piece))
+                yield piece
+        
+        monkeypatch.setattr(ArchiveService, "_inflate", staticmethod(recording_inflate))
+        
+        async def collect():
+            async def chunks():
+                yield bomb
+            return [line async for line in ArchiveService._lines(chunks())]
+        
+        with pytest.raises(HTTPException) as exc_info:
+            asyncio.run(collect())
+        assert exc_info.value.status_code == 400
+        assert max(pieces) <= 4096
+        assert sum(pieces) < 16 * 4096
+
+
+class TestSearchIndex:
+    """进程内检索索引测试"""
+    
+    def test_tokenize_cjk_bigrams(self):
+        """测试CJK按相邻两字切分，字母数字按小写单词"""
+        assert tokenize("全文检索 MySQL8") == ["全文", "文检", "检索", "mysql8"]
+        assert search_terms("检索， 检索 Index") == ["检索", "index"]
+    
+    def test_rank_requires_all_terms(self):
+        """测试排序只返回包含全部检索词的消息，词频高的排在前面，可按对话过滤"""
+        index = UserIndex()
+        index.add(1, 10, "全文检索")
+        index.add(2, 10, "全文检索和全文索引")
+        index.add(3, 20, "这一段比较长的话里只出现了一次全文")
+        ranked = index.rank(["全文", "索引"])
+        assert [message_id for _, message_id in ranked] == [2]
+        ranked = index.rank(["全文"])
+        assert [message_id for _, message_id in ranked][0] == 2
+        assert {message_id for _, message_id in ranked} == {1, 2, 3}
+        assert [message_id for _, message_id in index.rank(["全文"], conversation_id=20)] == [3]
+        
+        index.discard(2)
+        assert [message_id for _, message_id in index.rank(["索引"])] == []
+    
+    def test_snippet_highlights(self):
+        """测试片段截取到命中词附近，高亮偏移对应片段中的位置"""
+        content = "开头" * 50 + "命中的Keyword在这里"
+        snippet, highlights = make_snippet(content, ["keyword"], 20)
+        assert snippet.startswith("…")
+        start, end = highlights[0]
+        assert snippet[start:end] == "Keyword"
+
+
+class TestMessageCompression:
+    """消息内容透明压缩测试"""
+    
+    LONG_TEXT = "较长的助手回复会被压缩保存。Long replies are stored compressed. " * 40
+    
+    @staticmethod
+    def _search_text(db_session, message_id):
+        return db_session.execute(select(Message.search_text).where(Message.id == message_id)).scalar_one()
+    
+    @staticmethod
+    def _stored(db_session, message_id):
+        """读取列中的存储形式（不经过解码）"""
+        return db_session.execute(
+            select(type_coerce(Message.content, Text)).where(Message.id == message_id)
+        ).scalar_one()
+    
+    def test_encode_decode(self):
+        """测试达到阈值的内容压缩、短内容和未压缩的旧数据原样保存，以标记开头的原文被转义"""
+        stored = encode(self.LONG_TEXT, ZLIB, min_bytes=100)
+        assert is_compressed(stored) and len(stored) < len(self.LONG_TEXT)
+        assert decode(stored) == self.LONG_TEXT
+        assert encode("短内容", ZLIB, min_bytes=100) == "短内容"
+        assert encode(self.LONG_TEXT, None) == self.LONG_TEXT
+        assert encode(RawText(self.LONG_TEXT), ZLIB, min_bytes=100) == self.LONG_TEXT
+        assert decode("压缩前写入的旧数据") == "压缩前写入的旧数据"
+        
+        lookalike = "\x1fz:不是压缩内容"
+        assert not is_compressed(encode(lookalike, ZLIB, min_bytes=100))
+        assert decode(encode(lookalike, ZLIB, min_bytes=100)) == lookalike
+    
+    def test_checkpointed_reply_compressed_when_finished(self, db_session, monkeypatch):
+        """测试生成中的消息以原文追加写入，完成后整体压缩保存"""
+        user, conversation, user_message = TestResumableStream._prepare(db_session, "compressuser", "压缩测试")
+        
+        async def fake_stream(message, conversation_history=None, summary=None):
+            for i in range(6):
+                yield f"第{i}段回复的内容。" * 5
+        
+        monkeypatch.setattr(AIService, "get_ai_response_stream", fake_stream)
+        monkeypatch.setattr(settings, "AI_CHECKPOINT_TOKENS", 3)
+        monkeypatch.setattr(settings, "MESSAGE_COMPRESSION", "zlib")
+        monkeypatch.setattr(settings, "MESSAGE_COMPRESSION_MIN_BYTES", 100)
+        
+        async def test_async():
+            stream = GenerationService.start(
+                TestingSessionLocal, user.id, conversation.id, user_message,
+                [user_message], None, first_turn=True, flush_interval=0
+            )
+            return [frame async for frame in stream.subscribe()]
+        
+        asyncio.run(test_async())
+        saved = db_session.query(Message).filter(
+            Message.conversation_id == conversation.id,
+            Message.role == MessageRole.ASSISTANT
+        ).one()
+        assert saved.content == "".join(f"第{i}段回复的内容。" * 5 for i in range(6))
+        assert is_compressed(self._stored(db_session, saved.id))
+        # 检索用的原文随检查点追加，不压缩
+        assert self._search_text(db_session, saved.id) == saved.content
+        assert not is_compressed(self._stored(db_session, user_message.id))
+    
+    def test_compressed_message_searchable(self, db_session, monkeypatch):
+        """测试压缩保存的消息仍能被检索到，全文索引使用的原文列不压缩"""
+        monkeypatch.setattr(settings, "MESSAGE_COMPRESSION", "zlib")
+        monkeypatch.setattr(settings, "MESSAGE_COMPRESSION_MIN_BYTES", 100)
+        user, conversation, _ = TestResumableStream._prepare(db_session, "compresssearch", "检索前的提问")
+        message = Message(
+            conversation_id=conversation.id,
+            role=MessageRole.ASSISTANT,
+            content=self.LONG_TEXT + "这里提到了向量数据库。"
+        )
+        db_session.add(message)
+        db_session.commit()
+        assert is_compressed(self._stored(db_session, message.id))
+        assert self._search_text(db_session, message.id) == self.LONG_TEXT + "这里提到了向量数据库。"
+        
+        page = SearchService.search(db_session, user, "向量数据库")
+        assert [hit["message_id"] for hit in page.items] == [message.id]
+        assert "向量数据库" in page.items[0]["snippet"]
+    
+    def test_fill_search_text(self, db_session, monkeypatch):
+        """测试为升级前写入的消息回填检索原文（压缩的内容按解码后的原文回填）"""
+        monkeypatch.setattr(settings, "MESSAGE_COMPRESSION", "zlib")
+        monkeypatch.setattr(settings, "MESSAGE_COMPRESSION_MIN_BYTES", 100)
+        _, conversation, user_message = TestResumableStream._prepare(db_session, "searchfilluser", "回填原文")
+        message = Message(conversation_id=conversation.id, role=MessageRole.ASSISTANT, content=self.LONG_TEXT)
+        db_session.add(message)
+        db_session.commit()
+        db_session.query(Message).filter(Message.conversation_id == conversation.id).update(
+            {Message.search_text: None},
+            synchronize_session=False
+        )
+        db_session.commit()
+        
+        assert MaintenanceService.fill_search_text(db_session, batch_size=1)["filled"] >= 2
+        assert self._search_text(db_session, message.id) == self.LONG_TEXT
+        assert self._search_text(db_session, user_message.id) == "回填原文"
+        assert MaintenanceService.fill_search_text(db_session)["filled"] == 0
+    
+    def test_backfill_compress_and_restore(self, db_session, monkeypatch):
+        """测试分批改写已有消息为压缩存储，读取结果不变，可再还原为原文"""
+        _, conversation, _ = TestResumableStream._prepare(db_session, "backfilluser", "回填测试")
+        message = Message(conversation_id=conversation.id, role=MessageRole.ASSISTANT, content=self.LONG_TEXT)
+        db_session.add(message)
+        db_session.commit()
+        assert self._stored(db_session, message.id) == self.LONG_TEXT
+        monkeypatch.setattr(settings, "MESSAGE_COMPRESSION_MIN_BYTES", 100)
+        
+        result = MaintenanceService.compress_messages(db_session, batch_size=2, codec="zlib")
+        assert result["rewritten"] >= 1 and result["bytes_after"] < result["bytes_before"]
+        assert is_compressed(self._stored(db_session, message.id))
+        db_session.expire_all()
+        assert db_session.get(Message, message.id).content == self.LONG_TEXT
+        # 已压缩的行再次运行时不再改写
+        assert MaintenanceService.compress_messages(db_session, batch_size=2, codec="zlib")["rewritten"] == 0
+        
+        MaintenanceService.compress_messages(db_session, batch_size=2, decompress=True)
+        assert self._stored(db_session, message.id) == self.LONG_TEXT
+
+
+class TestConversationStats:
+    """对话消息统计（消息数、最后一条消息）测试"""
+    
+    def test_stats_maintained_on_send(self, db_session, monkeypatch):
+        """测试发送消息时在同一事务中更新消息数和预览，熔断撤回用户消息后恢复"""
+        user = AuthService.register_user(db_session, UserCreate(
+            username="statsuser",
+            email="statsuser@example.com",
+            password="password123"
+        ))
+        conversation = ConversationService.create_conversation(db_session, user, ConversationCreate())
+        assert conversation.message_count == 0 and conversation.last_message_preview is None
+        
+        async def fake_response(message, conversation_history=None, summary=None):
+            return "第一行\n\n第二行  " + "很长的回复" * 50
+        
+        monkeypatch.setattr(AIService, "get_ai_response", fake_response)
+        asyncio.run(ConversationService.send_message(db_session, user, conversation.id, MessageCreate(content="你好")))
+        db_session.refresh(conversation)
+        assert conversation.message_count == 2
+        assert conversation.last_message_preview.startswith("第一行 第二行 很长的回复")
+        assert len(conversation.last_message_preview) == 100
+        last_message_at = conversation.last_message_at
+        
+        async def open_circuit(message, conversation_history=None, summary=None):
+            raise CircuitOpenError(1.0)
+        
+        monkeypatch.setattr(AIService, "get_ai_response", open_circuit)
+        with pytest.raises(HTTPException):
+            asyncio.run(ConversationService.send_message(db_session, user, conversation.id, MessageCreate(content="重试")))
+        db_session.refresh(conversation)
+        assert conversation.message_count == 2
+        assert conversation.last_message_at == last_message_at
+        assert conversation.last_message_preview.startswith("第一行")
+    
+    def test_repair_conversations(self, db_session):
+        """测试修复命令按消息表重新计算统计，不改变对话的更新时间但改变列表版本"""
+        user = AuthService.register_user(db_session, UserCreate(
+            username="repairuser",
+            email="repairuser@example.com",
+            password="password123"
+        ))
+        conversation = ConversationService.create_conversation(db_session, user, ConversationCreate())
+        empty = ConversationService.create_conversation(db_session, user, ConversationCreate())
+        for content in ["问题", "回答"]:
+            db_session.add(Message(conversation_id=conversation.id, role=MessageRole.USER, content=content))
+        db_session.commit()
+        
+        db_session.query(Conversation).filter(Conversation.id.in_([conversation.id, empty.id])).update(
+            {Conversation.message_count: 7, Conversation.last_message_preview: "过期的预览"},
+            synchronize_session=False
+        )
+        db_session.commit()
+        db_session.refresh(conversation)
+        updated_at = conversation.updated_at
+        list_version = ConversationService.get_conversations_version(db_session, user)
+        messages_version = ConversationService.get_messages_version(db_session, user, conversation.id)
+        
+        result = MaintenanceService.repair_conversations(db_session, batch_size=1)
+        assert result["repaired"] >= 2
+        assert ConversationService.get_conversations_version(db_session, user) != list_version
+        assert ConversationService.get_messages_version(db_session, user, conversation.id) != messages_version
+        db_session.refresh(conversation)
+        db_session.refresh(empty)
+        assert (conversation.message_count, conversation.last_message_preview) == (2, "回答")
+        assert conversation.updated_at == updated_at
+        assert (empty.message_count, empty.last_message_preview, empty.last_message_at) == (0, None, None)
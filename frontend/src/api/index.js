@@ -125,62 +125,95 @@ export const conversationAPI = {
     return api.post(`/conversations/${conversationId}/messages`, data)
   },
   
-  // 发送流式消息
-  sendMessageStream(conversationId, data, onMessage) {
-    return new Promise((resolve, reject) => {
-      const eventSource = new EventSource(`/api/conversations/${conversationId}/messages/stream`, {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-          'Authorization': `Bearer ${localStorage.getItem('token')}`
-        },
-        body: JSON.stringify(data)
-      })
+  // 停止正在进行的AI回复生成
+  stopMessageStream(conversationId, streamId) {
+    return api.post(`/conversations/${conversationId}/messages/stream/${streamId}/stop`)
+  },
+  
+  // 发送流式消息（断线后凭Last-Event-ID续传，不重新生成）
+  async sendMessageStream(conversationId, data, onMessage) {
+    const streamUrl = `/api/conversations/${conversationId}/messages/stream`
+    const authHeaders = () => ({ 'Authorization': `Bearer ${localStorage.getItem('token')}` })
+    let streamId = null
+    let lastEventId = 0
+    let finished = false
+    
+    // 注意：EventSource 不支持 POST 请求，我们需要使用 fetch 和 ReadableStream
+    const consume = async (response) => {
+      if (!response.ok) {
+        const error = new Error(`HTTP error! status: ${response.status}`)
+        error.status = response.status
+        throw error
+      }
+      streamId = response.headers.get('X-Stream-ID') || streamId
       
-      // 注意：EventSource 不支持 POST 请求，我们需要使用 fetch 和 ReadableStream
-      fetch(`/api/conversations/${conversationId}/messages/stream`, {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-          'Authorization': `Bearer ${localStorage.getItem('token')}`
-        },
-        body: JSON.stringify(data)
-      }).then(response => {
-        if (!response.ok) {
-          throw new Error(`HTTP error! status: ${response.status}`)
+      const reader = response.body.getReader()
+      const decoder = new TextDecoder()
+      // 合并后的帧可能跨越多次读取，未完整的行留到下次处理
+      let buffer = ''
+      
+      while (true) {
+        const { done, value } = await reader.read()
+        if (done) {
+          return
         }
         
-        const reader = response.body.getReader()
-        const decoder = new TextDecoder()
+        buffer += decoder.decode(value, { stream: true })
+        const lines = buffer.split('\n')
+        buffer = lines.pop()
         
-        function readStream() {
-          return reader.read().then(({ done, value }) => {
-            if (done) {
-              resolve()
-              return
-            }
-            
-            const chunk = decoder.decode(value)
-            const lines = chunk.split('\n')
-            
-            for (const line of lines) {
-              if (line.startsWith('data: ')) {
-                try {
-                  const data = JSON.parse(line.slice(6))
-                  onMessage(data)
-                } catch (e) {
-                  console.error('解析SSE数据失败:', e)
-                }
+        for (const line of lines) {
+          if (line.startsWith('id: ')) {
+            lastEventId = parseInt(line.slice(4), 10)
+          } else if (line.startsWith('data: ')) {
+            try {
+              const event = JSON.parse(line.slice(6))
+              if (event.type === 'stream_start') {
+                streamId = event.stream_id
+              } else if (event.type === 'done') {
+                finished = true
               }
+              onMessage(event)
+            } catch (e) {
+              console.error('解析SSE数据失败:', e)
             }
-            
-            return readStream()
-          })
+          }
         }
-        
-        return readStream()
-      }).catch(reject)
-    })
+      }
+    }
+    
+    try {
+      await consume(await fetch(streamUrl, {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/json',
+          ...authHeaders()
+        },
+        body: JSON.stringify(data)
+      }))
+    } catch (error) {
+      if (!streamId) {
+        throw error
+      }
+    }
+    
+    // 连接中断但服务端仍在生成时，从最后收到的事件之后续传
+    for (let attempt = 1; !finished && streamId && attempt <= 5; attempt++) {
+      await new Promise(resolve => setTimeout(resolve, 1000 * attempt))
+      try {
+        await consume(await fetch(`${streamUrl}/${streamId}`, {
+          headers: {
+            ...authHeaders(),
+            'Last-Event-ID': String(lastEventId)
+          }
+        }))
+      } catch (error) {
+        console.error('续传AI回复失败:', error)
+        if (error.status === 404) {
+          break
+        }
+      }
+    }
   }
 }
 